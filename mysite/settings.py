@@ -85,6 +85,8 @@ SOCIALACCOUNT_PROVIDERS = {
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # After WhiteNoise so static files aren't timed, before everything else so sessions and auth are
+    'users.timing.ServerTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,7 +100,8 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with rendering time counted for the Server-Timing header
+        'BACKEND': 'users.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -107,6 +110,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.context_processors.nav_badges',
             ],
         },
     },
@@ -115,6 +119,35 @@ TEMPLATES = [
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 ASGI_APPLICATION = 'mysite.asgi.application'
+
+# Channel layer used to push project chat messages to websockets. Redis is shared
+# by every daphne worker, the in-memory layer only works inside one process.
+if os.getenv('REDIS_URL') and not os.getenv('TESTING'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.getenv('REDIS_URL')],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Shared by every process, so invalidating a cached value (badge counts, presigned
+# URLs) takes effect everywhere. The local memory default is per process.
+if os.getenv('REDIS_URL') and not os.getenv('TESTING'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+    }
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -203,9 +236,38 @@ AWS_S3_SIGNATURE_NAME = os.getenv('AWS_S3_SIGNATURE_NAME')
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
 # AWS_DEFAULT_ACL = 'public-read'
 AWS_S3_VERITY = True
-
-# Use S3 as the default file storage backend
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Size of the HTTP connection pool of each shared boto3 client (see users/aws.py)
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '25'))
+# Largest file a browser may upload straight to S3, 5 GB is the most a single POST can carry
+MAX_DIRECT_UPLOAD_SIZE = int(os.getenv('MAX_DIRECT_UPLOAD_SIZE', str(5 * 1024 ** 3)))
+
+# Where uploaded files are kept (see users/storage.py): 's3' in production, or 'local' to
+# keep them under LOCAL_STORAGE_ROOT for development, load tests and working without AWS
+FILE_STORAGE_BACKEND = os.getenv('FILE_STORAGE_BACKEND', 's3')
+LOCAL_STORAGE_ROOT = os.getenv('LOCAL_STORAGE_ROOT', str(BASE_DIR / 'local_storage'))
+
+# FileFields are stored through the same backend
+DEFAULT_FILE_STORAGE = 'users.storage.BackendFileStorage'
+
+# Send the Server-Timing header (see users/timing.py) to every client, not only staff
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', '').lower() in ('1', 'true')
+
+# Per-request timing lines go to the console, tests only show warnings
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'users': {
+            'handlers': ['console'],
+            'level': 'WARNING' if os.getenv('TESTING') else 'INFO',
+        },
+    },
+}
 
 # Make files publicly accessible
 AWS_QUERYSTRING_AUTH = False
@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import Upload  
+from .models import StoragePurge, Upload
 
 @admin.register(Upload)
 class UploadAdmin(admin.ModelAdmin):
     list_display = ('name', 'file')  
-    search_fields = ('name',)  
\ No newline at end of file
+    search_fields = ('name',)
+
+@admin.register(StoragePurge)
+class StoragePurgeAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'status', 'objects_deleted', 'attempts', 'updated_at')
+    list_filter = ('status',)
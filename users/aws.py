@@ -0,0 +1,65 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from mysite.settings import AWS_S3_REGION_NAME, AWS_MAX_POOL_CONNECTIONS
+from .timing import register_aws_timing
+
+# Shared by every client we build. boto3 clients are thread safe once created, so
+# one client per service per process is enough for both gunicorn (threads or
+# processes) and daphne (sync views run in a thread pool).
+CLIENT_CONFIG = Config(
+    region_name=AWS_S3_REGION_NAME,
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,  # keep idle pooled connections to AWS open
+    connect_timeout=5,
+    read_timeout=60,
+    retries={'max_attempts': 5, 'mode': 'standard'},
+)
+
+_clients = {}
+_clients_pid = None
+_lock = threading.Lock()
+
+
+def get_client(service_name):
+    """
+    Return the process-wide boto3 client for an AWS service, creating it on first use.
+
+    Building a client takes tens of milliseconds and each one owns its own HTTP
+    connection pool, so views should always go through this instead of boto3.client().
+    """
+    global _clients_pid
+    client = _clients.get(service_name)
+    if client is not None and _clients_pid == os.getpid():
+        return client
+
+    with _lock:
+        # Connection pools must not be shared with a parent process (gunicorn --preload)
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(service_name)
+        if client is None:
+            # boto3.client() uses the default session, which is not safe to share
+            # across threads while it is building clients
+            client = boto3.session.Session().client(service_name, config=CLIENT_CONFIG)
+            register_aws_timing(client)
+            _clients[service_name] = client
+    return client
+
+
+def get_s3_client():
+    return get_client('s3')
+
+
+def get_transcribe_client():
+    return get_client('transcribe')
+
+
+def reset_clients():
+    # Drop cached clients, e.g. after credentials change
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import JoinRequest, ProjectInvitation
+
+# Writes through the invitation and join request paths invalidate the counts once they
+# commit; the timeout only bounds the damage of a write that skips them
+BADGE_CACHE_TIMEOUT = 300  # 5 minutes
+
+NO_BADGES = {'pending_invites': 0, 'pending_join_requests': 0}
+
+
+def _cache_key(user_id):
+    return f'badges:{user_id}'
+
+
+def badge_counts(user):
+    """
+    Navbar badge counts for ``user``: pending invitations they received and pending
+    join requests on projects they own.
+
+    Like users.roles.user_is_pma_admin, the counts are remembered on the user object
+    for the rest of the request and cached between requests.
+    """
+    if not user.is_authenticated:
+        return NO_BADGES
+    if not hasattr(user, '_badge_counts'):
+        counts = cache.get(_cache_key(user.id))
+        if counts is None:
+            counts = {
+                'pending_invites': ProjectInvitation.objects.filter(invited_user=user, status='PENDING').count(),
+                'pending_join_requests': JoinRequest.objects.filter(project__owner=user, status='pending').count(),
+            }
+            cache.set(_cache_key(user.id), counts, BADGE_CACHE_TIMEOUT)
+        user._badge_counts = counts
+    return user._badge_counts
+
+
+def forget_badge_counts(user_ids):
+    keys = [_cache_key(user_id) for user_id in user_ids if user_id is not None]
+    # Only once the change is committed, or a request in between caches the old counts again
+    transaction.on_commit(lambda: cache.delete_many(keys))
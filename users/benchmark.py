@@ -0,0 +1,116 @@
+import math
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Project, Upload
+from .seed import SEED_USERNAME_PREFIX
+
+# Most SQL queries each benchmarked view may run for one request, cold cache included.
+# Keyed by URL name. None of them should depend on how much data there is, a view
+# that needs more queries as the dataset grows fails the benchmark as well
+QUERY_BUDGETS = {
+    'dashboard': 10,
+    'project_list': 8,
+    'popular_projects': 9,
+    'project_main_view': 12,
+    'view_file': 12,
+    'load_messages': 4,
+    'search_users': 8,
+}
+
+
+def percentile(values, percent):
+    # Nearest-rank percentile, good enough for a few dozen samples
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def benchmark_targets():
+    """
+    The seeded user the views are requested as, and (URL name, URL) for every
+    benchmarked view: a public project that user is a member of without owning it,
+    and its latest upload.
+    """
+    project = Project.objects.filter(
+        owner__username__startswith=SEED_USERNAME_PREFIX, is_private=False, uploads__isnull=False,
+    ).order_by('id').first()
+    if project is None:
+        raise ValueError("No seeded projects found, run the seed_data command first.")
+    viewer = project.members.exclude(id=project.owner_id).order_by('id').first() or project.owner
+    upload = Upload.objects.filter(project=project).order_by('-id').first()
+    targets = [
+        ('dashboard', reverse('dashboard')),
+        ('project_list', reverse('project_list')),
+        ('popular_projects', reverse('popular_projects')),
+        ('project_main_view', reverse('project_main_view', args=[project.name, project.id])),
+        ('view_file', reverse('view_file', args=[project.name, project.id, upload.id])),
+        ('load_messages', reverse('load_messages', args=[project.id])),
+        ('search_users', reverse('search_users') + f'?q={SEED_USERNAME_PREFIX}'),
+    ]
+    return viewer, targets
+
+
+def benchmark_views(user, targets, iterations=20):
+    """
+    Request every target ``iterations`` times as ``user`` and return one result per view.
+
+    The cache is cleared before the first request of each view, so its query count is
+    the cold one. Latencies are in milliseconds, ``queries`` is the most any request ran.
+    """
+    client = Client()
+    client.force_login(user)
+    results = []
+    for name, url in targets:
+        cache.clear()
+        latencies, query_counts, statuses = [], [], set()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.get(url, secure=True)
+                latencies.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+            statuses.add(response.status_code)
+        results.append({
+            'view': name,
+            'url': url,
+            'statuses': sorted(statuses),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+            'cold_queries': query_counts[0],
+            'queries': max(query_counts),
+            'budget': QUERY_BUDGETS.get(name),
+        })
+    return results
+
+
+def budget_failures(results):
+    # Problems with one benchmark run, as readable lines
+    failures = []
+    for result in results:
+        if result['statuses'] != [200]:
+            failures.append(f"{result['view']} answered {result['statuses']}, expected 200")
+        if result['budget'] is not None and result['queries'] > result['budget']:
+            failures.append(f"{result['view']} ran {result['queries']} queries, its budget is {result['budget']}")
+    return failures
+
+
+def scaling_failures(runs):
+    # Views whose query count grew with the dataset, ``runs`` maps scale name to results in growing order
+    failures = []
+    (first_scale, first), *rest = runs.items()
+    baseline = {result['view']: result['queries'] for result in first}
+    for scale, results in rest:
+        for result in results:
+            if result['queries'] > baseline[result['view']]:
+                failures.append(
+                    f"{result['view']} ran {result['queries']} queries at {scale} scale "
+                    f"but {baseline[result['view']]} at {first_scale} scale"
+                )
+    return failures
@@ -0,0 +1,112 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils.timezone import now
+
+from .models import Blob, Upload
+from .purge import delete_batch
+from .storage import get_storage
+from .thumbnails import thumbnail_key_for
+
+BLOB_PREFIX = 'blobs/'
+
+# Longest extension, dot included, kept on a blob key. With the prefix and the digest
+# that keeps every key within Blob.key's 100 characters
+MAX_EXTENSION_LENGTH = 10
+
+# An unreferenced blob is kept this long before it is deleted, so an upload of the
+# same content that is between store_blob and saving its row can still use it
+BLOB_GRACE_PERIOD = timedelta(hours=1)
+
+
+def hash_file(file):
+    """SHA-256 hex digest of an uploaded file, read in chunks and rewound for the transfer."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_key(digest, file_name):
+    # The extension stays on the key so media types can still be guessed from it,
+    # unless it is too long or has anything but ASCII letters and digits
+    extension = os.path.splitext(file_name)[1].lower()
+    suffix = extension[1:]
+    if len(extension) > MAX_EXTENSION_LENGTH or not (suffix.isascii() and suffix.isalnum()):
+        extension = ''
+    return f'{BLOB_PREFIX}{digest}{extension}'
+
+
+def blob_transcript_key(key):
+    # Transcribe output for a blob, shared by every upload of it
+    return f'{key}-transcription.json'
+
+
+def touch_blobs(keys):
+    """
+    Which of ``keys`` are already stored. Those blobs are touched, which keeps the
+    garbage collector away from them until the uploads using them are saved; if the
+    collector holds one of the rows this waits, then finds it gone.
+    """
+    Blob.objects.filter(key__in=keys).update(updated_at=now())
+    return set(Blob.objects.filter(key__in=keys).values_list('key', flat=True))
+
+
+def record_blobs(sizes):
+    # Rows for blobs that were just sent to S3, ``sizes`` maps key to size
+    Blob.objects.bulk_create([Blob(key=key, size=size) for key, size in sizes.items()], ignore_conflicts=True)
+    Blob.objects.filter(key__in=sizes).update(updated_at=now())
+
+
+def store_blob(file, storage=None):
+    """
+    Make sure the content of an uploaded file is stored under its content address.
+
+    The file is hashed first; if a blob with that content already exists nothing is
+    transferred. Returns (blob, transferred). The caller saves an Upload pointing at
+    the blob, which is what counts as a reference.
+    """
+    key = blob_key(hash_file(file), file.name)
+    transferred = key not in touch_blobs([key])
+    if transferred:
+        (storage or get_storage()).save(key, file)
+        record_blobs({key: file.size})
+    return Blob.objects.get(key=key), transferred
+
+
+def add_blob_references(uploads):
+    # For rows written with bulk_create, which skips the post_save signal
+    counts = {}
+    for upload in uploads:
+        if upload.blob_id:
+            counts[upload.blob_id] = counts.get(upload.blob_id, 0) + 1
+    for key, count in counts.items():
+        Blob.objects.filter(key=key).update(ref_count=F('ref_count') + count, updated_at=now())
+
+
+def collect_unreferenced_blobs(limit=100):
+    """
+    Delete blobs no upload has pointed at for BLOB_GRACE_PERIOD, with their transcripts
+    and thumbnails.
+
+    Each blob is locked while its objects are deleted so store_blob can't hand it
+    out at the same time. Returns how many blobs were deleted.
+    """
+    cutoff = now() - BLOB_GRACE_PERIOD
+    unreferenced = Blob.objects.filter(ref_count=0, updated_at__lt=cutoff).exclude(
+        Exists(Upload.objects.filter(blob=OuterRef('key')))
+    )
+    collected = 0
+    for key in list(unreferenced.values_list('key', flat=True)[:limit]):
+        with transaction.atomic():
+            blob = unreferenced.select_for_update(skip_locked=True).filter(key=key).first()
+            if blob is None:
+                continue
+            delete_batch([blob.key, blob_transcript_key(blob.key), thumbnail_key_for(blob.key)])
+            blob.delete()
+        collected += 1
+    return collected
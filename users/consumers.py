@@ -0,0 +1,62 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .models import Project
+from .roles import user_is_pma_admin
+
+
+def project_chat_group(project_id):
+    # Channel layer group every open chat socket for a project belongs to
+    return f'project_chat_{project_id}'
+
+
+def message_payload(message, user):
+    # Same shape as the messages returned by load_messages
+    return {
+        'id': message.id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+        'username': user.username,
+    }
+
+
+class ProjectChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes new project chat messages to connected project members.
+
+    Messages are still posted through the create_message view, which broadcasts
+    each saved message to the project's group, so clients only listen here.
+    """
+
+    async def connect(self):
+        self.project_id = self.scope['url_route']['kwargs']['project_id']
+        self.group_name = project_chat_group(self.project_id)
+
+        if not await self.can_join_chat():
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    @database_sync_to_async
+    def can_join_chat(self):
+        # Same rule as the chat box on the project page: members, the owner and PMA admins
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            return False
+        project = Project.objects.filter(id=self.project_id).first()
+        if project is None:
+            return False
+        return (
+            project.owner_id == user.id
+            or project.members.filter(id=user.id).exists()
+            or user_is_pma_admin(user)
+        )
+
+    async def chat_message(self, event):
+        await self.send_json({'type': 'message', 'message': event['message']})
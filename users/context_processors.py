@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .badges import badge_counts
+
+
+def nav_badges(request):
+    # Lazy, so pages whose navbar shows no badges (anonymous users, PMA admins) don't count anything
+    return {'nav_badges': SimpleLazyObject(lambda: badge_counts(request.user))}
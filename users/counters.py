@@ -0,0 +1,38 @@
+from itertools import islice
+
+from django.db.models import Count, F
+
+from .models import Project
+
+# Drifted projects recounted per query on the counted table
+RECOUNT_BATCH_SIZE = 500
+
+
+def repair_counter(counter, relation, report, dry_run=False):
+    """
+    Find the projects whose ``counter`` field disagrees with the number of rows in
+    their ``relation`` many-to-many table and, unless ``dry_run``, recount them.
+
+    ``report`` is called with (id, name, stored, actual) for every drifted project.
+    Projects are recounted RECOUNT_BATCH_SIZE at a time, one query on the table per
+    batch. Returns how many projects were fixed.
+    """
+    through = getattr(Project, relation).through
+    drifted = Project.objects.annotate(actual=Count(relation)).exclude(**{counter: F('actual')})
+    rows = drifted.values_list('id', 'name', counter, 'actual').iterator(chunk_size=RECOUNT_BATCH_SIZE)
+    fixed = 0
+    while batch := list(islice(rows, RECOUNT_BATCH_SIZE)):
+        for row in batch:
+            report(*row)
+        if dry_run:
+            continue
+        actual = dict(
+            through.objects.filter(project_id__in=[row[0] for row in batch])
+            .values('project_id').annotate(rows=Count('id')).values_list('project_id', 'rows')
+        )
+        for project_id, _, stored, _ in batch:
+            # Only write if nothing changed since we counted
+            fixed += Project.objects.filter(id=project_id, **{counter: stored}).update(
+                **{counter: actual.get(project_id, 0)}
+            )
+    return fixed
@@ -26,6 +26,24 @@ class FileUploadForm(forms.ModelForm):
         
         return name
 
+class DirectUploadForm(FileUploadForm):
+    # The browser sends the file itself straight to S3, only its name comes through Django
+    file_name = forms.CharField(max_length=200)
+    content_type = forms.CharField(max_length=100, required=False)
+
+    class Meta(FileUploadForm.Meta):
+        fields = ['name', 'description', 'keywords']
+
+    def clean_file_name(self):
+        file_name = self.cleaned_data['file_name'].strip()
+        # The name becomes part of the S3 key, so it can't point into another folder
+        if not file_name or '/' in file_name or '\\' in file_name or file_name in ('.', '..'):
+            raise forms.ValidationError("Invalid file name.")
+        return file_name
+
+    def clean_content_type(self):
+        return self.cleaned_data.get('content_type') or 'application/octet-stream'
+
 class ProjectForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.owner = kwargs.pop('owner', None)  # Pop the owner argument
@@ -48,8 +66,8 @@ class ProjectForm(forms.ModelForm):
         number_of_reviewers = self.cleaned_data.get('number_of_reviewers')
 
         if self.project_instance:
-            # Calculate the number of current members
-            current_members_count = self.project_instance.members.count()
+            # Current members, kept on the project so no count query is needed
+            current_members_count = self.project_instance.member_count
             # Ensure number of reviewers is greater than current members count
             if number_of_reviewers <= current_members_count - 1:
                 raise forms.ValidationError(
@@ -94,8 +112,8 @@ class ProjectEditForm(forms.ModelForm):
         number_of_reviewers = self.cleaned_data.get('number_of_reviewers')
 
         if self.project_instance:
-            # Calculate the number of current members
-            current_members_count = self.project_instance.members.count()
+            # Current members, kept on the project so no count query is needed
+            current_members_count = self.project_instance.member_count
             # Ensure number of reviewers is greater than current members count
             if number_of_reviewers < current_members_count - 1:
                 raise forms.ValidationError(
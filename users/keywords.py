@@ -0,0 +1,72 @@
+import re
+
+from django.db.models import Count, Q
+
+from .models import UploadKeyword
+
+KEYWORD_MAX_LENGTH = 50
+
+
+def normalize_keywords(text):
+    """
+    Split free-text keywords into lowercase tags, in order and without duplicates.
+
+    Commas, semicolons and spaces all separate tags, so "Art, map-making" gives
+    ["art", "map-making"].
+    """
+    if not text:
+        return []
+    tags = []
+    for word in re.findall(r'\w[\w-]*', text.lower()):
+        tag = word[:KEYWORD_MAX_LENGTH]
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def sync_upload_keywords(upload):
+    # Only write the difference, an unchanged upload costs a single query
+    wanted = set(normalize_keywords(upload.keywords))
+    existing = set(upload.keyword_tags.values_list('keyword', flat=True))
+    if existing - wanted:
+        upload.keyword_tags.filter(keyword__in=existing - wanted).delete()
+    if wanted - existing:
+        UploadKeyword.objects.bulk_create(
+            [UploadKeyword(upload=upload, project_id=upload.project_id, keyword=tag) for tag in wanted - existing],
+            ignore_conflicts=True,
+        )
+
+
+def create_keyword_tags(uploads):
+    # For uploads written with bulk_create, which doesn't send post_save
+    UploadKeyword.objects.bulk_create(
+        [
+            UploadKeyword(upload_id=upload.id, project_id=upload.project_id, keyword=tag)
+            for upload in uploads
+            for tag in normalize_keywords(upload.keywords)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def search_uploads(uploads, project, query):
+    """
+    Filter a project's uploads to those matching every term of ``query``.
+
+    A term matches an upload whose name contains it, or which has a keyword tag
+    equal to or starting with it. Tags are looked up through the
+    (project, keyword) index rather than by scanning the uploads.
+    """
+    for term in normalize_keywords(query):
+        tagged = UploadKeyword.objects.filter(project=project, keyword__startswith=term).values('upload_id')
+        uploads = uploads.filter(Q(name__icontains=term) | Q(id__in=tagged))
+    return uploads
+
+
+def keyword_counts(project, limit=20):
+    """The project's most used keyword tags with how many uploads carry each."""
+    return list(
+        UploadKeyword.objects.filter(project=project)
+        .values('keyword').annotate(count=Count('id'))
+        .order_by('-count', 'keyword')[:limit]
+    )
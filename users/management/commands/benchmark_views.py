@@ -0,0 +1,65 @@
+import logging
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from users.benchmark import benchmark_targets, benchmark_views, budget_failures, scaling_failures
+from users.seed import SCALES, clear_seed_data, seed_dataset
+from users.storage import LocalStorage, use_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database at several sizes and time the main pages. Prints latency "
+        "percentiles and query counts, and fails if a view goes over its query budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='small,medium',
+                            help=f"Comma separated dataset sizes, smallest first ({', '.join(SCALES)}).")
+        parser.add_argument('--iterations', type=int, default=20, help="Requests per view and scale.")
+
+    def handle(self, *args, **options):
+        scales = options['scales'].split(',')
+        unknown = [scale for scale in scales if scale not in SCALES]
+        if unknown:
+            raise CommandError(f"Unknown scale(s): {', '.join(unknown)}")
+
+        # Keep the per-request timing lines out of the report
+        logging.getLogger('users.timing').setLevel(logging.WARNING)
+        # Never touches real data: everything goes to a test database and a scratch directory
+        setup_test_environment()
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as directory, use_storage(LocalStorage(directory)):
+                runs = {}
+                for scale in scales:
+                    clear_seed_data()
+                    counts = seed_dataset(**SCALES[scale])
+                    self.stdout.write(f"\n{scale}: {counts['users']} users, {counts['projects']} projects, "
+                                      f"{counts['uploads']} uploads, {counts['messages']} messages")
+                    user, targets = benchmark_targets()
+                    runs[scale] = benchmark_views(user, targets, options['iterations'])
+                    self.report(runs[scale])
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+            teardown_test_environment()
+
+        failures = [f"{scale}: {failure}" for scale, results in runs.items() for failure in budget_failures(results)]
+        failures += scaling_failures(runs)
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError(f"{len(failures)} benchmark check(s) failed.")
+        self.stdout.write("\nAll views are within their query budgets.")
+
+    def report(self, results):
+        self.stdout.write(f"{'view':<20}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'queries':>9}{'budget':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['view']:<20}{result['p50']:>9.1f}{result['p95']:>9.1f}{result['p99']:>9.1f}"
+                f"{result['max']:>9.1f}{result['queries']:>9}{result['budget'] or '-':>8}"
+            )
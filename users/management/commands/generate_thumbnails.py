@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.models import Upload
+from users.storage import get_storage
+from users.thumbnails import generate_thumbnail
+
+
+class Command(BaseCommand):
+    help = "Render WebP thumbnails of image and PDF uploads that are waiting for one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Render the pending thumbnails once and exit.")
+        parser.add_argument('--interval', type=int, default=10, help="Seconds to wait when nothing is pending.")
+        parser.add_argument('--batch-size', type=int, default=20, help="Most thumbnails to render per round.")
+
+    def handle(self, *args, **options):
+        while True:
+            # Long running worker, don't hold on to connections the database has dropped
+            close_old_connections()
+            checked, rendered, retrying = self.render(options['batch_size'])
+            if checked:
+                self.stdout.write(f"Checked {checked} upload(s), rendered {rendered} thumbnail(s).")
+            if checked > retrying:
+                # Some uploads left the queue, go straight on to the next batch
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def render(self, batch_size):
+        # Uploads that hit storage errors before go after the new ones
+        uploads = Upload.objects.filter(thumbnail_status=Upload.THUMBNAIL_PENDING).select_related('project').order_by(
+            'thumbnail_attempts', 'id'
+        )
+        storage = get_storage()
+        checked = rendered = retrying = 0
+        for upload in uploads[:batch_size]:
+            checked += 1
+            try:
+                status = generate_thumbnail(upload, storage)
+            except Exception as e:
+                # Render errors are handled by generate_thumbnail, this is storage or the
+                # network, which may work next time
+                self.stderr.write(f"Error making a thumbnail for upload {upload.id}: {e}")
+                attempts = upload.thumbnail_attempts + 1
+                if attempts < Upload.THUMBNAIL_MAX_ATTEMPTS:
+                    retrying += 1
+                    status = Upload.THUMBNAIL_PENDING
+                else:
+                    # Pages fall back to no thumbnail, don't keep picking this one up
+                    status = Upload.THUMBNAIL_FAILED
+                Upload.objects.filter(id=upload.id).update(thumbnail_status=status, thumbnail_attempts=attempts)
+                continue
+            if status == Upload.THUMBNAIL_READY:
+                rendered += 1
+        return checked, rendered, retrying
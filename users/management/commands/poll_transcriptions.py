@@ -0,0 +1,66 @@
+import time
+
+from botocore.exceptions import ClientError
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils.timezone import now
+
+from users.aws import get_transcribe_client
+from users.models import Upload
+from users.transcription import poll_transcription
+
+
+class Command(BaseCommand):
+    help = "Poll AWS Transcribe for pending upload transcriptions and store the finished transcripts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Check the pending jobs once and exit.")
+        parser.add_argument('--interval', type=int, default=30, help="Seconds to wait between polling rounds.")
+        parser.add_argument('--batch-size', type=int, default=50, help="Most jobs to check per round.")
+
+    def handle(self, *args, **options):
+        while True:
+            # Long running worker, don't hold on to connections the database has dropped
+            close_old_connections()
+            checked, finished = self.poll(options['batch_size'])
+            if checked:
+                self.stdout.write(f"Checked {checked} transcription job(s), {finished} finished.")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def poll(self, batch_size):
+        # Least recently checked first so every pending job gets its turn
+        uploads = Upload.objects.pending_transcriptions().order_by(
+            F('transcription_checked_at').asc(nulls_first=True), 'id'
+        )[:batch_size]
+
+        transcribe_client = get_transcribe_client()
+        checked = finished = 0
+        for upload in uploads:
+            try:
+                status = poll_transcription(upload, transcribe_client)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'BadRequestException':
+                    # The job does not exist (never started or expired), stop polling it
+                    upload.transcription_status = Upload.TRANSCRIPTION_FAILED
+                    upload.transcription_checked_at = now()
+                    upload.save(update_fields=['transcription_status', 'transcription_checked_at'])
+                    status = Upload.TRANSCRIPTION_FAILED
+                else:
+                    self.report_error(upload, e)
+                    continue
+            except Exception as e:
+                self.report_error(upload, e)
+                continue
+
+            checked += 1
+            if status not in Upload.TRANSCRIPTION_PENDING_STATUSES:
+                finished += 1
+        return checked, finished
+
+    def report_error(self, upload, error):
+        self.stderr.write(f"Error checking transcription job {upload.transcription_job_name}: {error}")
+        # Move it to the back of the queue so one bad job can't starve the others
+        Upload.objects.filter(id=upload.id).update(transcription_checked_at=now())
@@ -0,0 +1,91 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from users.blobs import collect_unreferenced_blobs
+from users.models import StoragePurge
+from users.purge import PURGE_WORKERS, purge_keys
+
+# A purge that failed waits this long before it is tried again
+RETRY_AFTER = timedelta(minutes=1)
+# A running purge bumps updated_at after every deleted batch. One that hasn't for this
+# long lost its worker (killed or restarted) and is picked up again
+STALE_AFTER = timedelta(minutes=10)
+
+
+class Command(BaseCommand):
+    help = "Delete the files of deleted projects, queued as StoragePurge jobs, and blobs no upload uses any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the queued purges once and exit.")
+        parser.add_argument('--interval', type=int, default=10, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--workers', type=int, default=PURGE_WORKERS, help="Parallel delete batches per purge.")
+
+    def handle(self, *args, **options):
+        while True:
+            # Long running worker, don't hold on to connections the database has dropped
+            close_old_connections()
+            purge = self.claim()
+            if purge is not None:
+                self.run(purge, options['workers'])
+                continue
+            self.collect_blobs()
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def claim(self):
+        stale = Q(status=StoragePurge.RUNNING, updated_at__lte=now() - STALE_AFTER)
+        # A purge whose last allowed attempt lost its worker is given up like one that failed
+        StoragePurge.objects.filter(stale, attempts__gte=StoragePurge.MAX_ATTEMPTS).update(
+            status=StoragePurge.FAILED, error="The worker stopped during the last attempt.", updated_at=now()
+        )
+        # skip_locked lets several workers share the queue without running a purge twice
+        with transaction.atomic():
+            purge = StoragePurge.objects.select_for_update(skip_locked=True).filter(
+                Q(status=StoragePurge.PENDING) & (Q(attempts=0) | Q(updated_at__lte=now() - RETRY_AFTER)) |
+                stale & Q(attempts__lt=StoragePurge.MAX_ATTEMPTS)
+            ).order_by('created_at').first()
+            if purge is not None:
+                purge.status = StoragePurge.RUNNING
+                purge.attempts += 1
+                purge.save(update_fields=['status', 'attempts', 'updated_at'])
+        return purge
+
+    def run(self, purge, workers):
+        self.stdout.write(f"Purging {purge.prefix} (attempt {purge.attempts})")
+
+        def progress(deleted):
+            # Every attempt goes through all the keys again, so this is the total so far.
+            # update() skips auto_now, set updated_at so the purge doesn't look stale
+            StoragePurge.objects.filter(id=purge.id).update(objects_deleted=deleted, updated_at=now())
+
+        try:
+            deleted = purge_keys(purge.keys, progress=progress, workers=workers)
+        except Exception as e:
+            purge.refresh_from_db(fields=['objects_deleted'])
+            purge.error = str(e)
+            # Run it again later, deleting the keys that are already gone is harmless
+            purge.status = StoragePurge.PENDING if purge.attempts < StoragePurge.MAX_ATTEMPTS else StoragePurge.FAILED
+            purge.save(update_fields=['status', 'error', 'updated_at'])
+            self.stderr.write(f"Error purging {purge.prefix}: {e}")
+            return
+
+        purge.objects_deleted = deleted
+        purge.status = StoragePurge.DONE
+        purge.error = None
+        purge.save(update_fields=['status', 'objects_deleted', 'error', 'updated_at'])
+        self.stdout.write(f"Purged {purge.prefix}: {deleted} object(s) deleted.")
+
+    def collect_blobs(self):
+        try:
+            collected = collect_unreferenced_blobs()
+        except Exception as e:
+            self.stderr.write(f"Error deleting unreferenced blobs: {e}")
+            return
+        if collected:
+            self.stdout.write(f"Deleted {collected} unreferenced blob(s).")
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from users.purge import DELETE_BATCH_SIZE, delete_batch
+from users.reconcile import find_orphans
+
+
+class Command(BaseCommand):
+    help = "Find stored files that no upload, transcript, thumbnail or project resource points at, and delete them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report orphaned objects without deleting them.")
+        parser.add_argument('--prefix', default='', help="Only check keys under this prefix.")
+        parser.add_argument('--min-age', type=int, default=24,
+                            help="Hours an object must have existed before it counts as orphaned.")
+
+    def handle(self, *args, **options):
+        orphans = find_orphans(options['prefix'], modified_before=now() - timedelta(hours=options['min_age']))
+        found = total_size = deleted = 0
+        batch = []
+        for obj in orphans:
+            self.stdout.write(f"Orphaned: {obj.key} ({obj.size} bytes)")
+            found += 1
+            total_size += obj.size
+            if options['dry_run']:
+                continue
+            batch.append(obj.key)
+            if len(batch) == DELETE_BATCH_SIZE:
+                deleted += delete_batch(batch)
+                batch = []
+        if batch:
+            deleted += delete_batch(batch)
+
+        self.stdout.write(f"Found {found} orphaned object(s), {total_size} bytes.")
+        if options['dry_run']:
+            self.stdout.write("Dry run, nothing deleted.")
+        else:
+            self.stdout.write(f"Deleted {deleted} object(s).")
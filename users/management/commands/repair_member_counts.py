@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users.counters import repair_counter
+
+
+class Command(BaseCommand):
+    help = "Recompute Project.member_count from the members table and fix any projects that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drifted projects without fixing them.")
+
+    def handle(self, *args, **options):
+        fixed = repair_counter('member_count', 'members', self.report, dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write("Dry run, nothing changed.")
+        else:
+            self.stdout.write(f"Fixed {fixed} project(s).")
+
+    def report(self, project_id, name, stored, actual):
+        self.stdout.write(f"Project {project_id} ({name}): stored {stored}, actual {actual}")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User
+from users.seed import SCALES, SEED_USERNAME_PREFIX, clear_seed_data, seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic users, projects, uploads, prompts and messages for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small', help="Preset dataset size.")
+        # Each of these overrides the preset
+        for option in SCALES['small']:
+            parser.add_argument(f"--{option.replace('_', '-')}", type=int, dest=option)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed gives the same data.")
+        parser.add_argument('--clear', action='store_true', help="Delete previously seeded data first.")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f"Deleted {clear_seed_data()} seeded row(s).")
+        elif User.objects.filter(username__startswith=SEED_USERNAME_PREFIX).exists():
+            raise CommandError("The database already has seeded data, run again with --clear to replace it.")
+
+        sizes = {
+            option: options[option] if options[option] is not None else default
+            for option, default in SCALES[options['scale']].items()
+        }
+        counts = seed_dataset(seed=options['seed'], **sizes)
+        self.stdout.write("Created " + ", ".join(f"{count} {kind.replace('_', ' ')}" for kind, count in counts.items()) + ".")
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0024_projectmembership'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['created_at', 'id'], name='project_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['due_date', 'id'], name='project_due_date_id_idx'),
+        ),
+    ]
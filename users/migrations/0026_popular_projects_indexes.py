@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0025_project_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['upvotes', 'id'], name='project_upvotes_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['project', '-uploaded_at'], name='upload_project_latest_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0026_popular_projects_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['project', 'id'], name='message_project_id_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+def mark_existing_jobs_pending(apps, schema_editor):
+    # Jobs started before statuses were stored get picked up by the poller
+    Upload = apps.get_model('users', 'Upload')
+    Upload.objects.filter(transcription_job_name__isnull=False).update(transcription_status='IN_PROGRESS')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0027_message_cursor_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='transcript',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='transcription_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='transcription_status',
+            field=models.CharField(blank=True, choices=[('QUEUED', 'Queued'), ('IN_PROGRESS', 'In Progress'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], max_length=20, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['transcription_status', 'transcription_checked_at'], name='upload_transcription_idx'),
+        ),
+        migrations.RunPython(mark_existing_jobs_pending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:47
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The GIN index and tsvector functions only exist on PostgreSQL, SQLite (tests) skips them
+
+def create_transcript_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS upload_transcript_search_idx ON users_upload USING gin (transcript_search)"
+    )
+    # Index the transcripts stored before search existed
+    schema_editor.execute(
+        "UPDATE users_upload SET transcript_search = to_tsvector('english', transcript) WHERE transcript IS NOT NULL"
+    )
+
+def drop_transcript_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS upload_transcript_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0028_upload_transcription_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='transcript_search',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_transcript_index, drop_transcript_index),
+    ]
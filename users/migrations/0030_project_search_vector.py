@@ -0,0 +1,46 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:49
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The GIN index and tsvector functions only exist on PostgreSQL, SQLite (tests) skips them
+
+def create_project_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from users.models import CATEGORIES
+
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS project_search_vector_idx ON users_project USING gin (search_vector)"
+    )
+    # Index the existing projects, same weights as users.search.project_search_vector
+    for code, label in CATEGORIES:
+        schema_editor.execute(
+            "UPDATE users_project SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', %s), 'B') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'C') "
+            "WHERE category = %s",
+            [label, code],
+        )
+
+def drop_project_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS project_search_vector_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0029_upload_transcript_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_project_search_index, drop_project_search_index),
+    ]
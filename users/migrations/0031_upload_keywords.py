@@ -0,0 +1,56 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:52
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# A copy of users.keywords.normalize_keywords as it was when this migration was
+# written, so later changes to it don't change what the migration does
+def normalize_keywords(text):
+    if not text:
+        return []
+    tags = []
+    for word in re.findall(r'\w[\w-]*', text.lower()):
+        tag = word[:50]
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+def split_existing_keywords(apps, schema_editor):
+    Upload = apps.get_model('users', 'Upload')
+    UploadKeyword = apps.get_model('users', 'UploadKeyword')
+    tags = []
+    for upload in Upload.objects.exclude(keywords__isnull=True).exclude(keywords='').only('id', 'project_id', 'keywords').iterator():
+        tags.extend(
+            UploadKeyword(upload_id=upload.id, project_id=upload.project_id, keyword=keyword)
+            for keyword in normalize_keywords(upload.keywords)
+        )
+    UploadKeyword.objects.bulk_create(tags, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0030_project_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadKeyword',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keyword', models.CharField(max_length=50)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_keywords', to='users.project')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='keyword_tags', to='users.upload')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['project', 'keyword'], name='uploadkeyword_project_idx', opclasses=['int8_ops', 'varchar_pattern_ops'])],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='uploadkeyword',
+            constraint=models.UniqueConstraint(fields=('upload', 'keyword'), name='unique_keyword_per_upload'),
+        ),
+        migrations.RunPython(split_existing_keywords, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-18 05:02
+
+from django.db import migrations
+
+# icontains compiles to UPPER(column::text) LIKE UPPER('%term%') on PostgreSQL, so
+# trigram indexes over that expression serve both prefix and substring matches.
+# pg_trgm only exists on PostgreSQL, SQLite (tests) skips them.
+USER_SEARCH_INDEXES = [
+    ('user_username_trgm_idx', 'auth_user', 'username'),
+    ('user_first_name_trgm_idx', 'auth_user', 'first_name'),
+    ('user_last_name_trgm_idx', 'auth_user', 'last_name'),
+    ('userprofile_bio_trgm_idx', 'users_userprofile', 'bio'),
+]
+
+def create_user_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in USER_SEARCH_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+        )
+
+def drop_user_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in USER_SEARCH_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0031_upload_keywords'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_search_indexes, drop_user_search_indexes),
+    ]
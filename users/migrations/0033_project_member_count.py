@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+def count_existing_members(apps, schema_editor):
+    Project = apps.get_model('users', 'Project')
+    counts = Project.members.through.objects.filter(project_id=OuterRef('id')).values('project_id').annotate(
+        total=Count('id')
+    ).values('total')
+    Project.objects.update(member_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0032_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_members, migrations.RunPython.noop),
+    ]
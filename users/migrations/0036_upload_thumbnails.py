@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-18 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0035_upload_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='thumbnail_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='thumbnail_status',
+            field=models.CharField(blank=True, choices=[('PENDING', 'Pending'), ('READY', 'Ready'), ('FAILED', 'Failed')], max_length=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['thumbnail_status', 'id'], name='upload_thumbnail_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0036_upload_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='thumbnail_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:15
+
+from django.db import migrations
+
+# The "-due_date" project sort lists nulls last, which a backward scan of
+# project_due_date_id_idx (ascending, nulls last) can't give. This index matches it.
+# SQLite (tests) has no NULLS LAST in indexes and skips it.
+
+def create_due_date_desc_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS project_due_date_desc_id_idx '
+        'ON users_project (due_date DESC NULLS LAST, id DESC)'
+    )
+
+def drop_due_date_desc_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS project_due_date_desc_id_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0037_upload_thumbnail_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_due_date_desc_index, drop_due_date_desc_index),
+    ]
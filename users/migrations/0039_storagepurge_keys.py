@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+# Purges now delete the keys recorded when the project was deleted instead of its
+# whole prefix, which other projects with the same name share. Purges queued before
+# have no keys and delete nothing; reconcile_storage finds what they left behind.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0038_project_due_date_desc_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagepurge',
+            name='keys',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0039_storagepurge_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='project',
+            name='upvotes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
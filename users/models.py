@@ -1,4 +1,7 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Greatest
 from django.utils.timezone import now
 from django.contrib.auth.models import User
 
@@ -26,6 +29,77 @@ CATEGORIES = (
     ('OTHER', 'Other')
 
 )
+
+
+class ProjectQuerySet(models.QuerySet):
+    def visible_to(self, user, is_pma_admin=False):
+        # PMA admins see everything, anonymous users only see public projects
+        if is_pma_admin:
+            return self
+        if not user.is_authenticated:
+            return self.filter(is_private=False)
+
+        # Exists() instead of joining members so a project is never returned twice
+        is_member = Exists(
+            Project.members.through.objects.filter(project_id=OuterRef('pk'), user_id=user.id)
+        )
+        return self.filter(Q(is_private=False) | Q(owner=user) | is_member)
+
+    def accessible_to(self, user, is_pma_admin=False):
+        # Projects whose files the user may open: owned, joined, or any for PMA admins
+        if is_pma_admin:
+            return self
+        if not user.is_authenticated:
+            return self.none()
+        is_member = Exists(
+            Project.members.through.objects.filter(project_id=OuterRef('pk'), user_id=user.id)
+        )
+        return self.filter(Q(owner=user) | is_member)
+
+    def with_user_status(self, user):
+        # Annotate membership and pending join request flags so list pages can
+        # show each project's status without a query per row
+        if not user.is_authenticated:
+            return self.annotate(user_is_member=Value(False), user_has_pending_request=Value(False))
+        return self.annotate(
+            user_is_member=Exists(
+                Project.members.through.objects.filter(project_id=OuterRef('pk'), user_id=user.id)
+            ),
+            user_has_pending_request=Exists(
+                JoinRequest.objects.filter(project_id=OuterRef('pk'), user_id=user.id, status='pending')
+            ),
+        )
+
+
+def get_project_status(project):
+    # Status of a project annotated by ProjectQuerySet.with_user_status()
+    if project.user_is_member:
+        return 'member'
+    if project.user_has_pending_request:
+        return 'pending'
+    return 'not_member'
+
+def toggle_upvote(project_id, user):
+    """
+    Add or remove ``user``'s upvote on a project and return (added, upvotes).
+
+    The project row is locked first, so concurrent toggles on the same project run
+    one after another and the returned count is the committed value. Only the
+    upvoters row for this user is touched, however many upvoters there are.
+    Raises Project.DoesNotExist for an unknown project.
+    """
+    with transaction.atomic():
+        upvotes = Project.objects.select_for_update().values_list('upvotes', flat=True).get(id=project_id)
+        upvoters = Project.upvoters.through.objects
+        removed, _ = upvoters.filter(project_id=project_id, user_id=user.id).delete()
+        if removed:
+            # never below zero, even if the counter had drifted
+            Project.objects.filter(id=project_id).update(upvotes=Greatest(F('upvotes') - 1, 0))
+            return False, max(upvotes - 1, 0)
+        upvoters.create(project_id=project_id, user_id=user.id)
+        Project.objects.filter(id=project_id).update(upvotes=F('upvotes') + 1)
+        return True, upvotes + 1
+
 class Project(models.Model):
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_projects')
@@ -36,19 +110,86 @@ class Project(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     number_of_reviewers = models.PositiveIntegerField(default=1)
     is_private = models.BooleanField(default=False)
-    upvotes = models.PositiveIntegerField(default=0)
+    # Number of upvoters, maintained by toggle_upvote with F() updates
+    upvotes = models.PositiveIntegerField(default=0, editable=False)
     upvoters = models.ManyToManyField(User, related_name='upvoted_projects', blank=True)
+    # Number of rows in members (owner included), maintained by users.signals on every
+    # membership change so list pages never count members per project
+    member_count = models.PositiveIntegerField(default=0, editable=False)
 
     @property
     def current_reviewers_count(self):
-        return self.members.count() - 1
+        return self.member_count - 1
     rubric = models.FileField(upload_to='rubrics/', blank=True, null=True)
     review_guidelines = models.FileField(upload_to='review_guidelines/', blank=True, null=True)
+    # Full-text index of name, category and description, maintained by users.search (PostgreSQL only)
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+    objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination for the project list sort orders, scanned backward for the
+            # descending ones ("-due_date" has its own index, see migration 0038)
+            models.Index(fields=['created_at', 'id'], name='project_created_at_id_idx'),
+            models.Index(fields=['due_date', 'id'], name='project_due_date_id_idx'),
+            models.Index(fields=['upvotes', 'id'], name='project_upvotes_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class Blob(models.Model):
+    # One stored copy of some upload content, addressed by its SHA-256 (see users.blobs)
+    key = models.CharField(max_length=100, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    # Uploads pointing at this blob, kept by users.signals. At zero the blob is
+    # deleted once it has been untouched for BLOB_GRACE_PERIOD
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at'], name='blob_unreferenced_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
+
+class UploadQuerySet(models.QuerySet):
+    def pending_transcriptions(self):
+        # Uploads whose transcription job has not reached a final state yet
+        return self.filter(
+            transcription_job_name__isnull=False,
+            transcription_status__in=Upload.TRANSCRIPTION_PENDING_STATUSES,
+        )
+
 class Upload(models.Model):
+    # Mirrors the TranscriptionJobStatus values returned by AWS Transcribe
+    TRANSCRIPTION_QUEUED = 'QUEUED'
+    TRANSCRIPTION_IN_PROGRESS = 'IN_PROGRESS'
+    TRANSCRIPTION_COMPLETED = 'COMPLETED'
+    TRANSCRIPTION_FAILED = 'FAILED'
+    TRANSCRIPTION_STATUS_CHOICES = [
+        (TRANSCRIPTION_QUEUED, 'Queued'),
+        (TRANSCRIPTION_IN_PROGRESS, 'In Progress'),
+        (TRANSCRIPTION_COMPLETED, 'Completed'),
+        (TRANSCRIPTION_FAILED, 'Failed'),
+    ]
+    TRANSCRIPTION_PENDING_STATUSES = [TRANSCRIPTION_QUEUED, TRANSCRIPTION_IN_PROGRESS]
+
+    THUMBNAIL_PENDING = 'PENDING'
+    THUMBNAIL_READY = 'READY'
+    THUMBNAIL_FAILED = 'FAILED'
+    THUMBNAIL_STATUS_CHOICES = [
+        (THUMBNAIL_PENDING, 'Pending'),
+        (THUMBNAIL_READY, 'Ready'),
+        (THUMBNAIL_FAILED, 'Failed'),
+    ]
+    # Storage errors while making a thumbnail are retried this many times, render errors are final
+    THUMBNAIL_MAX_ATTEMPTS = 5
+
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_files', null=False)
     file = models.FileField(upload_to='uploads/')
@@ -58,15 +199,62 @@ class Upload(models.Model):
     keywords = models.CharField(max_length=200, blank=True, null=True)
     transcription_job_name = models.CharField(max_length=255, blank=True, null=True)
     output_key = models.CharField(max_length=255, blank=True, null=True)  # Add this line
+    # Filled in by the poll_transcriptions worker so pages never call Transcribe
+    transcription_status = models.CharField(max_length=20, choices=TRANSCRIPTION_STATUS_CHOICES, blank=True, null=True)
+    transcription_checked_at = models.DateTimeField(blank=True, null=True)
+    transcript = models.TextField(blank=True, null=True)
+    # Full-text index of the transcript, maintained by users.search (PostgreSQL only)
+    transcript_search = SearchVectorField(blank=True, null=True, editable=False)
+    # Content addressed copy of the file, shared by every upload of the same bytes.
+    # Uploads without one are stored at {project name}/{file}
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='uploads', blank=True, null=True)
+    # Small WebP rendition for list pages, made by the generate_thumbnails worker (see users.thumbnails).
+    # No status means the file type has no rendition or it was uploaded before they existed
+    thumbnail_status = models.CharField(max_length=10, choices=THUMBNAIL_STATUS_CHOICES, blank=True, null=True)
+    thumbnail_key = models.CharField(max_length=255, blank=True, null=True)
+    thumbnail_attempts = models.PositiveSmallIntegerField(default=0)
+
+    objects = UploadQuerySet.as_manager()
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['name', 'project'], name='unique_upload_name_per_project')
         ]
+        indexes = [
+            # latest upload per project
+            models.Index(fields=['project', '-uploaded_at'], name='upload_project_latest_idx'),
+            models.Index(fields=['transcription_status', 'transcription_checked_at'], name='upload_transcription_idx'),
+            models.Index(fields=['thumbnail_status', 'id'], name='upload_thumbnail_idx'),
+        ]
 
     def __str__(self):
         return self.file.name
 
+    def storage_key(self, project_name):
+        return self.blob_id or f"{project_name}/{self.file}"
+
+class UploadKeyword(models.Model):
+    # One row per normalized keyword of an upload, kept in sync with Upload.keywords by users.keywords
+    upload = models.ForeignKey(Upload, on_delete=models.CASCADE, related_name='keyword_tags')
+    # Copied from the upload so a project's tags can be searched without touching the upload table
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='upload_keywords')
+    keyword = models.CharField(max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'keyword'], name='unique_keyword_per_upload')
+        ]
+        indexes = [
+            # exact and prefix tag lookups within a project, pattern ops so LIKE 'prefix%' can use it
+            models.Index(
+                fields=['project', 'keyword'], name='uploadkeyword_project_idx',
+                opclasses=['int8_ops', 'varchar_pattern_ops'],
+            ),
+        ]
+
+    def __str__(self):
+        return self.keyword
+
 class JoinRequest(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
@@ -86,6 +274,12 @@ class Message(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content=models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # chat pages are read by id cursor within a project
+            models.Index(fields=['project', 'id'], name='message_project_id_idx'),
+        ]
     
 class Prompt(models.Model):
     upload = models.ForeignKey(Upload, on_delete=models.CASCADE, related_name='prompts')
@@ -137,3 +331,38 @@ class ProjectMembership(models.Model):
 
     def __str__(self):
         return f"{self.user.username} in {self.project.name} since {self.date_added}"
+
+class StoragePurge(models.Model):
+    # Files left behind by a deleted project, deleted by the purge_storage worker
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    MAX_ATTEMPTS = 5
+
+    # The project's folder, for the admin. Names are only unique per owner, so other
+    # projects may share it: only ``keys`` are deleted
+    prefix = models.CharField(max_length=255)
+    # Every storage key the project used that no other project points at (see users.reconcile.project_keys)
+    keys = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # progress, updated after every deleted batch
+    objects_deleted = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='storagepurge_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.prefix} ({self.status}, {self.objects_deleted} deleted)"
@@ -0,0 +1,141 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.db.models import F, Field, Func, Q, Value
+from django.db.models.lookups import GreaterThan, LessThan
+
+# Supported sort orders for project lists. Each maps to the column used for the
+# keyset and whether it runs descending. The primary key is always the tie-breaker
+# so that every row has a unique position in the ordering.
+PROJECT_SORTS = {
+    'created_at': ('created_at', False),
+    '-created_at': ('created_at', True),
+    'due_date': ('due_date', False),
+    '-due_date': ('due_date', True),
+}
+DEFAULT_PROJECT_SORT = '-created_at'
+
+# Search results can also be ordered by the search_rank annotation from
+# users.search.search_projects; this is the default when there is a query
+SEARCH_PROJECT_SORTS = {
+    'relevance': ('search_rank', True),
+}
+SEARCH_PROJECT_SORT = 'relevance'
+
+# The popular projects page is always ordered by upvotes
+POPULAR_PROJECT_SORTS = {
+    '-upvotes': ('upvotes', True),
+}
+POPULAR_PROJECT_SORT = '-upvotes'
+
+# User search results are listed alphabetically, usernames are unique
+USER_SORTS = {
+    'username': ('username', False),
+}
+USER_SORT = 'username'
+USER_PAGE_SIZE = 24
+
+# The sort orders keyset_page accepts for each model (by label), so a project sort
+# can't be applied to users or the other way round
+MODEL_SORTS = {
+    'users.Project': {**PROJECT_SORTS, **SEARCH_PROJECT_SORTS, **POPULAR_PROJECT_SORTS},
+    'auth.User': USER_SORTS,
+}
+
+# How to turn a cursor value back into the column's type
+CURSOR_PARSERS = {
+    'created_at': datetime.fromisoformat,
+    'due_date': date.fromisoformat,
+    'upvotes': int,
+    'search_rank': float,
+    'username': str,
+}
+
+# Sort columns that can be NULL. Their nulls are listed last in both directions, the
+# others are left without a NULLS modifier so their (column, id) index can be scanned
+# either way
+NULLABLE_SORT_FIELDS = {'due_date'}
+
+PROJECT_PAGE_SIZE = 25
+
+
+class Row(Func):
+    # A row value, (a, b), which compares column by column
+    template = '(%(expressions)s)'
+    output_field = Field()
+
+
+def encode_cursor(value, pk):
+    # Cursors are opaque to the client, but they only carry the sort value and id
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    payload = json.dumps([value, pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, field):
+    """Return (value, pk) from a cursor, or None if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        pk = int(pk)
+        if value is not None:
+            value = CURSOR_PARSERS[field](value)
+    except (ValueError, TypeError, json.JSONDecodeError):
+        return None
+    return value, pk
+
+
+def _sort_spec(queryset, sort_by):
+    return MODEL_SORTS[queryset.model._meta.label][sort_by]
+
+
+def order_projects(queryset, sort_by):
+    field, descending = _sort_spec(queryset, sort_by)
+    nulls_last = True if field in NULLABLE_SORT_FIELDS else None
+    if descending:
+        return queryset.order_by(F(field).desc(nulls_last=nulls_last), '-id')
+    return queryset.order_by(F(field).asc(nulls_last=nulls_last), 'id')
+
+
+def _after_cursor(field, descending, value, pk):
+    # Rows strictly after (value, pk) in "field [desc] [nulls last], id [desc]" order
+    id_lookup = 'id__lt' if descending else 'id__gt'
+    if value is None:
+        # Already in the trailing block of nulls, only the id decides
+        return Q(**{f'{field}__isnull': True, id_lookup: pk})
+    # One row-value comparison, which the database seeks to in the (field, id) index
+    compare = LessThan if descending else GreaterThan
+    after = Q(compare(Row(F(field), F('id')), Row(Value(value), Value(pk))))
+    if field in NULLABLE_SORT_FIELDS:
+        after |= Q(**{f'{field}__isnull': True})
+    return after
+
+
+def keyset_page(queryset, sort_by, cursor=None, page_size=PROJECT_PAGE_SIZE):
+    """
+    Slice one page out of a project (or user) queryset using keyset (seek) pagination.
+
+    Unlike OFFSET pagination, the cost of fetching a page does not depend on how
+    deep into the list it is: the database seeks straight to the cursor position
+    using the (sort column, id) index.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    field, descending = _sort_spec(queryset, sort_by)
+    queryset = order_projects(queryset, sort_by)
+
+    if cursor:
+        position = decode_cursor(cursor, field)
+        if position is not None:
+            queryset = queryset.filter(_after_cursor(field, descending, *position))
+
+    # One extra row tells us whether there is a following page
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return rows, next_cursor
@@ -0,0 +1,75 @@
+import hashlib
+import mimetypes  # https://docs.python.org/3/library/mimetypes.html
+
+from django.core.cache import cache
+from django.utils.http import content_disposition_header
+
+from .storage import get_storage
+from .timing import timed
+
+# Lifetime of every presigned URL we hand out
+PRESIGNED_URL_EXPIRY = 3600  # 1 hour
+# A cached URL is only reused while it has at least this much life left, so the
+# cache entry is dropped this long before the URL itself stops working
+PRESIGNED_URL_MIN_REMAINING = 600  # 10 minutes
+
+# Media types the browser can display directly, everything else is downloaded
+INLINE_CONTENT_TYPES = ['image/jpeg', 'text/plain', 'application/pdf', 'video/mp4']
+
+
+def content_type_and_disposition(file_key, file_name=None):
+    """
+    Guess the media type of an S3 key and whether the browser should display or download it.
+
+    ``file_name`` is the name the browser saves the file as, for keys that don't end
+    in it (blobs are named after their hash).
+    """
+    mime_type, _ = mimetypes.guess_type(file_key)
+    if mime_type not in INLINE_CONTENT_TYPES:
+        disposition_type = 'attachment'  # to download the file
+    else:
+        disposition_type = 'inline'  # to display the file
+    if file_name:
+        # Quoted as RFC 6266 asks, with filename* for names that aren't ASCII
+        disposition_type = content_disposition_header(disposition_type == 'attachment', file_name)
+    return mime_type, disposition_type
+
+
+def _cache_key(storage, key, content_type, disposition):
+    # S3 keys can be long and contain spaces, which some cache backends reject
+    raw = '\0'.join([storage.name, key, content_type or '', disposition or ''])
+    return 'presigned-url:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def presigned_url(key, content_type=None, disposition=None, storage=None):
+    """
+    Return a presigned GET URL for a stored file, reusing a cached one when possible.
+
+    URLs are cached per (storage, key, response content type, disposition, which holds
+    the file name if there is one) for
+    PRESIGNED_URL_EXPIRY - PRESIGNED_URL_MIN_REMAINING seconds, so a URL handed out
+    from the cache is always valid for at least PRESIGNED_URL_MIN_REMAINING more
+    seconds. Reusing the same URL also lets browsers cache the object itself.
+    """
+    storage = storage or get_storage()
+    cache_key = _cache_key(storage, key, content_type, disposition)
+    url = cache.get(cache_key)
+    if url is not None:
+        return url
+
+    with timed('presign'):
+        url = storage.url(key, content_type, disposition, expires=PRESIGNED_URL_EXPIRY)
+    cache.set(cache_key, url, timeout=PRESIGNED_URL_EXPIRY - PRESIGNED_URL_MIN_REMAINING)
+    return url
+
+
+def presigned_file_url(key, file_name=None, storage=None):
+    """Presigned URL for a stored file, with its media type and disposition guessed from the key."""
+    mime_type, disposition_type = content_type_and_disposition(key, file_name)
+    return presigned_url(key, mime_type, disposition_type, storage=storage)
+
+
+def forget_presigned_urls(key, storage=None):
+    # Called when an object is deleted or replaced so stale links are not handed out
+    mime_type, disposition_type = content_type_and_disposition(key)
+    cache.delete(_cache_key(storage or get_storage(), key, mime_type, disposition_type))
@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import PAGE_SIZE, get_storage
+
+DELETE_BATCH_SIZE = PAGE_SIZE  # the most keys a single delete_objects call accepts
+PURGE_WORKERS = 4
+MAX_BATCH_ATTEMPTS = 5
+RETRY_DELAY = 1  # seconds, doubled after every failed attempt
+
+
+class PurgeError(Exception):
+    pass
+
+
+def delete_batch(keys, storage=None):
+    """
+    Delete up to DELETE_BATCH_SIZE keys, retrying any the storage reports as not
+    deleted. Returns how many keys were deleted, raises PurgeError if some could not
+    be deleted after MAX_BATCH_ATTEMPTS.
+    """
+    storage = storage or get_storage()
+    remaining = list(keys)
+    for attempt in range(MAX_BATCH_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+        remaining = storage.delete_many(remaining)
+        if not remaining:
+            return len(keys)
+    raise PurgeError(f'{len(remaining)} of {len(keys)} objects could not be deleted')
+
+
+def purge_keys(keys, progress=None, workers=PURGE_WORKERS, storage=None):
+    """
+    Delete every one of ``keys``, however many there are.
+
+    The keys are deleted DELETE_BATCH_SIZE at a time on a pool of ``workers`` threads;
+    keys that are already gone count as deleted, so a purge can simply be run again.
+    ``progress`` is called from this thread with the running total after every
+    finished batch. Returns the number of keys deleted.
+    """
+    storage = storage or get_storage()
+    batches = [keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(keys), DELETE_BATCH_SIZE)]
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for count in pool.map(lambda batch: delete_batch(batch, storage), batches):
+            deleted += count
+            if progress:
+                progress(deleted)
+    return deleted
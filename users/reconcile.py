@@ -0,0 +1,93 @@
+import heapq
+
+from django.db import connection
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Collate, Concat
+
+from .blobs import BLOB_PREFIX
+from .models import Blob, Project, Upload
+from .storage import get_storage
+
+# Rows are read from the database this many keys at a time
+KEY_CHUNK_SIZE = 2000
+
+
+def _sorted_keys(queryset, expression, prefix):
+    # Byte order, the same order S3 lists keys in ("C" on PostgreSQL, BINARY on SQLite)
+    collation = 'C' if connection.vendor == 'postgresql' else 'BINARY'
+    keys = queryset.annotate(storage_key=expression).exclude(storage_key='')
+    if prefix:
+        keys = keys.filter(storage_key__startswith=prefix)
+    keys = keys.order_by(Collate(F('storage_key'), collation))
+    return keys.values_list('storage_key', flat=True).iterator(chunk_size=KEY_CHUNK_SIZE)
+
+
+def referenced_keys(prefix=''):
+    """
+    Every S3 key the database points at under ``prefix``, in S3 listing order.
+
+    Upload files live in their blob or at {project name}/{file}, transcripts at
+    output_key, thumbnails at thumbnail_key and project resources at the name of
+    their FileField. Blobs waiting to be collected still count, with their transcript
+    and thumbnail, collect_unreferenced_blobs deletes them.
+    """
+    upload_file = Concat(F('project__name'), Value('/'), F('file'), output_field=CharField())
+    blob_transcript = Concat(F('key'), Value('-transcription.json'), output_field=CharField())
+    blob_thumbnail = Concat(F('key'), Value('-thumbnail.webp'), output_field=CharField())
+    return heapq.merge(
+        _sorted_keys(Blob.objects.all(), F('key'), prefix),
+        _sorted_keys(Blob.objects.all(), blob_transcript, prefix),
+        _sorted_keys(Blob.objects.all(), blob_thumbnail, prefix),
+        _sorted_keys(Upload.objects.filter(blob=None), upload_file, prefix),
+        _sorted_keys(Upload.objects.exclude(output_key=None), F('output_key'), prefix),
+        _sorted_keys(Upload.objects.filter(blob=None).exclude(thumbnail_key=None), F('thumbnail_key'), prefix),
+        _sorted_keys(Project.objects.exclude(rubric=None), F('rubric'), prefix),
+        _sorted_keys(Project.objects.exclude(review_guidelines=None), F('review_guidelines'), prefix),
+    )
+
+
+def _project_file_keys(projects):
+    # Keys of the files of ``projects`` that aren't in a shared blob
+    uploads = Upload.objects.filter(project__in=projects)
+    keys = {f'{name}/{file}' for name, file in uploads.filter(blob=None).values_list('project__name', 'file')}
+    for generated in uploads.values_list('output_key', 'thumbnail_key'):
+        keys.update(key for key in generated if key and not key.startswith(BLOB_PREFIX))
+    for resources in projects.values_list('rubric', 'review_guidelines'):
+        keys.update(key for key in resources if key)
+    return keys
+
+
+def project_keys(project):
+    """
+    Every storage key only ``project`` uses: its uploads that aren't in a blob, their
+    transcripts and thumbnails, and its rubric and review guidelines.
+
+    Project names are only unique per owner and keys start with the name, so keys a
+    project of another owner with the same name points at are left out. Blobs are
+    shared, collect_unreferenced_blobs deletes them once no upload uses them.
+    """
+    same_name = Project.objects.filter(name=project.name)
+    keys = _project_file_keys(same_name.filter(id=project.id)) - _project_file_keys(same_name.exclude(id=project.id))
+    return sorted(keys)
+
+
+def find_orphans(prefix='', modified_before=None, storage=None):
+    """
+    Yield the StoredObject of every file under ``prefix`` that no row references.
+
+    The storage listing and the referenced keys are both walked in key order and
+    merged, so memory stays at one listing page and one chunk of keys however big
+    either side gets. Objects modified after ``modified_before`` are skipped, a
+    direct upload is in S3 for a moment before its row is saved.
+    """
+    referenced = referenced_keys(prefix)
+    next_referenced = next(referenced, None)
+    for page in (storage or get_storage()).list_pages(prefix):
+        for obj in page:
+            while next_referenced is not None and next_referenced < obj.key:
+                next_referenced = next(referenced, None)
+            if obj.key == next_referenced:
+                continue
+            if modified_before and obj.modified > modified_before:
+                continue
+            yield obj
@@ -0,0 +1,17 @@
+PMA_ADMIN_GROUP = 'PMA Administrators'
+
+
+def user_is_pma_admin(user):
+    """
+    Whether ``user`` belongs to the PMA Administrators group.
+
+    The answer is remembered on the user object, and request.user is built once per
+    request, so views and templates can call this as often as they like. It is not
+    cached between requests: this decides authorization, and a revoked admin must
+    lose access on every process straight away.
+    """
+    if not user.is_authenticated:
+        return False
+    if not hasattr(user, '_is_pma_admin'):
+        user._is_pma_admin = user.groups.filter(name=PMA_ADMIN_GROUP).exists()
+    return user._is_pma_admin
@@ -0,0 +1,156 @@
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Cast
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import CATEGORIES, Project, Upload
+
+# Text search configuration used to build and query every search vector
+SEARCH_CONFIG = 'english'
+
+# Markers around matched words in snippets, swapped for <mark> after escaping
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+SNIPPET_RADIUS = 120  # characters of context around a match in the fallback snippet
+
+
+def full_text_search_available():
+    # Production runs on PostgreSQL, tests and local development may use SQLite
+    return connection.vendor == 'postgresql'
+
+
+def search_terms(query):
+    return [term for term in re.findall(r'\w+', query.lower()) if term]
+
+
+def highlight(snippet):
+    """Escape a snippet and turn the match markers into <mark> tags."""
+    html = escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+    return mark_safe(html)
+
+
+def index_transcript(upload_id):
+    # Called whenever a transcript is stored, so the index is built one upload at a time
+    if full_text_search_available():
+        Upload.objects.filter(id=upload_id).update(
+            transcript_search=SearchVector('transcript', config=SEARCH_CONFIG)
+        )
+
+
+def _fallback_snippet(text, terms):
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in terms if lowered.find(term) != -1]
+    start = max(min(positions) - SNIPPET_RADIUS, 0) if positions else 0
+    snippet = text[start:start + SNIPPET_RADIUS * 2]
+    for term in terms:
+        snippet = re.sub(
+            f'({re.escape(term)})', f'{HIGHLIGHT_START}\\1{HIGHLIGHT_STOP}', snippet, flags=re.IGNORECASE
+        )
+    prefix = '...' if start else ''
+    suffix = '...' if start + SNIPPET_RADIUS * 2 < len(text) else ''
+    return prefix + snippet + suffix
+
+
+def rank_transcripts(uploads, query, limit=50):
+    """
+    Rank the completed transcripts in ``uploads`` against a search query.
+
+    Returns a list of uploads, best match first, each with ``rank`` and a
+    highlighted ``snippet``. On PostgreSQL this uses the GIN-indexed transcript
+    search vector; elsewhere it falls back to matching every term with icontains.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    uploads = uploads.filter(transcription_status=Upload.TRANSCRIPTION_COMPLETED).select_related('project')
+
+    if full_text_search_available():
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        results = list(
+            uploads.filter(transcript_search=search_query).annotate(
+                rank=SearchRank(F('transcript_search'), search_query),
+                snippet=SearchHeadline(
+                    'transcript', search_query, config=SEARCH_CONFIG,
+                    start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP, max_words=35, min_words=15,
+                ),
+            ).defer('transcript', 'transcript_search').order_by('-rank', '-uploaded_at')[:limit]
+        )
+    else:
+        for term in terms:
+            uploads = uploads.filter(transcript__icontains=term)
+        results = list(uploads.order_by('-uploaded_at')[:limit])
+        for upload in results:
+            lowered = upload.transcript.lower()
+            upload.rank = sum(lowered.count(term) for term in terms)
+            upload.snippet = _fallback_snippet(upload.transcript, terms)
+        results.sort(key=lambda upload: upload.rank, reverse=True)
+
+    for upload in results:
+        upload.snippet = highlight(upload.snippet)
+    return results
+
+
+# Project fields the search vector is built from
+PROJECT_SEARCH_FIELDS = {'name', 'category', 'description'}
+
+
+def project_search_vector(category):
+    # Name matches outrank category matches, which outrank description matches
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+        SearchVector(Value(dict(CATEGORIES).get(category, category)), weight='B', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def index_project(project):
+    # Called when a project save may change its text; deleted projects take their index entry with them
+    if full_text_search_available():
+        Project.objects.filter(id=project.id).update(search_vector=project_search_vector(project.category))
+
+
+def _prefix_query(terms):
+    # Every term must match, and the last word typed may be incomplete
+    raw = ' & '.join(f'{term}:*' for term in terms)
+    return SearchQuery(raw, config=SEARCH_CONFIG, search_type='raw')
+
+
+def search_projects(projects, query):
+    """
+    Filter a project queryset down to matches for ``query`` and annotate ``search_rank``.
+
+    On PostgreSQL this is a prefix tsquery against the GIN-indexed search vector
+    ranked with ts_rank. Elsewhere every term has to appear in the name, the
+    description or the category label, and the rank is a weighted count of where
+    each term was found.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return projects.none()
+
+    if full_text_search_available():
+        search_query = _prefix_query(terms)
+        # ts_rank returns a real, as double precision the value survives the round
+        # trip through a relevance cursor exactly
+        return projects.filter(search_vector=search_query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+        )
+
+    rank = Value(0)
+    for term in terms:
+        category_codes = [code for code, label in CATEGORIES if term in label.lower()]
+        projects = projects.filter(
+            Q(name__icontains=term) | Q(description__icontains=term) | Q(category__in=category_codes)
+        )
+        rank = rank + Case(
+            When(name__icontains=term, then=Value(3)),
+            When(category__in=category_codes, then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    return projects.annotate(search_rank=rank)
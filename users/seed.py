@@ -0,0 +1,167 @@
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVector
+from django.db import transaction
+from django.utils.timezone import now
+
+from .keywords import create_keyword_tags
+from .models import (
+    CATEGORIES, JoinRequest, Message, Project, ProjectMembership, Prompt, PromptResponse, Upload, UserProfile,
+)
+from .search import SEARCH_CONFIG, full_text_search_available, project_search_vector
+from .thumbnails import has_rendition, thumbnail_key_for
+
+# Every seeded username starts with this, which is how clear_seed_data finds them
+SEED_USERNAME_PREFIX = 'seed-'
+
+# Dataset sizes used by seed_data --scale and the benchmarks
+SCALES = {
+    'small': {'users': 50, 'projects': 10, 'members_per_project': 5, 'uploads_per_project': 10,
+              'prompts_per_upload': 1, 'responses_per_prompt': 2, 'messages_per_project': 50},
+    'medium': {'users': 500, 'projects': 100, 'members_per_project': 20, 'uploads_per_project': 25,
+               'prompts_per_upload': 2, 'responses_per_prompt': 3, 'messages_per_project': 200},
+    'large': {'users': 5000, 'projects': 1000, 'members_per_project': 40, 'uploads_per_project': 50,
+              'prompts_per_upload': 3, 'responses_per_prompt': 3, 'messages_per_project': 500},
+}
+
+FILE_EXTENSIONS = ['pdf', 'jpg', 'png', 'mp4', 'mp3', 'txt', 'docx']
+WORDS = [
+    'review', 'draft', 'essay', 'lab', 'report', 'sketch', 'model', 'survey', 'thesis', 'proposal',
+    'chapter', 'figure', 'budget', 'design', 'analysis', 'interview', 'lecture', 'poster', 'notes', 'data',
+]
+BATCH_SIZE = 1000
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def clear_seed_data():
+    """Delete every seeded user, which takes their projects, uploads and messages along."""
+    deleted, _ = User.objects.filter(username__startswith=SEED_USERNAME_PREFIX).delete()
+    return deleted
+
+
+def seed_dataset(users, projects, members_per_project, uploads_per_project, prompts_per_upload,
+                 responses_per_prompt, messages_per_project, seed=0):
+    """
+    Fill the database with a synthetic dataset of the given size and return how many
+    rows of each kind were created.
+
+    Rows are written with bulk_create, so the counters and index rows that signals
+    normally keep (member counts, profiles, keyword tags, search vectors) are filled
+    in here. Only rows are created, no files are written to storage. The same
+    ``seed`` always gives the same dataset.
+    """
+    rng = random.Random(seed)
+    start = now() - timedelta(days=365)
+    categories = [value for value, _ in CATEGORIES]
+    members_per_project = min(members_per_project, users - 1)
+
+    with transaction.atomic():
+        # Users can't log in with a password, the benchmarks use force_login
+        seeded_users = User.objects.bulk_create([
+            User(username=f'{SEED_USERNAME_PREFIX}user{i}', first_name=rng.choice(WORDS).title(),
+                 email=f'{SEED_USERNAME_PREFIX}user{i}@example.com', password='!')
+            for i in range(users)
+        ], batch_size=BATCH_SIZE)
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=user, bio=_text(rng, 8)) for user in seeded_users], batch_size=BATCH_SIZE
+        )
+
+        seeded_projects = Project.objects.bulk_create([
+            Project(
+                name=f'{rng.choice(WORDS).title()} {i}', owner=rng.choice(seeded_users),
+                category=rng.choice(categories), description=_text(rng, 20), is_private=rng.random() < 0.2,
+                due_date=(start + timedelta(days=rng.randrange(730))).date(),
+                member_count=members_per_project + 1,
+            )
+            for i in range(projects)
+        ], batch_size=BATCH_SIZE)
+        if full_text_search_available():
+            for category in categories:
+                Project.objects.filter(id__in=[p.id for p in seeded_projects], category=category).update(
+                    search_vector=project_search_vector(category)
+                )
+
+        members, memberships, join_requests, upvoters = [], [], [], []
+        members_of = {}
+        for project in seeded_projects:
+            others = [user for user in seeded_users if user.id != project.owner_id]
+            project_members = [project.owner] + rng.sample(others, members_per_project)
+            members_of[project.id] = project_members
+            for user in project_members:
+                members.append(Project.members.through(project_id=project.id, user_id=user.id))
+                memberships.append(ProjectMembership(project=project, user=user))
+            outsiders = [user for user in rng.sample(others, min(len(others), members_per_project + 3))
+                         if user not in project_members]
+            join_requests += [JoinRequest(project=project, user=user) for user in outsiders[:3]]
+            upvoters += [Project.upvoters.through(project_id=project.id, user_id=user.id)
+                         for user in rng.sample(project_members, rng.randrange(len(project_members) + 1))]
+        Project.members.through.objects.bulk_create(members, batch_size=BATCH_SIZE)
+        ProjectMembership.objects.bulk_create(memberships, batch_size=BATCH_SIZE)
+        JoinRequest.objects.bulk_create(join_requests, batch_size=BATCH_SIZE)
+        Project.upvoters.through.objects.bulk_create(upvoters, batch_size=BATCH_SIZE)
+        upvotes = Counter(row.project_id for row in upvoters)
+        for project in seeded_projects:
+            project.upvotes = upvotes[project.id]
+        Project.objects.bulk_update(seeded_projects, ['upvotes'], batch_size=BATCH_SIZE)
+
+        uploads = []
+        for project in seeded_projects:
+            for i in range(uploads_per_project):
+                extension = rng.choice(FILE_EXTENSIONS)
+                upload = Upload(
+                    name=f'{rng.choice(WORDS).title()} {i}', owner=rng.choice(members_of[project.id]),
+                    project=project, file=f'seed-{i}.{extension}', description=_text(rng, 12),
+                    keywords=', '.join(rng.sample(WORDS, 3)),
+                    uploaded_at=start + timedelta(minutes=rng.randrange(525600)),
+                )
+                if extension in ('mp4', 'mp3'):
+                    upload.transcription_job_name = f'seed-{project.id}-{i}'
+                    upload.output_key = f'{project.name}/{upload.file}-transcription.json'
+                    upload.transcription_status = Upload.TRANSCRIPTION_COMPLETED
+                    upload.transcript = _text(rng, 200)
+                if has_rendition(upload):
+                    upload.thumbnail_status = Upload.THUMBNAIL_READY
+                    upload.thumbnail_key = thumbnail_key_for(upload.storage_key(project.name))
+                uploads.append(upload)
+        uploads = Upload.objects.bulk_create(uploads, batch_size=BATCH_SIZE)
+        create_keyword_tags(uploads)
+        if full_text_search_available():
+            Upload.objects.filter(id__in=[u.id for u in uploads], transcript__isnull=False).update(
+                transcript_search=SearchVector('transcript', config=SEARCH_CONFIG)
+            )
+
+        prompts = Prompt.objects.bulk_create([
+            Prompt(upload=upload, content=_text(rng, 15), created_by=rng.choice(members_of[upload.project_id]))
+            for upload in uploads
+            for _ in range(prompts_per_upload)
+        ], batch_size=BATCH_SIZE)
+        project_of_upload = {upload.id: upload.project_id for upload in uploads}
+        responses = PromptResponse.objects.bulk_create([
+            PromptResponse(prompt=prompt, content=_text(rng, 15),
+                           created_by=rng.choice(members_of[project_of_upload[prompt.upload_id]]))
+            for prompt in prompts
+            for _ in range(responses_per_prompt)
+        ], batch_size=BATCH_SIZE)
+
+        messages = Message.objects.bulk_create([
+            Message(project=project, user=rng.choice(members_of[project.id]), content=_text(rng, 10))
+            for project in seeded_projects
+            for _ in range(messages_per_project)
+        ], batch_size=BATCH_SIZE)
+
+    return {
+        'users': len(seeded_users),
+        'projects': len(seeded_projects),
+        'memberships': len(members),
+        'join_requests': len(join_requests),
+        'uploads': len(uploads),
+        'prompts': len(prompts),
+        'responses': len(responses),
+        'messages': len(messages),
+    }
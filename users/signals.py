@@ -1,9 +1,14 @@
 from django.contrib.auth.models import Group
 from allauth.account.signals import user_signed_up
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models import F, QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.contrib.auth.models import User
-from .models import UserProfile
+from django.utils.timezone import now
+from .badges import forget_badge_counts
+from .keywords import sync_upload_keywords
+from .models import Blob, JoinRequest, Project, ProjectInvitation, Upload, UserProfile
+from .search import PROJECT_SEARCH_FIELDS, index_project
 
 
 @receiver(user_signed_up)
@@ -24,3 +29,103 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+@receiver(post_save, sender=Project)
+def update_project_search_index(sender, instance, update_fields=None, **kwargs):
+    # Counter and file updates leave the indexed text alone
+    if update_fields is None or PROJECT_SEARCH_FIELDS & set(update_fields):
+        index_project(instance)
+
+
+@receiver(post_save, sender=Upload)
+def update_upload_keywords(sender, instance, update_fields=None, **kwargs):
+    # Saves that name their fields and leave keywords out (e.g. transcription updates) can't change the tags
+    if update_fields is None or 'keywords' in update_fields:
+        sync_upload_keywords(instance)
+
+
+@receiver(post_save, sender=Upload)
+def add_blob_reference(sender, instance, created, **kwargs):
+    if created and instance.blob_id:
+        Blob.objects.filter(key=instance.blob_id).update(ref_count=F('ref_count') + 1, updated_at=now())
+
+
+@receiver(post_delete, sender=Upload)
+def release_blob_reference(sender, instance, **kwargs):
+    # Also runs for uploads removed with their project or owner. The blob itself is
+    # deleted later by collect_unreferenced_blobs
+    if instance.blob_id:
+        Blob.objects.filter(key=instance.blob_id, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1, updated_at=now()
+        )
+
+
+def _recount_members(project_ids):
+    for project_id in project_ids:
+        Project.objects.filter(id=project_id).update(
+            member_count=Project.members.through.objects.filter(project_id=project_id).count()
+        )
+
+
+@receiver(m2m_changed, sender=Project.members.through)
+def update_project_member_count(sender, instance, action, reverse, pk_set, **kwargs):
+    # Runs inside the transaction making the change. For post_add pk_set only holds the
+    # rows that were actually inserted, for removals it holds every requested id, so recount.
+    if action == 'pre_clear' and reverse:
+        # user.projects.clear() doesn't say which projects it touched afterwards
+        instance._cleared_project_ids = list(instance.projects.values_list('id', flat=True))
+        return
+    if action == 'post_add' and pk_set:
+        if reverse:
+            Project.objects.filter(id__in=pk_set).update(member_count=F('member_count') + 1)
+        else:
+            Project.objects.filter(id=instance.id).update(member_count=F('member_count') + len(pk_set))
+    elif action == 'post_remove':
+        _recount_members(pk_set if reverse else [instance.id])
+    elif action == 'post_clear':
+        _recount_members(instance.__dict__.pop('_cleared_project_ids', []) if reverse else [instance.id])
+    else:
+        return
+    if not reverse:
+        instance.refresh_from_db(fields=['member_count'])
+
+
+@receiver(pre_delete, sender=User)
+def release_project_memberships(sender, instance, **kwargs):
+    # Deleting a user cascades to the members table without an m2m_changed signal
+    Project.objects.filter(members=instance).update(member_count=F('member_count') - 1)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_memoized_roles(sender, instance, action, reverse, **kwargs):
+    # user.groups.add(...) passes the user, whose memoized answer is now out of date
+    if not reverse and action.startswith('post_'):
+        instance.__dict__.pop('_is_pma_admin', None)
+
+
+@receiver(post_save, sender=ProjectInvitation)
+@receiver(post_delete, sender=ProjectInvitation)
+def forget_invitation_badges(sender, instance, **kwargs):
+    forget_badge_counts([instance.invited_user_id])
+
+
+@receiver(pre_delete, sender=Project)
+def forget_deleted_project_badges(sender, instance, **kwargs):
+    # The project's join requests are deleted with it, the owner's badge is forgotten here once
+    forget_badge_counts([instance.owner_id])
+
+
+@receiver(post_save, sender=JoinRequest)
+@receiver(post_delete, sender=JoinRequest)
+def forget_join_request_badges(sender, instance, origin=None, **kwargs):
+    # Deleted along with its project, see forget_deleted_project_badges
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is Project:
+        return
+    # The badge belongs to the project owner
+    if JoinRequest.project.is_cached(instance):
+        owner_id = instance.project.owner_id
+    else:
+        owner_id = Project.objects.filter(id=instance.project_id).values_list('owner_id', flat=True).first()
+    forget_badge_counts([owner_id])
@@ -0,0 +1,256 @@
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.urls import reverse
+from django.utils.deconstruct import deconstructible
+
+from mysite.settings import AWS_STORAGE_BUCKET_NAME, FILE_STORAGE_BACKEND, LOCAL_STORAGE_ROOT
+from .aws import get_s3_client
+
+# Most keys returned per listing page and accepted per delete_many call, S3's own limits
+PAGE_SIZE = 1000
+
+# One entry of a prefix listing
+StoredObject = namedtuple('StoredObject', ['key', 'size', 'modified'])
+
+
+class S3Storage:
+    """Files in the S3 bucket, through the shared boto3 client."""
+
+    def __init__(self, bucket=AWS_STORAGE_BUCKET_NAME, client=None):
+        self.bucket = bucket
+        self._client = client
+        self.name = f's3:{bucket}'
+
+    @property
+    def client(self):
+        return self._client or get_s3_client()
+
+    def save(self, key, file, content_type=None, cache_control=None):
+        extra = {}
+        if content_type:
+            extra['ContentType'] = content_type
+        if cache_control:
+            extra['CacheControl'] = cache_control
+        self.client.upload_fileobj(file, self.bucket, key, **({'ExtraArgs': extra} if extra else {}))
+
+    def open(self, key):
+        """Returns (stream, size) for a stored file."""
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        return response['Body'], response['ContentLength']
+
+    def size(self, key):
+        """Size of a stored file, or None if there is nothing at ``key``."""
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return response['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys):
+        """Delete up to PAGE_SIZE keys in one call, returns the keys that could not be deleted."""
+        try:
+            response = self.client.delete_objects(
+                Bucket=self.bucket, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        except (BotoCoreError, ClientError) as e:
+            print(f'Error deleting {len(keys)} objects: {e}')
+            return list(keys)
+        # Quiet mode only lists the keys that failed
+        return [error['Key'] for error in response.get('Errors', [])]
+
+    def list_pages(self, prefix):
+        """Yield the objects under ``prefix`` in key (byte) order, PAGE_SIZE at a time."""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, PaginationConfig={'PageSize': PAGE_SIZE}):
+            yield [StoredObject(obj['Key'], obj['Size'], obj['LastModified']) for obj in page.get('Contents', [])]
+
+    def url(self, key, content_type=None, disposition=None, expires=3600):
+        params = {'Bucket': self.bucket, 'Key': key}
+        # makes sure the browser is able to handle the display the correct media type
+        if content_type:
+            params['ResponseContentType'] = content_type
+        if disposition:
+            params['ResponseContentDisposition'] = disposition
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+    def presigned_post(self, key, content_type, max_size, expires):
+        """
+        Form the browser posts one file to, straight into storage at ``key``.
+        Returns {'url': ..., 'fields': ...}; the file goes in a last 'file' field.
+        """
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, max_size],
+            ],
+            ExpiresIn=expires,
+        )
+
+
+class LocalStorage:
+    """
+    Files in a directory on this machine, for development, load tests and running
+    without AWS. Signed URLs and browser uploads go through the serve_stored_file and
+    receive_stored_file views, with django.core.signing in place of AWS signatures.
+    """
+
+    SIGNING_SALT = 'users.storage'
+
+    def __init__(self, root=LOCAL_STORAGE_ROOT):
+        self.root = os.path.abspath(root)
+        self.name = f'local:{self.root}'
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        # Keys come from file names, never let one point outside the root
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f'Invalid storage key: {key}')
+        return path
+
+    def save(self, key, file, content_type=None, cache_control=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and rename, so readers never see half a file
+        partial = f'{path}.{threading.get_ident()}.partial'
+        with open(partial, 'wb') as destination:
+            shutil.copyfileobj(file, destination)
+        os.replace(partial, path)
+
+    def open(self, key):
+        path = self.path(key)
+        return open(path, 'rb'), os.path.getsize(path)
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass  # S3 doesn't complain about missing keys either
+
+    def delete_many(self, keys):
+        failed = []
+        for key in keys:
+            try:
+                self.delete(key)
+            except OSError as e:
+                print(f'Error deleting {key}: {e}')
+                failed.append(key)
+        return failed
+
+    def list_pages(self, prefix):
+        # Sorted like S3: by the UTF-8 bytes of the key, which is code point order
+        directory_prefix = prefix.rpartition('/')[0]
+        keys = []
+        for directory, _, files in os.walk(os.path.join(self.root, directory_prefix)):
+            for file_name in files:
+                key = os.path.relpath(os.path.join(directory, file_name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not key.endswith('.partial'):
+                    keys.append(key)
+        keys.sort()
+        for start in range(0, len(keys), PAGE_SIZE):
+            page = []
+            for key in keys[start:start + PAGE_SIZE]:
+                try:
+                    stat = os.stat(self.path(key))
+                except FileNotFoundError:
+                    continue  # deleted since the walk
+                page.append(StoredObject(key, stat.st_size, datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)))
+            yield page
+
+    def sign(self, payload, expires):
+        return signing.dumps({**payload, 'exp': int(time.time()) + expires}, salt=self.SIGNING_SALT, compress=True)
+
+    def unsign(self, token):
+        """The payload of a token from sign(), or None if it was tampered with or has expired."""
+        try:
+            payload = signing.loads(token, salt=self.SIGNING_SALT)
+        except signing.BadSignature:
+            return None
+        return payload if payload['exp'] >= time.time() else None
+
+    def url(self, key, content_type=None, disposition=None, expires=3600):
+        token = self.sign({'key': key, 'type': content_type, 'disposition': disposition}, expires)
+        return reverse('serve_stored_file', args=[token])
+
+    def presigned_post(self, key, content_type, max_size, expires):
+        token = self.sign({'key': key, 'type': content_type, 'max_size': max_size}, expires)
+        return {'url': reverse('receive_stored_file'), 'fields': {'key': key, 'policy': token}}
+
+
+STORAGE_BACKENDS = {
+    's3': S3Storage,
+    'local': LocalStorage,
+}
+
+_storage = None
+
+
+def get_storage():
+    """The process-wide storage backend picked by FILE_STORAGE_BACKEND ('s3' or 'local')."""
+    global _storage
+    if _storage is None:
+        _storage = STORAGE_BACKENDS[FILE_STORAGE_BACKEND]()
+    return _storage
+
+
+@contextmanager
+def use_storage(storage):
+    # Send everything to another backend for a while, e.g. benchmarks on a scratch directory
+    global _storage
+    previous, _storage = _storage, storage
+    try:
+        yield storage
+    finally:
+        _storage = previous
+
+
+@deconstructible
+class BackendFileStorage(Storage):
+    """
+    Django file storage on top of get_storage(), so FileFields (project rubrics and
+    review guidelines) are stored by the same backend as everything else.
+    """
+
+    def _open(self, name, mode='rb'):
+        stream, _ = get_storage().open(name)
+        return File(stream, name)
+
+    def _save(self, name, content):
+        content.seek(0)
+        get_storage().save(name, content, getattr(content, 'content_type', None))
+        return name
+
+    def delete(self, name):
+        get_storage().delete(name)
+
+    def exists(self, name):
+        return get_storage().size(name) is not None
+
+    def size(self, name):
+        return get_storage().size(name)
+
+    def url(self, name):
+        return get_storage().url(name)
@@ -1,5 +1,6 @@
 from django import template
-from users.models import ProjectInvitation
+from users.badges import badge_counts
+from users.roles import user_is_pma_admin
 
 register = template.Library()
 
@@ -14,10 +15,8 @@ def is_transcribable(file_type):
 
 @register.filter
 def pending_invites_count(user):
-    if user.is_authenticated:
-        return ProjectInvitation.objects.filter(invited_user=user, status='PENDING').count()
-    return 0
+    return badge_counts(user)['pending_invites']
 
 @register.filter
 def is_admin(user):
-    return user.groups.filter(name='PMA Administrators').exists()
\ No newline at end of file
+    return user_is_pma_admin(user)
\ No newline at end of file
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..models import Project
+
+
+class UsersTestCase(TestCase):
+    """
+    TestCase that starts every test with an empty cache, with helpers for the users
+    and projects most tests begin with.
+
+    Cached roles, badge counts and URLs are keyed by ids, which SQLite hands out
+    again in the next test, so nothing cached may outlive a test.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def create_user(self, username, **fields):
+        return User.objects.create_user(username=username, password='password', **fields)
+
+    def create_project(self, name, owner, members=(), **fields):
+        fields.setdefault('description', "d")
+        project = Project.objects.create(name=name, owner=owner, **fields)
+        if members:
+            project.members.add(*members)
+        return project
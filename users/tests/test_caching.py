@@ -0,0 +1,162 @@
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..badges import badge_counts
+from ..models import JoinRequest, ProjectInvitation
+from ..presign import (
+    PRESIGNED_URL_EXPIRY, PRESIGNED_URL_MIN_REMAINING, forget_presigned_urls, presigned_file_url, presigned_url,
+)
+from ..roles import user_is_pma_admin
+from ..storage import S3Storage
+from .base import UsersTestCase
+
+
+class PresignedUrlCacheTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.s3 = mock.Mock()
+        self.s3.generate_presigned_url.side_effect = lambda *args, **kwargs: f"https://signed/{kwargs['Params']['Key']}?n={self.s3.generate_presigned_url.call_count}"
+        self.storage = S3Storage(client=self.s3)
+
+    def test_url_is_reused_until_evicted(self):
+        first = presigned_file_url('project/slides.pdf', storage=self.storage)
+        self.assertEqual(presigned_file_url('project/slides.pdf', storage=self.storage), first)
+        self.assertEqual(self.s3.generate_presigned_url.call_count, 1)
+        params = self.s3.generate_presigned_url.call_args.kwargs['Params']
+        self.assertEqual(params['ResponseContentType'], 'application/pdf')
+        self.assertEqual(params['ResponseContentDisposition'], 'inline')
+
+    def test_cache_entry_expires_before_the_url(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            presigned_file_url('project/slides.pdf', storage=self.storage)
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], PRESIGNED_URL_EXPIRY - PRESIGNED_URL_MIN_REMAINING)
+        self.assertEqual(self.s3.generate_presigned_url.call_args.kwargs['ExpiresIn'], PRESIGNED_URL_EXPIRY)
+
+    def test_key_includes_content_type_and_disposition(self):
+        inline = presigned_url('project/a.txt', 'text/plain', 'inline', storage=self.storage)
+        attachment = presigned_url('project/a.txt', 'text/plain', 'attachment', storage=self.storage)
+        self.assertNotEqual(inline, attachment)
+        self.assertEqual(self.s3.generate_presigned_url.call_count, 2)
+
+    def test_blob_downloads_keep_the_uploaded_file_name(self):
+        key = 'blobs/' + 'a' * 64 + '.zip'
+        named = presigned_file_url(key, 'Week "1" notes.zip', storage=self.storage)
+        params = self.s3.generate_presigned_url.call_args.kwargs['Params']
+        self.assertEqual(params['ResponseContentDisposition'], 'attachment; filename="Week \\"1\\" notes.zip"')
+        self.assertEqual(presigned_file_url(key, 'Week "1" notes.zip', storage=self.storage), named)
+        self.assertNotEqual(presigned_file_url(key, 'other.zip', storage=self.storage), named)
+        presigned_file_url(key, 'café.zip', storage=self.storage)
+        params = self.s3.generate_presigned_url.call_args.kwargs['Params']
+        self.assertEqual(params['ResponseContentDisposition'], "attachment; filename*=utf-8''caf%C3%A9.zip")
+
+    def test_forget_drops_cached_url(self):
+        first = presigned_file_url('project/notes.zip', storage=self.storage)
+        forget_presigned_urls('project/notes.zip', storage=self.storage)
+        self.assertNotEqual(presigned_file_url('project/notes.zip', storage=self.storage), first)
+
+
+class RoleCacheTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('reviewer')
+        self.admins = Group.objects.create(name='PMA Administrators')
+
+    def fresh_user(self):
+        # a new object, like request.user on the next request
+        return User.objects.get(id=self.user.id)
+
+    def test_answer_is_memoized_per_request_only(self):
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertFalse(user_is_pma_admin(user))
+            self.assertFalse(user_is_pma_admin(user))
+        # Never cached across requests, other processes would keep a revoked admin's rights
+        next_request_user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertFalse(user_is_pma_admin(next_request_user))
+        self.assertFalse(user_is_pma_admin(AnonymousUser()))
+
+    def test_group_changes_apply_on_the_next_request(self):
+        self.assertFalse(user_is_pma_admin(self.fresh_user()))
+        self.user.groups.add(self.admins)
+        self.assertTrue(user_is_pma_admin(self.fresh_user()))
+        self.admins.user_set.remove(self.user)
+        self.assertFalse(user_is_pma_admin(self.fresh_user()))
+        self.admins.user_set.add(self.user)
+        self.assertTrue(user_is_pma_admin(self.fresh_user()))
+        self.admins.delete()
+        self.assertFalse(user_is_pma_admin(self.fresh_user()))
+
+    def test_pages_check_roles_at_most_once(self):
+        project = self.create_project("Roles", self.user, members=[self.user])
+        self.client.force_login(self.user)
+        for url in (reverse('project_list'), reverse('project_main_view', args=[project.name, project.id])):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url, secure=True).status_code, 200)
+            role_queries = [query for query in queries if '"auth_group"' in query['sql']]
+            self.assertLessEqual(len(role_queries), 1, url)
+
+
+class NavBadgeTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.reviewer = self.create_user('reviewer')
+        self.project = self.create_project("Badged", self.owner, members=[self.owner])
+
+    def counts(self, user):
+        # a fresh object, like request.user on the next request
+        return badge_counts(User.objects.get(id=user.id))
+
+    def test_counts_are_cached_and_invalidated_by_writes(self):
+        self.assertEqual(self.counts(self.reviewer)['pending_invites'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            invitation = ProjectInvitation.objects.create(project=self.project, invited_by=self.owner, invited_user=self.reviewer)
+        self.assertEqual(self.counts(self.reviewer)['pending_invites'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            join_request = JoinRequest.objects.create(user=self.reviewer, project=self.project)
+        self.assertEqual(self.counts(self.owner)['pending_join_requests'], 1)
+        user = User.objects.get(id=self.owner.id)
+        with self.assertNumQueries(0):
+            badge_counts(user)
+
+        # approving resolves the invitation through update(), which must clear both badges
+        self.client.force_login(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('approve_join_request', args=[join_request.id]), secure=True)
+        self.assertEqual(self.counts(self.owner)['pending_join_requests'], 0)
+        self.assertEqual(self.counts(self.reviewer)['pending_invites'], 0)
+        invitation.refresh_from_db()
+        self.assertEqual(invitation.status, 'ACCEPTED')
+
+    def test_deleting_a_project_forgets_its_owners_badge(self):
+        for i in range(3):
+            JoinRequest.objects.create(user=self.create_user(f'applicant{i}'), project=self.project)
+        self.assertEqual(self.counts(self.owner)['pending_join_requests'], 3)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.project.delete()
+        # No owner lookup per cascaded join request
+        self.assertFalse([query for query in queries if '"users_project"."owner_id"' in query['sql']])
+        self.assertEqual(self.counts(self.owner)['pending_join_requests'], 0)
+
+    def test_counts_are_only_forgotten_after_commit(self):
+        self.assertEqual(self.counts(self.reviewer)['pending_invites'], 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            ProjectInvitation.objects.create(project=self.project, invited_by=self.owner, invited_user=self.reviewer)
+            # A request reading before the commit can't refill the cache with the old count
+            self.assertEqual(self.counts(self.reviewer)['pending_invites'], 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.counts(self.reviewer)['pending_invites'], 1)
+
+    def test_navbar_renders_badges(self):
+        ProjectInvitation.objects.create(project=self.project, invited_by=self.owner, invited_user=self.reviewer)
+        self.client.force_login(self.reviewer)
+        response = self.client.get(reverse('project_list'), secure=True)
+        self.assertContains(response, '<span class="badge bg-danger">1</span>', html=True)
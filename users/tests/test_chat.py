@@ -0,0 +1,101 @@
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..consumers import ProjectChatConsumer
+from ..models import Message
+from .base import UsersTestCase
+
+
+class ProjectChatConsumerTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.member = self.create_user('member')
+        self.outsider = self.create_user('outsider')
+        self.project = self.create_project(
+            "Chat Project", self.owner, description="chat", members=[self.owner, self.member],
+        )
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(
+            ProjectChatConsumer.as_asgi(), f'/ws/projects/{self.project.id}/chat/'
+        )
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'project_id': self.project.id}}
+        return communicator
+
+    async def test_outsiders_are_rejected(self):
+        communicator = self.communicator(self.outsider)
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_created_message_is_pushed_to_members(self):
+        communicator = self.communicator(self.member)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        def post_message():
+            self.client.force_login(self.owner)
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(
+                    reverse('create_message', args=[self.project.id]), {'content': 'hello'}, secure=True
+                )
+
+        response = await sync_to_async(post_message)()
+        self.assertEqual(response.status_code, 200)
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'message')
+        self.assertEqual(event['message']['content'], 'hello')
+        self.assertEqual(event['message']['username'], 'owner')
+        await communicator.disconnect()
+
+
+class LoadMessagesViewTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('chatter')
+        self.project = self.create_project("Chatty", self.user, description="chat")
+        self.messages = [
+            Message.objects.create(project=self.project, user=self.user, content=f"line {i}")
+            for i in range(7)
+        ]
+        self.client.force_login(self.user)
+
+    def load(self, **params):
+        response = self.client.get(reverse('load_messages', args=[self.project.id]), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_latest_page_and_scroll_back(self):
+        data = self.load(limit=3)
+        self.assertEqual([m['content'] for m in data['messages']], ["line 4", "line 5", "line 6"])
+        self.assertEqual(data['next'], {'before_id': self.messages[4].id})
+
+        data = self.load(limit=3, before_id=data['next']['before_id'])
+        self.assertEqual([m['content'] for m in data['messages']], ["line 1", "line 2", "line 3"])
+
+        data = self.load(limit=3, before_id=data['next']['before_id'])
+        self.assertEqual([m['content'] for m in data['messages']], ["line 0"])
+        self.assertIsNone(data['next'])
+
+    def test_after_id_returns_only_the_delta(self):
+        data = self.load(after_id=self.messages[4].id)
+        self.assertEqual([m['content'] for m in data['messages']], ["line 5", "line 6"])
+        self.assertEqual(data['messages'][0]['username'], 'chatter')
+        self.assertIsNone(data['next'])
+
+    def test_single_query_regardless_of_authors(self):
+        for i in range(5):
+            author = self.create_user(f'author{i}')
+            Message.objects.create(project=self.project, user=author, content="hi")
+        with CaptureQueriesContext(connection) as queries:
+            self.load()
+        message_queries = [q for q in queries.captured_queries if 'users_message' in q['sql']]
+        self.assertEqual(len(message_queries), 1)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('load_messages', args=[self.project.id]), {'after_id': 'x'}, secure=True)
+        self.assertEqual(response.status_code, 400)
@@ -1,8 +1,7 @@
-from django.test import TestCase
-from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Project, Upload, JoinRequest, Message, Prompt, PromptResponse, UserProfile, ProjectMembership
+from django.test import TestCase
 
+from ..models import JoinRequest, Message, Project, Prompt, PromptResponse, Upload
 
 
 class ProjectModelTest(TestCase):
@@ -129,5 +128,3 @@ class PromptAndResponseModelTest(TestCase):
         
         self.assertTrue(prompt_exists)
         self.assertTrue(response_exists)
-
-
@@ -0,0 +1,130 @@
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+
+import boto3
+from botocore.stub import Stubber
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+
+from ..benchmark import benchmark_targets, benchmark_views, budget_failures, scaling_failures
+from ..models import Project, PromptResponse, Upload, UploadKeyword
+from ..seed import clear_seed_data, seed_dataset
+from ..storage import LocalStorage, use_storage
+from ..timing import ServerTimingMiddleware, register_aws_timing
+from .base import UsersTestCase
+
+
+class BenchmarkTest(UsersTestCase):
+    # Small versions of the benchmark_views command, so query budgets are checked with the rest of the tests
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(use_storage(LocalStorage(directory.name)))
+
+    def sizes(self, factor):
+        return {'users': 10 * factor, 'projects': 3 * factor, 'members_per_project': 3 * factor,
+                'uploads_per_project': 4 * factor, 'prompts_per_upload': factor, 'responses_per_prompt': factor,
+                'messages_per_project': 5 * factor}
+
+    def test_seed_data_command_creates_and_replaces_a_dataset(self):
+        call_command('seed_data', '--users', '20', '--projects', '4', '--uploads-per-project', '3', stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='seed-').count(), 20)
+        self.assertEqual(Upload.objects.count(), 12)
+        self.assertEqual(PromptResponse.objects.count(), 4 * 3 * 2)
+        project = Project.objects.first()
+        self.assertEqual(project.member_count, project.members.count())
+        self.assertTrue(UploadKeyword.objects.exists())
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', stdout=StringIO())
+        call_command('seed_data', '--clear', '--users', '5', '--projects', '1', stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='seed-').count(), 5)
+        self.assertEqual(Project.objects.count(), 1)
+
+    def test_views_stay_within_query_budgets_as_data_grows(self):
+        runs = {}
+        for factor in (1, 3):
+            clear_seed_data()
+            seed_dataset(**self.sizes(factor))
+            user, targets = benchmark_targets()
+            runs[factor] = benchmark_views(user, targets, iterations=2)
+            self.assertEqual(budget_failures(runs[factor]), [])
+        self.assertEqual(scaling_failures(runs), [])
+        self.assertEqual({result['view'] for result in runs[1]}, {
+            'dashboard', 'project_list', 'popular_projects', 'project_main_view', 'view_file', 'load_messages',
+            'search_users',
+        })
+
+
+class ServerTimingTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('timed', is_staff=True)
+        self.project = self.create_project("Timed", self.user)
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        with self.assertLogs('users.timing', 'INFO') as logs:
+            response = self.client.get(url, secure=True)
+        return response, [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_header_and_log_line_break_down_the_request(self):
+        response, lines = self.get(reverse('project_main_view', args=[self.project.name, self.project.id]))
+        self.assertEqual(response.status_code, 200)
+        metrics = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(list(metrics), ['db', 'aws', 'presign', 'template', 'total'])
+        self.assertRegex(metrics['template'], r'^dur=[\d.]+;desc="[1-9]\d* templates rendered"$')
+
+        [line] = lines
+        self.assertEqual((line['url_name'], line['method'], line['status']), ('project_main_view', 'GET', 200))
+        self.assertGreater(line['db_count'], 0)
+        self.assertIn(f'desc="{line["db_count"]} queries"', metrics['db'])
+        self.assertEqual(line['aws_count'], 0)
+
+    def test_unresolved_urls_are_logged_without_a_name(self):
+        response, [line] = self.get('/no-such-page/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(line['url_name'])
+        self.assertIn('Server-Timing', response)
+
+    def test_header_is_only_sent_to_staff_unless_enabled(self):
+        User.objects.filter(id=self.user.id).update(is_staff=False)
+        url = reverse('project_main_view', args=[self.project.name, self.project.id])
+        response, [line] = self.get(url)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(line['url_name'], 'project_main_view')
+        with mock.patch('users.timing.SERVER_TIMING_HEADER', True):
+            response, _ = self.get(url)
+        self.assertIn('Server-Timing', response)
+
+    def test_aws_calls_are_counted_through_client_events(self):
+        s3 = boto3.session.Session(aws_access_key_id='x', aws_secret_access_key='x').client('s3', region_name='us-east-1')
+        register_aws_timing(s3)
+        stubber = Stubber(s3)
+        stubber.add_response('head_object', {'ContentLength': 3}, {'Bucket': 'b', 'Key': 'k'})
+        stubber.add_client_error('head_object', http_status_code=404)
+
+        def view(request):
+            s3.head_object(Bucket='b', Key='k')
+            try:
+                s3.head_object(Bucket='b', Key='missing')
+            except s3.exceptions.ClientError:
+                pass
+            return HttpResponse()
+
+        with stubber, self.assertLogs('users.timing', 'INFO') as logs, \
+                mock.patch('users.timing.SERVER_TIMING_HEADER', True):
+            response = ServerTimingMiddleware(view)(RequestFactory().get('/'))
+        self.assertIn('desc="2 AWS calls"', response['Server-Timing'])
+        self.assertEqual(json.loads(logs.records[0].getMessage())['aws_count'], 2)
+        # Outside a request the hooks leave calls alone
+        stubber.add_response('head_object', {'ContentLength': 3}, {'Bucket': 'b', 'Key': 'k'})
+        with stubber:
+            s3.head_object(Bucket='b', Key='k')
@@ -0,0 +1,317 @@
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.management import call_command
+from django.db import connection
+from django.shortcuts import get_object_or_404
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..badges import badge_counts
+from ..models import JoinRequest, Project, Upload
+from ..roles import user_is_pma_admin
+from ..views import get_projects_context
+from .base import UsersTestCase
+
+
+class ProjectListContextTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.owner = self.create_user('owner')
+        self.member = self.create_user('member')
+        self.outsider = self.create_user('outsider')
+        self.public = self.create_project("Public", self.owner, description="public")
+        self.private = self.create_project(
+            "Private", self.owner, description="private", is_private=True, members=[self.owner, self.member],
+        )
+
+    def get_context(self, user, **params):
+        request = self.factory.get('/projects/', params)
+        request.user = user
+        return get_projects_context(request)
+
+    def test_private_projects_hidden_from_outsiders(self):
+        self.assertEqual(self.get_context(self.outsider)['projects'], [self.public])
+        self.assertEqual(self.get_context(AnonymousUser())['projects'], [self.public])
+
+    def test_private_projects_visible_to_owner_member_and_admin(self):
+        admin = self.create_user('admin')
+        admin.groups.add(Group.objects.create(name='PMA Administrators'))
+        for user in (self.owner, self.member, admin):
+            self.assertCountEqual(self.get_context(user)['projects'], [self.public, self.private])
+
+    def test_keyset_pagination_walks_every_project_once(self):
+        for i in range(60):
+            self.create_project(
+                f"Project {i}", self.owner, description="bulk", due_date=date(2025, 1, 1 + i % 5) if i % 3 else None,
+            )
+        expected = Project.objects.visible_to(self.outsider).count()
+        for sort in ('created_at', '-created_at', 'due_date', '-due_date'):
+            seen, cursor = [], None
+            while True:
+                params = {'sort': sort}
+                if cursor:
+                    params['cursor'] = cursor
+                context = self.get_context(self.outsider, **params)
+                seen.extend(project.id for project in context['projects'])
+                cursor = context['next_cursor']
+                if not cursor:
+                    break
+            self.assertEqual(len(seen), expected, sort)
+            self.assertEqual(len(set(seen)), expected, sort)
+
+    def test_due_date_sort_puts_nulls_last(self):
+        dated = self.create_project("Dated", self.owner, due_date=date(2025, 5, 1))
+        for sort in ('due_date', '-due_date'):
+            self.assertEqual(self.get_context(self.outsider, sort=sort)['projects'][0], dated)
+
+    def test_search_ranks_name_over_category_over_description(self):
+        by_description = self.create_project("Essay", self.owner, description="a history of rome")
+        by_category = self.create_project("Essay", self.owner, category='HISTORY')
+        by_name = self.create_project("History of Rome", self.owner)
+        context = self.get_context(self.outsider, q='histo')
+        self.assertEqual(context['sort_by'], 'relevance')
+        self.assertEqual(context['projects'], [by_name, by_category, by_description])
+
+    def test_only_saves_of_indexed_fields_reindex(self):
+        project = self.create_project("Indexed", self.owner)
+        with mock.patch('users.signals.index_project') as index:
+            project.save(update_fields=['upvotes'])
+            project.save(update_fields=['rubric', 'review_guidelines'])
+            index.assert_not_called()
+            project.save(update_fields=['category'])
+            project.save()
+        self.assertEqual(index.call_count, 2)
+
+    def test_search_matches_category_label_and_requires_every_term(self):
+        literature = self.create_project("Poems", self.owner, category='ENGLISH')
+        self.assertEqual(self.get_context(self.outsider, q='literature')['projects'], [literature])
+        self.assertEqual(self.get_context(self.outsider, q='poems literature')['projects'], [literature])
+        self.assertEqual(self.get_context(self.outsider, q='poems biology')['projects'], [])
+
+    def test_search_results_page_by_relevance(self):
+        for i in range(30):
+            self.create_project(f"Robot {i}" if i % 2 else "Other", self.owner, description="robot arm")
+        seen, cursor = [], None
+        while True:
+            params = {'q': 'robot'}
+            if cursor:
+                params['cursor'] = cursor
+            context = self.get_context(self.outsider, **params)
+            seen.extend(project.id for project in context['projects'])
+            cursor = context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+        # Name matches come first
+        names = list(Project.objects.filter(id__in=seen[:15]).values_list('name', flat=True))
+        self.assertTrue(all(name.startswith("Robot") for name in names))
+
+    def test_malformed_cursor_returns_first_page(self):
+        context = self.get_context(self.outsider, cursor='not-a-cursor')
+        self.assertEqual(context['projects'], [self.public])
+
+
+class ProjectStatusTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.owner = self.create_user('owner')
+        self.user = self.create_user('reviewer')
+        self.joined = self.create_project("Joined", self.owner, description="a", members=[self.user])
+        self.requested = self.create_project("Requested", self.owner, description="b")
+        JoinRequest.objects.create(user=self.user, project=self.requested)
+        self.other = self.create_project("Other", self.owner, description="c")
+
+    def test_project_list_status_is_annotated(self):
+        for i in range(10):
+            self.create_project(f"Filler {i}", self.owner, description="filler")
+        request = self.factory.get('/projects/')
+        request.user = User.objects.get(id=self.user.id)
+        # the admin group check and the page itself, however many projects there are
+        with self.assertNumQueries(2):
+            context = get_projects_context(request)
+        self.assertEqual(context['project_status'][self.joined.id], 'member')
+        self.assertEqual(context['project_status'][self.requested.id], 'pending')
+        self.assertEqual(context['project_status'][self.other.id], 'not_member')
+        self.assertFalse(context['project_permissions'][self.joined.id])
+
+
+@mock.patch('users.storage.get_s3_client')
+class PopularProjectsViewTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.user = self.create_user('reviewer')
+        self.client.force_login(self.user)
+        # every measured request sees a warm role and badge cache
+        user_is_pma_admin(self.user)
+        badge_counts(self.user)
+
+    def add_projects(self, count):
+        for i in range(count):
+            project = self.create_project(f"Popular {i}", self.owner, description="p", upvotes=i, members=[self.owner])
+            Upload.objects.create(name="first", owner=self.owner, project=project, file="first.pdf")
+            Upload.objects.create(name="second", owner=self.owner, project=project, file="second.jpg")
+            JoinRequest.objects.create(user=self.user, project=project)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('popular_projects'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_does_not_grow_with_projects(self, boto_client):
+        boto_client.return_value.generate_presigned_url.return_value = 'https://signed'
+        self.add_projects(3)
+        small, _ = self.count_queries()
+        self.add_projects(12)
+        large, response = self.count_queries()
+        self.assertEqual(small, large)
+        first = response.context['projects'][0]
+        self.assertEqual(first.latest_upload.name, "second")
+        self.assertTrue(first.pending_request)
+
+    def test_private_projects_are_excluded_and_paginated(self, boto_client):
+        boto_client.return_value.generate_presigned_url.return_value = 'https://signed'
+        self.create_project("Hidden", self.owner, description="h", is_private=True, upvotes=100)
+        self.add_projects(30)
+        _, response = self.count_queries()
+        names = [project.name for project in response.context['projects']]
+        self.assertNotIn("Hidden", names)
+        self.assertEqual(names[0], "Popular 29")
+        self.assertIsNotNone(response.context['next_cursor'])
+
+
+class ProjectMemberCountTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.reviewer = self.create_user('reviewer')
+        self.project = self.create_project("Counted", self.owner, number_of_reviewers=1, members=[self.owner])
+
+    def test_count_follows_membership_changes(self):
+        self.assertEqual(self.project.member_count, 1)
+        self.project.members.add(self.owner, self.reviewer)
+        self.assertEqual(self.project.member_count, 2)
+        self.assertEqual(self.project.current_reviewers_count, 1)
+        self.reviewer.projects.remove(self.project)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 1)
+        self.project.members.clear()
+        self.assertEqual(self.project.member_count, 0)
+
+    def test_join_approval_and_leaving_update_the_count(self):
+        join_request = JoinRequest.objects.create(user=self.reviewer, project=self.project)
+        self.client.force_login(self.owner)
+        self.client.get(reverse('approve_join_request', args=[join_request.id]), secure=True)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 2)
+
+        self.client.force_login(self.reviewer)
+        self.client.get(reverse('leave_project', args=[self.project.name, self.project.id]), secure=True)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 1)
+
+    def test_deleting_a_member_releases_their_seat(self):
+        self.project.members.add(self.reviewer)
+        self.reviewer.delete()
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 1)
+
+    def test_editing_the_project_keeps_the_count(self):
+
+        def load_then_join(*args, **kwargs):
+            # The reviewer joins while the owner's edit is in flight
+            project = get_object_or_404(*args, **kwargs)
+            self.project.members.add(self.reviewer)
+            return project
+        self.client.force_login(self.owner)
+        details = {'description': "edited", 'category': 'OTHER', 'number_of_reviewers': 1}
+        with mock.patch('users.views.get_object_or_404', side_effect=load_then_join):
+            self.client.post(reverse('edit_project', args=[self.project.id]), details, secure=True)
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.member_count, self.project.description), (2, "edited"))
+
+    def test_repair_command_fixes_drift(self):
+        Project.objects.filter(id=self.project.id).update(member_count=7)
+        out = StringIO()
+        call_command('repair_member_counts', '--dry-run', stdout=out)
+        self.assertIn("stored 7, actual 1", out.getvalue())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 7)
+
+        call_command('repair_member_counts', stdout=StringIO())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.member_count, 1)
+
+
+class UpvoteToggleTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.voter = self.create_user('voter')
+        self.project = self.create_project("Voted", self.owner)
+        self.client.force_login(self.voter)
+
+    def upvote(self, project_id=None):
+        return self.client.post(reverse('upvote_project', args=[project_id or self.project.id]), secure=True)
+
+    def test_toggle_returns_committed_count(self):
+        self.assertEqual(self.upvote().json(), {'status': 'added', 'upvotes': 1})
+        self.assertTrue(self.project.upvoters.filter(id=self.voter.id).exists())
+        self.assertEqual(self.upvote().json(), {'status': 'removed', 'upvotes': 0})
+        self.assertFalse(self.project.upvoters.exists())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.upvotes, 0)
+
+    def test_toggle_cost_does_not_grow_with_upvoters(self):
+        with CaptureQueriesContext(connection) as alone:
+            self.upvote()
+        self.upvote()
+        for i in range(20):
+            self.project.upvoters.add(self.create_user(f'fan{i}'))
+        with CaptureQueriesContext(connection) as crowded:
+            self.upvote()
+        self.assertEqual(len(crowded), len(alone))
+        self.assertEqual(self.project.upvoters.count(), 21)
+
+    def test_unknown_project_is_404(self):
+        self.assertEqual(self.upvote(project_id=9999).status_code, 404)
+
+    def test_editing_the_project_keeps_the_upvotes(self):
+
+        def load_then_upvote(*args, **kwargs):
+            project = get_object_or_404(*args, **kwargs)
+            self.upvote()
+            return project
+        details = {'description': "edited", 'category': 'OTHER', 'number_of_reviewers': 1}
+        self.client.force_login(self.owner)
+        with mock.patch('users.views.get_object_or_404', side_effect=load_then_upvote):
+            self.client.post(reverse('edit_project', args=[self.project.id]), details, secure=True)
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.upvotes, self.project.description), (1, "edited"))
+
+    def test_reconcile_command_fixes_drift(self):
+        self.project.upvoters.add(self.voter)
+        Project.objects.filter(id=self.project.id).update(upvotes=5)
+        call_command('reconcile_upvotes', stdout=StringIO())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.upvotes, 1)
+
+    @mock.patch('users.counters.RECOUNT_BATCH_SIZE', 2)
+    def test_reconcile_recounts_in_batches(self):
+        projects = [self.create_project(f"Drifted {i}", self.owner) for i in range(3)]
+        projects[0].upvoters.add(self.voter)
+        Project.objects.update(upvotes=5)
+        out = StringIO()
+        # the drifted projects, one recount per batch of two, one update per project
+        with self.assertNumQueries(1 + 2 + 4):
+            call_command('reconcile_upvotes', stdout=out)
+        self.assertIn("Fixed 4 project(s).", out.getvalue())
+        self.assertEqual(sorted(Project.objects.values_list('upvotes', flat=True)), [0, 0, 0, 1])
@@ -0,0 +1,159 @@
+from django.contrib.auth.models import Group, User
+from django.urls import reverse
+
+from ..forms import UploadMetaDataForm
+from ..keywords import normalize_keywords
+from ..models import Project, Upload, UploadKeyword
+from ..pagination import keyset_page
+from .base import UsersTestCase
+
+
+class TranscriptSearchTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.reviewer = self.create_user('reviewer')
+        self.project = self.create_project(
+            "Lectures", self.owner, description="talks", members=[self.owner, self.reviewer],
+        )
+        self.other = self.create_project("Secret", self.owner, description="not shared")
+        self.add_transcript(self.project, "Photosynthesis", "plants turn light into sugar. light matters. light!")
+        self.add_transcript(self.project, "Cells", "the cell membrane lets light molecules through")
+        self.add_transcript(self.other, "Hidden", "light from the hidden project")
+        Upload.objects.create(
+            name="Pending", owner=self.owner, project=self.project, file="pending.mp4",
+            transcription_job_name="job", transcription_status=Upload.TRANSCRIPTION_IN_PROGRESS,
+            transcript="light",
+        )
+        self.client.force_login(self.reviewer)
+
+    def add_transcript(self, project, name, text):
+        return Upload.objects.create(
+            name=name, owner=self.owner, project=project, file=f"{name}.mp4",
+            transcription_job_name=f"{name}-job", transcription_status=Upload.TRANSCRIPTION_COMPLETED,
+            transcript=text,
+        )
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_transcripts'), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_results_are_ranked_and_limited_to_accessible_projects(self):
+        response = self.search(q='light')
+        names = [upload.name for upload in response.context['results']]
+        self.assertEqual(names, ["Photosynthesis", "Cells"])
+        self.assertIn('<mark>light</mark>', str(response.context['results'][0].snippet))
+
+    def test_all_terms_must_match(self):
+        response = self.search(q='light sugar')
+        self.assertEqual([upload.name for upload in response.context['results']], ["Photosynthesis"])
+
+    def test_project_scoped_search_requires_access(self):
+        response = self.client.get(reverse('search_transcripts'), {'q': 'light', 'project_id': self.other.id}, secure=True)
+        self.assertEqual(response.status_code, 404)
+
+    def test_project_id_must_be_a_number(self):
+        response = self.client.get(reverse('search_transcripts'), {'q': 'light', 'project_id': 'abc'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_snippet_is_escaped(self):
+        self.add_transcript(self.project, "Markup", "<script>light</script>")
+        response = self.search(q='light', project_id=self.project.id)
+        snippets = [str(upload.snippet) for upload in response.context['results'] if upload.name == "Markup"]
+        self.assertNotIn('<script>', snippets[0])
+
+
+class UploadKeywordTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.project = self.create_project("Atlas", self.owner, description="maps", members=[self.owner])
+        self.client.force_login(self.owner)
+
+    def add_upload(self, name, keywords):
+        return Upload.objects.create(name=name, owner=self.owner, project=self.project, file=f"{name}.pdf", keywords=keywords)
+
+    def search(self, query):
+        response = self.client.get(
+            reverse('project_main_view', args=[self.project.name, self.project.id]), {'search': query}, secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_normalize_keywords(self):
+        self.assertEqual(normalize_keywords("Art, map-making;  ART history"), ['art', 'map-making', 'history'])
+        self.assertEqual(normalize_keywords(None), [])
+
+    def test_tags_follow_metadata_form_saves(self):
+        upload = self.add_upload("Sheet", "art, history")
+        self.assertCountEqual(upload.keyword_tags.values_list('keyword', flat=True), ['art', 'history'])
+
+        form = UploadMetaDataForm({'name': "Sheet", 'description': '', 'keywords': "history, rivers"}, instance=upload)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertCountEqual(upload.keyword_tags.values_list('keyword', flat=True), ['history', 'rivers'])
+        self.assertEqual(UploadKeyword.objects.get(keyword='rivers').project, self.project)
+
+    def test_search_matches_whole_tags_and_prefixes_not_substrings(self):
+        self.add_upload("First", "art")
+        self.add_upload("Second", "cartography")
+        self.add_upload("Third", "artwork, rivers")
+        names = lambda response: sorted(upload.name for upload in response.context['files'])
+        self.assertEqual(names(self.search("art")), ["First", "Third"])
+        self.assertEqual(names(self.search("cart")), ["Second"])
+        self.assertEqual(names(self.search("art rivers")), ["Third"])
+        self.assertEqual(names(self.search("seco")), ["Second"])
+
+    def test_keyword_counts(self):
+        self.add_upload("First", "art, maps")
+        self.add_upload("Second", "maps")
+        response = self.search("")
+        self.assertEqual(
+            response.context['keyword_counts'], [{'keyword': 'maps', 'count': 2}, {'keyword': 'art', 'count': 1}]
+        )
+
+
+class SearchUsersViewTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.viewer = self.create_user('viewer')
+        self.project = self.create_project("Survey", self.viewer, members=[self.viewer])
+        self.admin = self.create_user('admin')
+        self.admin.groups.add(Group.objects.create(name='PMA Administrators'))
+        for i in range(30):
+            self.create_user(f'student{i:02d}', first_name="Ada")
+        self.client.force_login(self.viewer)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_users'), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_results_are_paginated_and_admin_status_annotated(self):
+        response = self.search()
+        first_page = response.context['users']
+        self.assertEqual(len(first_page), 24)
+        self.assertTrue(next(user for user in first_page if user.username == 'admin').is_pma_admin)
+        self.assertFalse(first_page[1].is_pma_admin)
+
+        response = self.search(cursor=response.context['next_cursor'])
+        self.assertEqual(len(response.context['users']), 7)
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_sorts_are_keyed_per_model(self):
+        with self.assertRaises(KeyError):
+            keyset_page(User.objects.all(), '-created_at')
+        with self.assertRaises(KeyError):
+            keyset_page(Project.objects.all(), 'username')
+
+    def test_search_excludes_members_and_uses_fixed_number_of_queries(self):
+        member = User.objects.get(username='student00')
+        self.project.members.add(member)
+        # session, user, project, the page itself, viewer groups and the two cold badge
+        # counts; nothing per row
+        with self.assertNumQueries(7):
+            response = self.search(q='ada', project_id=self.project.id)
+        usernames = [user.username for user in response.context['users']]
+        self.assertNotIn('student00', usernames)
+        self.assertEqual(len(usernames), 24)
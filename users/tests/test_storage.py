@@ -0,0 +1,269 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils.timezone import now
+
+from .. import aws
+from ..models import Project, StoragePurge, Upload
+from ..purge import purge_keys
+from ..storage import LocalStorage
+from .base import UsersTestCase
+
+
+class AwsClientRegistryTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        aws.reset_clients()
+        self.addCleanup(aws.reset_clients)
+        # transcribe has no global endpoint, so make sure a region is configured
+        patcher = mock.patch.dict('os.environ', {'AWS_DEFAULT_REGION': 'us-east-1'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_clients_are_shared_and_tuned(self):
+        s3 = aws.get_s3_client()
+        self.assertIs(aws.get_s3_client(), s3)
+        self.assertIsNot(aws.get_transcribe_client(), s3)
+        self.assertEqual(s3.meta.config.max_pool_connections, aws.CLIENT_CONFIG.max_pool_connections)
+        self.assertTrue(s3.meta.config.tcp_keepalive)
+
+    def test_concurrent_first_use_builds_one_client(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            clients = list(pool.map(lambda _: aws.get_s3_client(), range(16)))
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
+
+class StoragePurgeTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.project = self.create_project("Doomed", self.owner)
+        self.client.force_login(self.owner)
+
+    @mock.patch('users.storage.get_s3_client')
+    def test_delete_project_queues_purge_without_touching_s3(self, s3_client):
+        self.project.rubric = "Doomed/rubrics/r.pdf"
+        self.project.save()
+        Upload.objects.create(name="Talk", owner=self.owner, project=self.project, file="talk.mp4",
+                              output_key="Doomed/talk.mp4-transcription.json")
+        response = self.client.post(reverse('delete_project', args=[self.project.name, self.project.id]), secure=True)
+        self.assertRedirects(response, reverse('project_list'), fetch_redirect_response=False)
+        self.assertFalse(Project.objects.filter(id=self.project.id).exists())
+        purge = StoragePurge.objects.get()
+        self.assertEqual((purge.prefix, purge.status), ("Doomed/", StoragePurge.PENDING))
+        self.assertEqual(purge.keys, ["Doomed/rubrics/r.pdf", "Doomed/talk.mp4", "Doomed/talk.mp4-transcription.json"])
+        s3_client.assert_not_called()
+
+    @mock.patch('users.purge.RETRY_DELAY', 0)
+    @mock.patch('users.purge.DELETE_BATCH_SIZE', 3)
+    @mock.patch('users.storage.get_s3_client')
+    def test_purge_keys_batches_and_retries_failed_keys(self, s3_client):
+        s3 = s3_client.return_value
+        s3.delete_objects.side_effect = [
+            {'Errors': [{'Key': "Doomed/1"}]}, {}, {},
+        ]
+        progress = []
+        deleted = purge_keys([f"Doomed/{i}" for i in range(4)], progress=progress.append, workers=1)
+        self.assertEqual(deleted, 4)
+        self.assertEqual(progress[-1], 4)
+        retried = s3.delete_objects.call_args_list[1].kwargs['Delete']['Objects']
+        self.assertEqual(retried, [{'Key': "Doomed/1"}])
+        self.assertEqual(s3.delete_objects.call_count, 3)
+
+    @mock.patch('users.purge.RETRY_DELAY', 0)
+    @mock.patch('users.storage.get_s3_client')
+    def test_command_runs_queued_purges(self, s3_client):
+
+        def delete_objects(Bucket, Delete):
+            if Delete['Objects'][0]['Key'].startswith("Broken/"):
+                raise OSError("delete failed")
+            return {}
+        s3 = s3_client.return_value
+        s3.get_paginator.return_value.paginate.return_value = []
+        s3.delete_objects.side_effect = delete_objects
+        purge = StoragePurge.objects.create(prefix="Doomed/", keys=["Doomed/a", "Doomed/b"])
+        failing = StoragePurge.objects.create(prefix="Broken/", keys=["Broken/a"])
+
+        call_command('purge_storage', '--once', stdout=StringIO(), stderr=StringIO())
+        purge.refresh_from_db()
+        failing.refresh_from_db()
+        self.assertEqual((purge.status, purge.objects_deleted), (StoragePurge.DONE, 2))
+        # A failed purge goes back on the queue and waits before its next attempt
+        self.assertEqual((failing.status, failing.attempts), (StoragePurge.PENDING, 1))
+        self.assertIn("delete failed", failing.error)
+
+    @mock.patch('users.storage.get_s3_client')
+    def test_purges_abandoned_while_running_are_reclaimed(self, s3_client):
+        s3 = s3_client.return_value
+        s3.get_paginator.return_value.paginate.return_value = []
+        s3.delete_objects.return_value = {}
+        abandoned = StoragePurge.objects.create(prefix="Doomed/", keys=["Doomed/a"], status=StoragePurge.RUNNING,
+                                                attempts=1)
+        live = StoragePurge.objects.create(prefix="Live/", status=StoragePurge.RUNNING, attempts=1)
+        StoragePurge.objects.filter(id=abandoned.id).update(updated_at=now() - timedelta(hours=1))
+
+        call_command('purge_storage', '--once', stdout=StringIO(), stderr=StringIO())
+        abandoned.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((abandoned.status, abandoned.attempts, abandoned.objects_deleted), (StoragePurge.DONE, 2, 1))
+        self.assertEqual(live.status, StoragePurge.RUNNING)
+
+    @mock.patch('users.storage.get_s3_client')
+    def test_abandoned_last_attempts_fail_instead_of_running_again(self, s3_client):
+        s3_client.return_value.get_paginator.return_value.paginate.return_value = []
+        exhausted = StoragePurge.objects.create(prefix="Doomed/", keys=["Doomed/a"], status=StoragePurge.RUNNING,
+                                                attempts=StoragePurge.MAX_ATTEMPTS)
+        StoragePurge.objects.filter(id=exhausted.id).update(updated_at=now() - timedelta(hours=1))
+
+        call_command('purge_storage', '--once', stdout=StringIO(), stderr=StringIO())
+        exhausted.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.attempts), (StoragePurge.FAILED, StoragePurge.MAX_ATTEMPTS))
+        self.assertIsNotNone(exhausted.error)
+        s3_client.return_value.delete_objects.assert_not_called()
+
+
+@mock.patch('users.storage.get_s3_client')
+class ReconcileStorageTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = self.create_user('owner')
+        project = self.create_project("Alpha", owner, rubric="Alpha/rubrics/r.pdf")
+        Upload.objects.create(name="Talk", owner=owner, project=project, file="talk.mp4",
+                              output_key="Alpha/talk.mp4-transcription.json")
+        Upload.objects.create(name="Notes", owner=owner, project=project, file="notes.pdf")
+        old, recent = now() - timedelta(days=3), now()
+        self.pages = [
+            {'Contents': [
+                {'Key': "Alpha/gone.pdf", 'Size': 10, 'LastModified': old},
+                {'Key': "Alpha/notes.pdf", 'Size': 5, 'LastModified': old},
+                {'Key': "Alpha/rubrics/r.pdf", 'Size': 5, 'LastModified': old},
+            ]},
+            {'Contents': [
+                {'Key': "Alpha/talk.mp4", 'Size': 5, 'LastModified': old},
+                {'Key': "Alpha/talk.mp4-transcription.json", 'Size': 5, 'LastModified': old},
+                {'Key': "Alpha/uploading.mp4", 'Size': 7, 'LastModified': recent},
+                {'Key': "Beta/old.mp4-transcription.json", 'Size': 20, 'LastModified': old},
+            ]},
+        ]
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_storage', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_reports_unreferenced_objects_only(self, s3_client):
+        s3_client.return_value.get_paginator.return_value.paginate.return_value = self.pages
+        output = self.reconcile('--dry-run')
+        self.assertIn("Orphaned: Alpha/gone.pdf", output)
+        self.assertIn("Orphaned: Beta/old.mp4-transcription.json", output)
+        self.assertIn("Found 2 orphaned object(s), 30 bytes.", output)
+        self.assertNotIn("uploading.mp4", output)
+        s3_client.return_value.delete_objects.assert_not_called()
+
+    def test_deletes_orphans_in_batches(self, s3_client):
+        s3_client.return_value.get_paginator.return_value.paginate.return_value = self.pages
+        s3_client.return_value.delete_objects.return_value = {}
+        with mock.patch('users.management.commands.reconcile_storage.DELETE_BATCH_SIZE', 1):
+            output = self.reconcile()
+        deleted = [call.kwargs['Delete']['Objects'] for call in s3_client.return_value.delete_objects.call_args_list]
+        self.assertEqual(deleted, [[{'Key': "Alpha/gone.pdf"}], [{'Key': "Beta/old.mp4-transcription.json"}]])
+        self.assertIn("Deleted 2 object(s).", output)
+
+
+@mock.patch('users.uploads.start_transcription_job', return_value=True)
+class LocalStorageTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name)
+        patcher = mock.patch('users.storage._storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = self.create_user('owner')
+        self.project = self.create_project("Local", self.owner, members=[self.owner])
+        self.client.force_login(self.owner)
+
+    def save(self, key, data):
+        self.storage.save(key, BytesIO(data))
+
+    def test_save_open_list_and_delete(self, start_job):
+        for key in ["Local/b.pdf", "Local/a.pdf", "Local/sub/c.pdf", "Localish/d.pdf"]:
+            self.save(key, key.encode())
+        stream, size = self.storage.open("Local/a.pdf")
+        with stream:
+            self.assertEqual((stream.read(), size), (b"Local/a.pdf", 11))
+        self.assertIsNone(self.storage.size("Local/missing.pdf"))
+
+        keys = [obj.key for page in self.storage.list_pages("Local/") for obj in page]
+        self.assertEqual(keys, ["Local/a.pdf", "Local/b.pdf", "Local/sub/c.pdf"])
+        self.assertEqual(self.storage.delete_many(["Local/a.pdf", "Local/missing.pdf"]), [])
+        self.assertIsNone(self.storage.size("Local/a.pdf"))
+        with self.assertRaises(ValueError):
+            self.storage.save("../outside.pdf", None)
+
+    def test_signed_urls_serve_files_until_they_expire(self, start_job):
+        self.save("Local/notes.pdf", b"%PDF")
+        self.client.logout()
+        url = self.storage.url("Local/notes.pdf", 'application/pdf', 'inline')
+        response = self.client.get(url, secure=True)
+        self.assertEqual(b''.join(response.streaming_content), b"%PDF")
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        self.assertEqual(self.client.get(url[:-3] + 'abc/', secure=True).status_code, 404)
+        expired = self.storage.url("Local/notes.pdf", expires=-1)
+        self.assertEqual(self.client.get(expired, secure=True).status_code, 404)
+
+    def test_direct_upload_goes_through_the_local_policy(self, start_job):
+        details = {'name': "Lecture", 'description': "week 1", 'keywords': "", 'file_name': "lecture.mp4",
+                   'content_type': "video/mp4"}
+        post = self.client.post(reverse('presign_project_upload', args=[self.project.name, self.project.id]),
+                                details, secure=True).json()
+
+        def send(key, content_type='video/mp4', data=b"video"):
+            file = SimpleUploadedFile("lecture.mp4", data, content_type=content_type)
+            return self.client.post(post['url'], {**post['fields'], 'key': key, 'file': file}, secure=True)
+
+        key = post['key']
+        self.assertEqual(send("Local/lecture.mp4").status_code, 403)
+        self.assertEqual(send(key, content_type='text/html').status_code, 400)
+        self.assertIsNone(self.storage.size(key))
+        self.assertEqual(send(key).status_code, 204)
+
+        response = self.client.post(reverse('complete_project_upload', args=[self.project.name, self.project.id]),
+                                    {**details, 'upload_token': post['upload_token']}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Upload.objects.get().storage_key(self.project.name), key)
+        self.assertEqual(self.storage.size(key), 5)
+
+    def test_purging_a_project_keeps_files_of_projects_with_the_same_name(self, start_job):
+        other = self.create_project("Local", self.create_user('other'))
+        self.project.rubric = "Local/rubrics/rubric.pdf"
+        self.project.save()
+        other.rubric = "Local/rubrics/rubric.pdf"
+        other.save()
+        Upload.objects.create(name="Mine", owner=self.owner, project=self.project, file="mine.pdf")
+        Upload.objects.create(name="Theirs", owner=other.owner, project=other, file="theirs.pdf")
+        for key in ["Local/mine.pdf", "Local/theirs.pdf", "Local/rubrics/rubric.pdf"]:
+            self.save(key, b"data")
+
+        self.client.post(reverse('delete_project', args=[self.project.name, self.project.id]), secure=True)
+        call_command('purge_storage', '--once', stdout=StringIO(), stderr=StringIO())
+        self.assertIsNone(self.storage.size("Local/mine.pdf"))
+        self.assertEqual(self.storage.size("Local/theirs.pdf"), 4)
+        self.assertEqual(self.storage.size("Local/rubrics/rubric.pdf"), 4)
+
+    def test_batch_upload_stores_blobs_on_disk(self, start_job):
+        files = [SimpleUploadedFile(name, b"same slides") for name in ["one.pdf", "two.pdf"]]
+        response = self.client.post(reverse('batch_project_upload', args=[self.project.name, self.project.id]),
+                                    {'files': files}, secure=True)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['uploaded', 'uploaded'])
+        keys = [obj.key for page in self.storage.list_pages("blobs/") for obj in page]
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(set(Upload.objects.values_list('blob_id', flat=True)), set(keys))
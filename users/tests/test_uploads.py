@@ -0,0 +1,401 @@
+import json
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from botocore.exceptions import ClientError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from ..blobs import blob_key, collect_unreferenced_blobs
+from ..models import Blob, Upload
+from .base import UsersTestCase
+
+
+@mock.patch('users.uploads.start_transcription_job', return_value=True)
+@mock.patch('users.storage.get_s3_client')
+class DirectUploadTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.project = self.create_project("Direct", self.owner, members=[self.owner])
+        self.client.force_login(self.owner)
+        self.details = {'name': "Lecture", 'description': "week 1", 'keywords': "audio", 'file_name': "lecture.mp4",
+                        'content_type': "video/mp4"}
+
+    def post(self, step, project=None, **overrides):
+        project = project or self.project
+        url = reverse(f'{step}_project_upload', args=[project.name, project.id])
+        return self.client.post(url, {**self.details, **overrides}, secure=True)
+
+    def upload(self, s3_client, project=None, **overrides):
+        # Both steps, as the browser does them; returns the complete response and the key
+        s3_client.return_value.generate_presigned_post.return_value = {'url': 'https://bucket', 'fields': {}}
+        presigned = self.post('presign', project, **overrides).json()
+        return self.post('complete', project, upload_token=presigned['upload_token'], **overrides), presigned['key']
+
+    def test_presign_returns_constrained_post_for_project_key(self, s3_client, start_job):
+        s3_client.return_value.generate_presigned_post.return_value = {'url': 'https://bucket', 'fields': {}}
+        response = self.post('presign')
+        self.assertEqual(response.status_code, 200)
+        key = response.json()['key']
+        self.assertRegex(key, r"^Direct/[0-9a-f]{32}/lecture\.mp4$")
+        kwargs = s3_client.return_value.generate_presigned_post.call_args.kwargs
+        self.assertEqual(kwargs['Key'], key)
+        self.assertIn({'Content-Type': 'video/mp4'}, kwargs['Conditions'])
+        self.assertEqual(kwargs['Conditions'][1][0], 'content-length-range')
+        self.assertFalse(Upload.objects.exists())
+
+    def test_presign_rejects_bad_names_and_outsiders(self, s3_client, start_job):
+        self.assertEqual(self.post('presign', file_name="../other/secret.mp4").status_code, 400)
+        Upload.objects.create(name="Lecture", owner=self.owner, project=self.project, file="old.mp4")
+        self.assertIn('name', self.post('presign').json()['errors'])
+
+        self.client.force_login(self.create_user('outsider'))
+        self.assertEqual(self.post('presign').status_code, 403)
+        s3_client.return_value.generate_presigned_post.assert_not_called()
+
+    def test_complete_records_upload_and_starts_transcription(self, s3_client, start_job):
+        s3_client.return_value.head_object.return_value = {'ContentLength': 1024}
+        response, key = self.upload(s3_client)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(s3_client.return_value.head_object.call_args.kwargs['Key'], key)
+        upload = Upload.objects.get(name="Lecture")
+        self.assertEqual(upload.storage_key(self.project.name), key)
+        self.assertEqual(upload.owner, self.owner)
+        self.assertEqual(upload.output_key, f"{key}-transcription.json")
+        self.assertEqual(upload.transcription_status, Upload.TRANSCRIPTION_QUEUED)
+        self.assertTrue(start_job.call_args.args[1].endswith(f"/{key}"))
+        self.assertNotIn("/", start_job.call_args.args[0])
+        self.assertEqual(list(upload.keyword_tags.values_list('keyword', flat=True)), ['audio'])
+
+    def test_same_file_names_get_keys_of_their_own(self, s3_client, start_job):
+        s3_client.return_value.head_object.return_value = {'ContentLength': 1024}
+        namesake = self.create_project("Direct", self.create_user('other'), members=[self.owner])
+        Upload.objects.create(name="Theirs", owner=self.owner, project=namesake, file="lecture.mp4",
+                              output_key="Direct/lecture.mp4-transcription.json")
+        _, first = self.upload(s3_client)
+        _, second = self.upload(s3_client, name="Again")
+        _, third = self.upload(s3_client, namesake, name="Mine")
+        taken = {"Direct/lecture.mp4", "Direct/lecture.mp4-transcription.json"}
+        keys = {first, second, third}
+        self.assertEqual(len(keys), 3)
+        self.assertFalse(keys & taken)
+        self.assertFalse(set(Upload.objects.exclude(name="Theirs").values_list('output_key', flat=True)) & taken)
+
+    def test_complete_only_accepts_the_presigned_name(self, s3_client, start_job):
+        s3_client.return_value.head_object.return_value = {'ContentLength': 1024}
+        s3_client.return_value.generate_presigned_post.return_value = {'url': 'https://bucket', 'fields': {}}
+        token = self.post('presign').json()['upload_token']
+        self.assertEqual(self.post('complete').status_code, 400)
+        self.assertEqual(self.post('complete', upload_token="forged").status_code, 400)
+        self.assertEqual(self.post('complete', upload_token=token, file_name="other.mp4").status_code, 400)
+        other = self.create_project("Elsewhere", self.owner, members=[self.owner])
+        self.assertEqual(self.post('complete', other, upload_token=token).status_code, 400)
+        self.assertFalse(Upload.objects.exists())
+
+    def test_keys_use_the_stored_project_name(self, s3_client, start_job):
+        s3_client.return_value.head_object.return_value = {'ContentLength': 1024}
+        self.project.name = "DIRECT"
+        response, key = self.upload(s3_client)
+        self.project.name = "Direct"
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(key.startswith("Direct/"))
+        self.assertEqual(s3_client.return_value.head_object.call_args.kwargs['Key'], key)
+        self.assertTrue(Upload.objects.get().output_key.startswith("Direct/"))
+
+    def test_complete_requires_the_object_in_s3(self, s3_client, start_job):
+        s3_client.return_value.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        self.assertEqual(self.upload(s3_client)[0].status_code, 400)
+        self.assertFalse(Upload.objects.exists())
+        start_job.assert_not_called()
+
+
+@mock.patch('users.uploads.start_transcription_job', return_value=True)
+@mock.patch('users.storage.get_s3_client')
+class BatchUploadTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.project = self.create_project("Batch", self.owner, members=[self.owner])
+        self.client.force_login(self.owner)
+
+    def post(self, files, **fields):
+        data = {'files': [SimpleUploadedFile(name, name.encode()) for name in files], **fields}
+        return self.client.post(reverse('batch_project_upload', args=[self.project.name, self.project.id]), data, secure=True)
+
+    def test_batch_creates_uploads_with_per_file_results(self, s3_client, start_job):
+        Upload.objects.create(name="Taken", owner=self.owner, project=self.project, file="taken.pdf")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(
+                ['slides.pdf', 'talk.mp4', 'dupe.pdf', 'other.pdf'],
+                name=['Slides', '', 'Taken', 'Slides'], keywords=['week1', 'audio', '', ''],
+            )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['uploaded', 'uploaded', 'error', 'error'])
+        self.assertIn("already exists", results[2]['error'])
+        self.assertIn("same name", results[3]['error'])
+
+        self.assertEqual(s3_client.return_value.upload_fileobj.call_count, 2)
+        talk = Upload.objects.get(name="talk.mp4")
+        self.assertEqual(talk.transcription_status, Upload.TRANSCRIPTION_QUEUED)
+        self.assertEqual(list(talk.keyword_tags.values_list('keyword', flat=True)), ['audio'])
+        self.assertEqual(Upload.objects.get(name="Slides").transcription_status, None)
+        start_job.assert_called_once()
+
+    def test_failed_transfers_are_reported_and_not_recorded(self, s3_client, start_job):
+        def transfer(file, bucket, key):
+            if file.name == 'broken.pdf':
+                raise OSError("connection reset")
+        s3_client.return_value.upload_fileobj.side_effect = transfer
+        results = self.post(['fine.pdf', 'broken.pdf']).json()['results']
+        self.assertEqual([result['status'] for result in results], ['uploaded', 'error'])
+        self.assertEqual(list(Upload.objects.values_list('name', flat=True)), ['fine.pdf'])
+
+    def test_no_jobs_are_started_when_the_rows_cannot_be_written(self, s3_client, start_job):
+        with mock.patch('users.uploads.create_keyword_tags', side_effect=IntegrityError), \
+                self.captureOnCommitCallbacks(execute=True):
+            results = self.post(['talk.mp4']).json()['results']
+        self.assertEqual(results[0]['status'], 'error')
+        self.assertIn("already exists", results[0]['error'])
+        self.assertFalse(Upload.objects.exists())
+        start_job.assert_not_called()
+
+    def test_name_uniqueness_is_checked_in_one_query(self, s3_client, start_job):
+        with CaptureQueriesContext(connection) as queries:
+            self.post([f'file{i}.pdf' for i in range(10)])
+        upload_selects = [query for query in queries if query['sql'].startswith('SELECT') and '"users_upload"' in query['sql']]
+        self.assertEqual(len(upload_selects), 1)
+        self.assertEqual(Upload.objects.count(), 10)
+
+
+@mock.patch('users.uploads.start_transcription_job', return_value=True)
+@mock.patch('users.storage.get_s3_client')
+class BlobStorageTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.first = self.create_project("First", self.owner)
+        self.second = self.create_project("Second", self.owner)
+        self.client.force_login(self.owner)
+
+    def upload(self, project, file_name, content=b'lecture'):
+        self.client.post(reverse('project_upload', args=[project.name, project.id]), {
+            'name': file_name, 'file': SimpleUploadedFile(file_name, content),
+        }, secure=True)
+        return Upload.objects.get(project=project, name=file_name)
+
+    def test_identical_content_is_stored_once(self, s3_client, start_job):
+        first = self.upload(self.first, "rubric.pdf")
+        second = self.upload(self.second, "copy.pdf")
+        other = self.upload(self.second, "other.pdf", b'different')
+
+        self.assertEqual(s3_client.return_value.upload_fileobj.call_count, 2)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertTrue(first.blob_id.startswith('blobs/') and first.blob_id.endswith('.pdf'))
+        self.assertEqual(second.storage_key("Second"), first.blob_id)
+        self.assertNotEqual(other.blob_id, first.blob_id)
+        self.assertEqual(Blob.objects.get(key=first.blob_id).ref_count, 2)
+        self.assertEqual(first.thumbnail_status, Upload.THUMBNAIL_PENDING)
+
+    def test_only_short_plain_extensions_are_kept_on_keys(self, s3_client, start_job):
+        digest = 'a' * 64
+        self.assertEqual(blob_key(digest, "Slides.PDF"), f"blobs/{digest}.pdf")
+        self.assertEqual(blob_key(digest, "notes"), f"blobs/{digest}")
+        self.assertEqual(blob_key(digest, "archive." + "x" * 200), f"blobs/{digest}")
+        self.assertEqual(blob_key(digest, "odd.p df"), f"blobs/{digest}")
+
+        upload = self.upload(self.first, "export." + "y" * 60)
+        self.assertEqual(len(upload.blob_id), len(f"blobs/{digest}"))
+
+    def test_transcript_is_reused_for_the_same_media(self, s3_client, start_job):
+        first = self.upload(self.first, "talk.mp4")
+        start_job.assert_called_once()
+        Upload.objects.filter(id=first.id).update(
+            transcription_status=Upload.TRANSCRIPTION_COMPLETED, transcript="hello class"
+        )
+
+        second = self.upload(self.second, "talk.mp4")
+        start_job.assert_called_once()
+        self.assertEqual(second.transcription_status, Upload.TRANSCRIPTION_COMPLETED)
+        self.assertEqual(second.transcript, "hello class")
+        self.assertEqual(second.transcription_job_name, first.transcription_job_name)
+
+    def test_blob_is_deleted_after_its_last_reference(self, s3_client, start_job):
+        first = self.upload(self.first, "rubric.pdf")
+        self.upload(self.second, "copy.pdf")
+        key = first.blob_id
+
+        self.client.post(reverse('delete_file', args=["First", self.first.id, first.id]), secure=True)
+        self.assertEqual(Blob.objects.get(key=key).ref_count, 1)
+        self.second.delete()
+        self.assertEqual(Blob.objects.get(key=key).ref_count, 0)
+
+        with mock.patch('users.storage.get_s3_client') as delete_client:
+            delete_client.return_value.delete_objects.return_value = {}
+            # Recently released blobs are kept for the grace period
+            self.assertEqual(collect_unreferenced_blobs(), 0)
+            Blob.objects.filter(key=key).update(updated_at=now() - timedelta(days=1))
+            self.assertEqual(collect_unreferenced_blobs(), 1)
+        deleted = delete_client.return_value.delete_objects.call_args.kwargs['Delete']['Objects']
+        self.assertEqual(deleted, [
+            {'Key': key}, {'Key': f"{key}-transcription.json"}, {'Key': f"{key}-thumbnail.webp"},
+        ])
+        self.assertFalse(Blob.objects.filter(key=key).exists())
+        s3_client.return_value.delete_object.assert_not_called()
+
+
+@mock.patch('users.thumbnails.render_thumbnail', return_value=b'webp')
+@mock.patch('users.storage.get_s3_client')
+class ThumbnailTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.project = self.create_project("Gallery", self.owner, members=[self.owner])
+        self.blob = Blob.objects.create(key="blobs/abc.pdf", size=10)
+
+    def add_upload(self, name, **fields):
+        return Upload.objects.create(name=name, owner=self.owner, project=self.project, file=name, **fields)
+
+    def run_worker(self):
+        call_command('generate_thumbnails', '--once', stdout=StringIO(), stderr=StringIO())
+
+    def test_worker_renders_and_shares_renditions(self, s3_client, render):
+        s3 = s3_client.return_value
+        s3.head_object.return_value = {'ContentLength': 4}
+        s3.get_object.side_effect = lambda **kwargs: {'ContentLength': 4, 'Body': BytesIO(b'%PDF')}
+        first = self.add_upload("slides.pdf", blob=self.blob, thumbnail_status=Upload.THUMBNAIL_PENDING)
+        second = self.add_upload("copy.pdf", blob=self.blob, thumbnail_status=Upload.THUMBNAIL_PENDING)
+        photo = self.add_upload("photo.jpg", thumbnail_status=Upload.THUMBNAIL_PENDING)
+        self.run_worker()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        photo.refresh_from_db()
+        self.assertEqual((first.thumbnail_status, first.thumbnail_key), (Upload.THUMBNAIL_READY, "blobs/abc.pdf-thumbnail.webp"))
+        self.assertEqual(second.thumbnail_key, first.thumbnail_key)
+        self.assertEqual(photo.thumbnail_key, "Gallery/photo.jpg-thumbnail.webp")
+        # The shared blob was only downloaded and rendered once
+        self.assertEqual(s3.get_object.call_count, 2)
+        self.assertEqual(render.call_args_list[0].args, (b'%PDF', 'pdf'))
+        self.assertEqual(s3.upload_fileobj.call_args.kwargs['ExtraArgs']['ContentType'], 'image/webp')
+
+    def test_unrenderable_and_oversized_files_fail(self, s3_client, render):
+        s3 = s3_client.return_value
+        sizes = {"Gallery/broken.png": 4, "Gallery/huge.jpg": 10 ** 9}
+        s3.head_object.side_effect = lambda Bucket, Key: {'ContentLength': sizes[Key]}
+        s3.get_object.return_value = {'ContentLength': 4, 'Body': BytesIO(b'junk')}
+        render.side_effect = OSError("cannot identify image file")
+        broken = self.add_upload("broken.png", thumbnail_status=Upload.THUMBNAIL_PENDING)
+        huge = self.add_upload("huge.jpg", thumbnail_status=Upload.THUMBNAIL_PENDING)
+        self.run_worker()
+        for upload in (broken, huge):
+            upload.refresh_from_db()
+            self.assertEqual((upload.thumbnail_status, upload.thumbnail_key), (Upload.THUMBNAIL_FAILED, None))
+        self.assertEqual(render.call_count, 1)
+        # The oversized file was never downloaded
+        self.assertEqual([call.kwargs['Key'] for call in s3.get_object.call_args_list], ["Gallery/broken.png"])
+        s3.upload_fileobj.assert_not_called()
+
+    def test_storage_errors_are_retried_before_failing(self, s3_client, render):
+        s3_client.return_value.get_object.side_effect = OSError("connection reset")
+        upload = self.add_upload("photo.jpg", thumbnail_status=Upload.THUMBNAIL_PENDING)
+        self.run_worker()
+        upload.refresh_from_db()
+        self.assertEqual((upload.thumbnail_status, upload.thumbnail_attempts), (Upload.THUMBNAIL_PENDING, 1))
+
+        Upload.objects.filter(id=upload.id).update(thumbnail_attempts=Upload.THUMBNAIL_MAX_ATTEMPTS - 1)
+        self.run_worker()
+        upload.refresh_from_db()
+        self.assertEqual(upload.thumbnail_status, Upload.THUMBNAIL_FAILED)
+        render.assert_not_called()
+
+    def test_project_page_serves_renditions_and_queues_missing_ones(self, s3_client, render):
+        presign_client = s3_client
+        presign_client.return_value.generate_presigned_url.return_value = 'https://signed/thumb.webp'
+        self.add_upload("ready.jpg", thumbnail_status=Upload.THUMBNAIL_READY, thumbnail_key="Gallery/ready.jpg-thumbnail.webp")
+        old = self.add_upload("old.png")
+        notes = self.add_upload("notes.txt")
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('project_main_view', args=[self.project.name, self.project.id]), secure=True)
+
+        self.assertContains(response, 'src="https://signed/thumb.webp"', count=1)
+        params = presign_client.return_value.generate_presigned_url.call_args.kwargs['Params']
+        self.assertEqual(params['Key'], "Gallery/ready.jpg-thumbnail.webp")
+        old.refresh_from_db()
+        notes.refresh_from_db()
+        self.assertEqual(old.thumbnail_status, Upload.THUMBNAIL_PENDING)
+        self.assertIsNone(notes.thumbnail_status)
+
+    def test_popular_cards_only_show_renditions_to_members(self, s3_client, render):
+        s3_client.return_value.generate_presigned_url.return_value = 'https://signed/thumb.webp'
+        self.add_upload("ready.jpg", thumbnail_status=Upload.THUMBNAIL_READY, thumbnail_key="Gallery/ready.jpg-thumbnail.webp")
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(reverse('popular_projects'), secure=True), 'src="https://signed/thumb.webp"')
+
+        self.client.force_login(self.create_user('outsider'))
+        response = self.client.get(reverse('popular_projects'), secure=True)
+        self.assertContains(response, "Gallery")
+        self.assertNotContains(response, 'https://signed/thumb.webp')
+
+
+class PollTranscriptionsCommandTest(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('speaker')
+        self.project = self.create_project("Talks", self.user, description="talks")
+        self.upload = Upload.objects.create(
+            name="Talk", owner=self.user, project=self.project, file="talk.mp4",
+            transcription_job_name="talk-job", output_key="Talks/talk.mp4-transcription.json",
+            transcription_status=Upload.TRANSCRIPTION_QUEUED,
+        )
+        self.transcribe = mock.Mock()
+        self.s3 = mock.Mock()
+        transcript = json.dumps({'results': {'transcripts': [{'transcript': 'hello world'}]}}).encode('utf-8')
+        self.s3.get_object.side_effect = lambda **kwargs: {'Body': BytesIO(transcript), 'ContentLength': len(transcript)}
+        for target, client in (
+            ('users.management.commands.poll_transcriptions.get_transcribe_client', self.transcribe),
+            ('users.storage.get_s3_client', self.s3),
+        ):
+            patcher = mock.patch(target, return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_poller(self):
+        call_command('poll_transcriptions', '--once', stdout=StringIO(), stderr=StringIO())
+        self.upload.refresh_from_db()
+
+    def job_status(self, status):
+        self.transcribe.get_transcription_job.return_value = {'TranscriptionJob': {'TranscriptionJobStatus': status}}
+
+    def test_completed_transcript_is_stored_once(self):
+        self.job_status('COMPLETED')
+        self.run_poller()
+        self.assertEqual(self.upload.transcription_status, Upload.TRANSCRIPTION_COMPLETED)
+        self.assertEqual(self.upload.transcript, 'hello world')
+
+        self.run_poller()
+        self.assertEqual(self.transcribe.get_transcription_job.call_count, 1)
+        self.assertEqual(self.s3.get_object.call_count, 1)
+
+    def test_in_progress_job_stays_pending(self):
+        self.job_status('IN_PROGRESS')
+        self.run_poller()
+        self.assertEqual(self.upload.transcription_status, Upload.TRANSCRIPTION_IN_PROGRESS)
+        self.assertIsNotNone(self.upload.transcription_checked_at)
+        self.assertFalse(self.s3.get_object.called)
+
+    def test_refresh_endpoint_reads_the_database(self):
+        self.upload.transcription_status = Upload.TRANSCRIPTION_COMPLETED
+        self.upload.transcript = 'stored text'
+        self.upload.save()
+        response = self.client.get(
+            reverse('refresh_transcription', args=['talk-job', self.upload.id]), secure=True
+        )
+        self.assertEqual(response.json(), {'status': 'completed', 'transcription': 'stored text'})
+        self.assertFalse(self.transcribe.get_transcription_job.called)
@@ -0,0 +1,119 @@
+import io
+
+from .models import Upload
+from .presign import presigned_url
+from .storage import get_storage
+
+# Renditions fit in this box, about 10-30 KB as WebP
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_CONTENT_TYPE = 'image/webp'
+# Renditions never change once written, so browsers may keep them
+THUMBNAIL_CACHE_CONTROL = 'max-age=31536000, immutable'
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp']
+PDF_EXTENSION = 'pdf'
+
+# Originals bigger than this are not downloaded just to make a thumbnail
+MAX_THUMBNAIL_SOURCE_SIZE = 50 * 1024 * 1024  # 50 MB
+
+
+def has_rendition(upload):
+    extension = upload.file.name.split('.')[-1].lower()
+    return extension in IMAGE_EXTENSIONS or extension == PDF_EXTENSION
+
+
+def thumbnail_key_for(storage_key):
+    # Stored next to the original, so project purges and blob collection take it along
+    return f'{storage_key}-thumbnail.webp'
+
+
+def render_thumbnail(data, extension):
+    """WebP thumbnail of an image, or of the first page of a PDF, that fits in THUMBNAIL_SIZE."""
+    # Only the generate_thumbnails worker renders, the web process never imports these
+    from PIL import Image
+
+    if extension == PDF_EXTENSION:
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(data)
+        try:
+            page = pdf[0]
+            # Twice the final width, then scaled down for smoother text
+            image = page.render(scale=THUMBNAIL_SIZE[0] * 2 / page.get_width()).to_pil()
+        finally:
+            pdf.close()
+    else:
+        image = Image.open(io.BytesIO(data))
+
+    image.thumbnail(THUMBNAIL_SIZE)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    output = io.BytesIO()
+    image.save(output, 'WEBP', quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def generate_thumbnail(upload, storage=None):
+    """
+    Render and store the thumbnail of a pending upload and record the outcome on it.
+
+    Uploads of the same blob share one rendition, so a blob is only rendered once.
+    ``upload.project`` should already be loaded. Returns the stored status; storage
+    errors are raised for the caller to handle.
+    """
+    shared_key = None
+    if upload.blob_id:
+        shared_key = Upload.objects.filter(
+            blob_id=upload.blob_id, thumbnail_status=Upload.THUMBNAIL_READY
+        ).values_list('thumbnail_key', flat=True).first()
+
+    if shared_key:
+        key, status = shared_key, Upload.THUMBNAIL_READY
+    else:
+        storage = storage or get_storage()
+        source_key = upload.storage_key(upload.project.name)
+        key, status = thumbnail_key_for(source_key), Upload.THUMBNAIL_FAILED
+        # Checked before opening, so oversized files are never downloaded. A missing
+        # file (None) is left to open() to raise
+        size = storage.size(source_key)
+        if size is not None and size > MAX_THUMBNAIL_SOURCE_SIZE:
+            print(f'Not making a thumbnail of {source_key}, it is {size} bytes')
+        else:
+            stream, _ = storage.open(source_key)
+            with stream:
+                data = stream.read()
+            try:
+                thumbnail = render_thumbnail(data, upload.file.name.split('.')[-1].lower())
+            except Exception as e:
+                # Corrupt or unsupported files are not retried
+                print(f'Error rendering thumbnail of {source_key}: {e}')
+            else:
+                storage.save(key, io.BytesIO(thumbnail), THUMBNAIL_CONTENT_TYPE, THUMBNAIL_CACHE_CONTROL)
+                status = Upload.THUMBNAIL_READY
+
+    upload.thumbnail_status = status
+    upload.thumbnail_key = key if status == Upload.THUMBNAIL_READY else None
+    upload.save(update_fields=['thumbnail_status', 'thumbnail_key'])
+    return status
+
+
+def attach_thumbnails(uploads):
+    """
+    Set ``thumbnail_url`` on each upload, a presigned link to its rendition or None.
+
+    Uploads that could have a rendition but were never queued (older uploads) are
+    queued for the generate_thumbnails worker now, in one query, and show up with a
+    thumbnail on a later visit.
+    """
+    missing = []
+    for upload in uploads:
+        upload.thumbnail_url = None
+        if upload.thumbnail_status == Upload.THUMBNAIL_READY:
+            upload.thumbnail_url = presigned_url(upload.thumbnail_key, THUMBNAIL_CONTENT_TYPE, 'inline')
+        elif upload.thumbnail_status is None and has_rendition(upload):
+            upload.thumbnail_status = Upload.THUMBNAIL_PENDING
+            missing.append(upload.id)
+    if missing:
+        Upload.objects.filter(id__in=missing, thumbnail_status=None).update(thumbnail_status=Upload.THUMBNAIL_PENDING)
+    return uploads
@@ -0,0 +1,140 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from mysite.settings import SERVER_TIMING_HEADER
+
+logger = logging.getLogger(__name__)
+
+# What a request spent its time on, in the order they appear in the Server-Timing header
+METRICS = {
+    'db': 'queries',
+    'aws': 'AWS calls',
+    'presign': 'URLs signed',
+    'template': 'templates rendered',
+}
+
+# Timings of the request being handled; sync views run in the thread that set it
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.counts = dict.fromkeys(METRICS, 0)
+        self.seconds = dict.fromkeys(METRICS, 0.0)
+
+    def add(self, metric, seconds):
+        self.counts[metric] += 1
+        self.seconds[metric] += seconds
+
+
+@contextmanager
+def timed(metric):
+    """Count the block as one ``metric`` operation of the current request, if there is one."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(metric, time.perf_counter() - start)
+
+
+def _time_query(execute, sql, params, many, context):
+    # connection.execute_wrapper hook
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+def _start_aws_call(context, **kwargs):
+    context['timing_start'] = time.perf_counter()
+
+
+def _end_aws_call(context, **kwargs):
+    timings = _current.get()
+    start = context.pop('timing_start', None)
+    if timings is not None and start is not None:
+        timings.add('aws', time.perf_counter() - start)
+
+
+def register_aws_timing(client):
+    # Called by users.aws for every client it builds. Calls made from other threads
+    # (such as s3transfer's upload workers) are not counted
+    events = client.meta.events
+    events.register('before-call.*.*', _start_aws_call)
+    events.register('after-call.*.*', _end_aws_call)
+    events.register('after-call-error.*.*', _end_aws_call)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The regular Django template backend, with rendering time counted per request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def server_timing_header(timings, total):
+    entries = [
+        f'{metric};dur={timings.seconds[metric] * 1000:.1f};desc="{timings.counts[metric]} {label}"'
+        for metric, label in METRICS.items()
+    ]
+    return ', '.join(entries + [f'total;dur={total * 1000:.1f}'])
+
+
+class ServerTimingMiddleware:
+    """
+    Time each request's SQL queries, AWS calls, URL signing and template rendering.
+
+    The totals are logged as one JSON line tagged with the URL name, so slow pages
+    can be broken down from the logs. Staff, or everyone with SERVER_TIMING_HEADER,
+    also get them in a Server-Timing header (shown in the devtools network panel).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_time_query):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+
+        user = getattr(request, 'user', None)
+        if SERVER_TIMING_HEADER or (user is not None and user.is_staff):
+            response['Server-Timing'] = server_timing_header(timings, total)
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'event': 'request_timing',
+            'url_name': match.url_name if match else None,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            **{f'{metric}_count': timings.counts[metric] for metric in METRICS},
+            **{f'{metric}_ms': round(timings.seconds[metric] * 1000, 1) for metric in METRICS},
+        }))
+        return response
@@ -0,0 +1,76 @@
+import json
+
+from django.utils.timezone import now
+
+from mysite.settings import AWS_STORAGE_BUCKET_NAME
+from .aws import get_transcribe_client
+from .models import Upload
+from .search import index_transcript
+from .storage import get_storage
+
+TRANSCRIBABLE_EXTENSIONS = ['mp3', 'mp4', 'wav', 'flac']
+
+# Text shown in place of a transcript that is not ready yet
+TRANSCRIBING_TEXT = "Transcribing..."
+TRANSCRIPTION_FAILED_TEXT = "Transcription failed."
+
+
+def start_transcription_job(job_name, file_uri, output_key):
+    """Start an AWS Transcribe job, returning True if it was accepted."""
+    transcribe_client = get_transcribe_client()
+    try:
+        response = transcribe_client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            Media={'MediaFileUri': file_uri},
+            MediaFormat='mp4',
+            LanguageCode='en-US',
+            OutputBucketName=AWS_STORAGE_BUCKET_NAME,
+            OutputKey=output_key,
+        )
+        print(f'Started transcription job: {response}')
+        return True
+    except Exception as e:
+        print(f'Error starting transcription job: {e}')
+        return False
+
+
+def fetch_transcript(output_key):
+    # Transcribe writes its result as JSON next to the upload
+    stream, _ = get_storage().open(output_key)
+    with stream:
+        transcription_data = json.loads(stream.read().decode('utf-8'))
+    return transcription_data['results']['transcripts'][0]['transcript']
+
+
+def poll_transcription(upload, transcribe_client=None):
+    """
+    Ask Transcribe for the status of an upload's job and store the outcome on the upload.
+
+    The transcript is downloaded from S3 once, when the job completes; after that the
+    upload is no longer pending and is never polled again. Returns the stored status.
+    """
+    transcribe_client = transcribe_client or get_transcribe_client()
+    response = transcribe_client.get_transcription_job(TranscriptionJobName=upload.transcription_job_name)
+    status = response['TranscriptionJob']['TranscriptionJobStatus']
+
+    upload.transcription_checked_at = now()
+    update_fields = ['transcription_status', 'transcription_checked_at']
+    if status == Upload.TRANSCRIPTION_COMPLETED:
+        upload.transcript = fetch_transcript(upload.output_key)
+        update_fields.append('transcript')
+    upload.transcription_status = status
+    upload.save(update_fields=update_fields)
+    if status == Upload.TRANSCRIPTION_COMPLETED:
+        index_transcript(upload.id)
+    return status
+
+
+def get_transcription_text(upload):
+    """Text to show for an upload's transcription, read from the database only."""
+    if not upload.transcription_job_name:
+        return None
+    if upload.transcription_status == Upload.TRANSCRIPTION_COMPLETED:
+        return upload.transcript
+    if upload.transcription_status == Upload.TRANSCRIPTION_FAILED:
+        return TRANSCRIPTION_FAILED_TEXT
+    return TRANSCRIBING_TEXT
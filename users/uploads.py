@@ -0,0 +1,255 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core import signing
+from django.db import IntegrityError, transaction
+
+from mysite.settings import AWS_STORAGE_BUCKET_NAME, MAX_DIRECT_UPLOAD_SIZE
+from .blobs import add_blob_references, blob_key, blob_transcript_key, hash_file, record_blobs, touch_blobs
+from .keywords import create_keyword_tags
+from .models import Upload
+from .search import index_transcript
+from .storage import get_storage
+from .thumbnails import has_rendition
+from .transcription import TRANSCRIBABLE_EXTENSIONS, start_transcription_job
+
+# How long the browser has to start sending the file once it has a presigned POST
+DIRECT_UPLOAD_EXPIRY = 900  # 15 minutes
+
+# Batch uploads: most files per request and how many are sent to S3 at once. Keep the
+# workers below AWS_MAX_POOL_CONNECTIONS, the pool is shared with the rest of the process
+MAX_BATCH_FILES = 50
+BATCH_UPLOAD_WORKERS = 8
+
+
+# Signs the name a direct upload was given between its presign and complete steps
+DIRECT_UPLOAD_SALT = 'users.direct_upload'
+
+
+def upload_key(project_name, file_name):
+    return f'{project_name}/{file_name}'
+
+
+def new_direct_upload(project, file_name):
+    """
+    Pick the name a direct upload is stored under, {uuid}/{file_name}, and a token the
+    browser sends back with the complete step. Returns (name, token).
+
+    Project names are only unique per owner and transcripts are written next to their
+    upload, so {project_name}/{file_name} may already hold another project's file.
+    """
+    name = f'{uuid.uuid4().hex}/{file_name}'
+    return name, signing.dumps({'project': project.id, 'name': name}, salt=DIRECT_UPLOAD_SALT)
+
+
+def direct_upload_name(token, project, file_name):
+    """The name new_direct_upload gave ``file_name``, or None if ``token`` isn't its token."""
+    try:
+        payload = signing.loads(token or '', salt=DIRECT_UPLOAD_SALT)
+    except signing.BadSignature:
+        return None
+    if payload['project'] != project.id or payload['name'].split('/', 1)[1] != file_name:
+        return None
+    return payload['name']
+
+
+def presigned_upload(key, content_type):
+    """
+    Presigned POST that lets the browser send one file straight to storage under ``key``.
+
+    The storage itself rejects files larger than MAX_DIRECT_UPLOAD_SIZE or sent with a
+    different Content-Type. Returns {'url': ..., 'fields': ...} for a multipart form.
+    """
+    return get_storage().presigned_post(key, content_type, MAX_DIRECT_UPLOAD_SIZE, DIRECT_UPLOAD_EXPIRY)
+
+
+def uploaded_object_size(key):
+    """Size of a file the browser says it uploaded, or None if it is not in storage."""
+    return get_storage().size(key)
+
+
+def output_key_for(project_name, file_name):
+    # Where Transcribe writes the transcript, next to the upload
+    safe_project_name = project_name.replace(' ', '_')
+    return f"{safe_project_name}/{file_name}-transcription.json"
+
+
+# Fields copied from an earlier upload of the same content instead of transcribing it again
+TRANSCRIPTION_FIELDS = [
+    'transcription_job_name', 'transcription_status', 'transcription_checked_at', 'output_key', 'transcript',
+]
+
+
+def is_transcribable(upload):
+    return upload.file.name.split('.')[-1].lower() in TRANSCRIBABLE_EXTENSIONS
+
+
+def reuse_transcriptions(uploads):
+    """
+    Give unsaved uploads the transcription of an earlier upload of the same blob,
+    finished or still running (the poller then fills in both), in one query.
+    Returns the uploads that got one.
+    """
+    uploads = [upload for upload in uploads if upload.blob_id and is_transcribable(upload)]
+    if not uploads:
+        return []
+    earlier = Upload.objects.filter(
+        blob_id__in={upload.blob_id for upload in uploads},
+        transcription_job_name__isnull=False,
+        transcription_status__in=[Upload.TRANSCRIPTION_COMPLETED, *Upload.TRANSCRIPTION_PENDING_STATUSES],
+    ).only('blob_id', *TRANSCRIPTION_FIELDS)
+    # A finished transcript beats a running job
+    sources = {}
+    for source in earlier:
+        current = sources.get(source.blob_id)
+        if current is None or current.transcription_status != Upload.TRANSCRIPTION_COMPLETED:
+            sources[source.blob_id] = source
+
+    reused = []
+    for upload in uploads:
+        source = sources.get(upload.blob_id)
+        if source is not None:
+            for field in TRANSCRIPTION_FIELDS:
+                setattr(upload, field, getattr(source, field))
+            reused.append(upload)
+    return reused
+
+
+def start_upload_transcription(upload, project_name):
+    """
+    Start a Transcribe job if ``upload`` is audio or video and set its job fields
+    (without saving them). The poll_transcriptions worker takes it from there.
+    """
+    # Direct uploads are stored under a folder of their own, job names can't have slashes
+    file_name = upload.file.name.rsplit('/', 1)[-1]
+    if not is_transcribable(upload):
+        return
+    job_name = f"{upload.project.name.replace(' ', '_')}-{file_name}-{uuid.uuid4()}-transcription"
+    file_uri = f"s3://{AWS_STORAGE_BUCKET_NAME}/{upload.storage_key(project_name)}"
+    print(f'Starting transcription job: {job_name} for file: {file_uri}')
+
+    started = start_transcription_job(job_name, file_uri, upload.output_key)
+    upload.transcription_job_name = job_name
+    upload.transcription_status = Upload.TRANSCRIPTION_QUEUED if started else Upload.TRANSCRIPTION_FAILED
+
+
+def save_upload(upload, project, project_name, owner, file_name, blob=None):
+    """
+    Record a file that is already stored, in ``blob`` or at {project_name}/{file_name},
+    and start its transcription if it is audio or video.
+
+    ``upload`` is an unsaved Upload from FileUploadForm.save(commit=False).
+    """
+    upload.owner = owner
+    upload.project = project
+    upload.file = file_name
+    upload.blob = blob
+    upload.output_key = blob_transcript_key(blob.key) if blob else output_key_for(project_name, file_name)
+    # Picked up by the generate_thumbnails worker
+    upload.thumbnail_status = Upload.THUMBNAIL_PENDING if has_rendition(upload) else None
+    upload.save()
+
+    if not reuse_transcriptions([upload]):
+        start_upload_transcription(upload, project_name)
+    if upload.transcription_job_name:
+        upload.save(update_fields=TRANSCRIPTION_FIELDS)
+        if upload.transcription_status == Upload.TRANSCRIPTION_COMPLETED:
+            index_transcript(upload.id)
+    return upload
+
+
+def start_batch_transcriptions(uploads, project_name):
+    # Transcribe calls are network round trips, so they are started on a pool too
+    with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as pool:
+        list(pool.map(lambda upload: start_upload_transcription(upload, project_name), uploads))
+    started = [upload for upload in uploads if upload.transcription_job_name]
+    if started:
+        Upload.objects.bulk_update(started, TRANSCRIPTION_FIELDS)
+
+
+def upload_batch(project, project_name, owner, entries):
+    """
+    Store several files in one request and record them as uploads.
+
+    ``entries`` is a list of (uploaded file, UploadMetaDataForm) pairs. Names are
+    checked against the project in one query, the files are hashed and sent to S3 as
+    blobs on a thread pool of BATCH_UPLOAD_WORKERS (so the batch takes about as long
+    as its slowest file, and content already stored is not sent again), and the rows
+    are written with one bulk_create. Transcription jobs are started once those rows
+    are committed. Returns one result dict per entry, in order.
+    """
+    results = [{'name': form.data.get('name', ''), 'file_name': file.name} for file, form in entries]
+
+    # Validate every entry, name uniqueness against the project in a single query
+    names = [form.cleaned_data['name'] for _, form in entries if form.is_valid()]
+    taken = set(Upload.objects.filter(project=project, name__in=names).values_list('name', flat=True))
+    seen_names, seen_files, accepted = set(), set(), []
+    for index, (file, form) in enumerate(entries):
+        if not form.is_valid():
+            error = ' '.join(message for messages in form.errors.values() for message in messages)
+        elif form.cleaned_data['name'] in taken:
+            error = "An upload with this name already exists in the project."
+        elif form.cleaned_data['name'] in seen_names or file.name in seen_files:
+            error = "Another file in this batch has the same name."
+        else:
+            seen_names.add(form.cleaned_data['name'])
+            seen_files.add(file.name)
+            accepted.append(index)
+            continue
+        results[index].update(status='error', error=error)
+
+    # Hash the files and send only the content that isn't stored yet, concurrently. The
+    # storage is thread safe; the database is only used from this thread
+    storage = get_storage()
+    uploads = []
+    with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as pool:
+        files = [entries[index][0] for index in accepted]
+        keys = dict(zip(accepted, pool.map(lambda file: blob_key(hash_file(file), file.name), files)))
+        stored = touch_blobs(set(keys.values()))
+        transfers = {}
+        for index, key in keys.items():
+            if key not in stored and key not in transfers:
+                transfers[key] = pool.submit(storage.save, key, entries[index][0])
+
+        sent = {}
+        for index, key in keys.items():
+            file, form = entries[index]
+            try:
+                if key in transfers:
+                    transfers[key].result()
+                    sent[key] = file.size
+            except Exception as e:
+                print(f'Error uploading file {file.name}: {e}')
+                results[index].update(status='error', error="The file could not be stored.")
+                continue
+            upload = form.save(commit=False)
+            upload.owner = owner
+            upload.project = project
+            upload.file = file.name
+            upload.blob_id = key
+            upload.output_key = blob_transcript_key(key)
+            upload.thumbnail_status = Upload.THUMBNAIL_PENDING if has_rendition(upload) else None
+            uploads.append((index, upload))
+        record_blobs(sent)
+
+    reused = reuse_transcriptions([upload for _, upload in uploads])
+    to_start = [upload for _, upload in uploads if upload not in reused]
+    try:
+        with transaction.atomic():
+            # bulk_create skips post_save, so the keyword tags are written here
+            created = Upload.objects.bulk_create([upload for _, upload in uploads])
+            create_keyword_tags(created)
+            add_blob_references(created)
+            # Only once the rows are in, a batch that loses a name race leaves no jobs behind
+            transaction.on_commit(lambda: start_batch_transcriptions(to_start, project_name))
+    except IntegrityError:
+        # Another request took one of the names after the check above
+        for index, _ in uploads:
+            results[index].update(status='error', error="An upload with this name already exists in the project.")
+        return results
+
+    for index, upload in uploads:
+        if upload.transcription_status == Upload.TRANSCRIPTION_COMPLETED:
+            index_transcript(upload.id)
+        results[index].update(status='uploaded', id=upload.id)
+    return results
@@ -15,6 +15,12 @@ urlpatterns = [
     path('deny_request/<int:request_id>/', views.deny_join_request, name='deny_join_request'),
     path('projects/<str:project_name>/<int:id>/', views.view_project, name='project_main_view'),
     path('projects/<str:project_name>/<int:id>/upload/', views.project_upload, name='project_upload'),
+    path('projects/<str:project_name>/<int:id>/upload/presign/', views.presign_project_upload, name='presign_project_upload'),
+    path('projects/<str:project_name>/<int:id>/upload/complete/', views.complete_project_upload, name='complete_project_upload'),
+    path('projects/<str:project_name>/<int:id>/upload/batch/', views.batch_project_upload, name='batch_project_upload'),
+    # Signed links and browser uploads when files are kept in local storage (users/storage.py)
+    path('storage/files/<str:token>/', views.serve_stored_file, name='serve_stored_file'),
+    path('storage/upload/', views.receive_stored_file, name='receive_stored_file'),
     path('projects/<str:project_name>/<int:id>/delete/', views.delete_project, name='delete_project'),
     path('projects/<str:project_name>/<int:id>/delete-file/<int:file_id>/', views.delete_file, name='delete_file'),
     path('create-message/<int:project_id>/', views.create_message, name='create_message'),
@@ -25,6 +31,7 @@ urlpatterns = [
     path('profile/<int:user_id>/', views.view_profile, name='view_profile'),
     path('refresh-transcription/<str:job_name>/<int:file_id>/', views.refresh_transcription_status, name='refresh_transcription'),
     path('search_users/', views.search_users, name='search_users'),
+    path('search_transcripts/', views.search_transcripts, name='search_transcripts'),
     path('invite/', views.manage_invites, name='manage_invites'),
     path('users/<int:user_id>/select-project/', views.select_project_for_invite, name='select_project_for_invite'),
     path('invitations/', views.invitation_list, name='view_invites'),
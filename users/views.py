@@ -1,11 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q, F
-from django.http import HttpRequest, StreamingHttpResponse, HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.http import HttpRequest, StreamingHttpResponse, HttpResponse, JsonResponse, HttpResponseBadRequest, Http404
+from django.http import FileResponse
+from django.views.decorators.csrf import csrf_exempt
 from .models import Upload, JoinRequest, Project, Message, User, UserProfile, ProjectMembership
-from .forms import FileUploadForm, ProjectForm, UserProfileForm, UploadMetaDataForm, UserEditForm
+from .models import StoragePurge, get_project_status, toggle_upvote
+from .forms import DirectUploadForm, FileUploadForm, ProjectForm, UserProfileForm, UploadMetaDataForm, UserEditForm
 from typing import AsyncGenerator
 import asyncio
 import json
@@ -13,13 +17,35 @@ import random
 from datetime import datetime
 from django.utils.timezone import now
 import time
-import uuid
 from django.http import JsonResponse, HttpResponseRedirect
 from urllib.parse import urlparse
-from django.db.models import Exists, OuterRef
-
-from mysite.settings import AWS_STORAGE_BUCKET_NAME, AWS_S3_REGION_NAME
-import boto3
+from django.db.models import Exists, OuterRef, Subquery
+
+from .badges import forget_badge_counts
+from .keywords import keyword_counts, search_uploads
+from .blobs import store_blob
+from .thumbnails import attach_thumbnails
+from .uploads import (
+    MAX_BATCH_FILES, direct_upload_name, new_direct_upload, presigned_upload, save_upload, upload_batch, upload_key,
+    uploaded_object_size,
+)
+from .roles import PMA_ADMIN_GROUP, user_is_pma_admin
+from .search import rank_transcripts, search_projects
+from .pagination import (
+    PROJECT_SORTS, DEFAULT_PROJECT_SORT, POPULAR_PROJECT_SORT, SEARCH_PROJECT_SORTS, SEARCH_PROJECT_SORT,
+    USER_SORT, USER_PAGE_SIZE, keyset_page,
+)
+from .presign import forget_presigned_urls, presigned_file_url
+
+from .storage import LocalStorage, get_storage
+from .transcription import get_transcription_text, start_transcription_job
+from .consumers import message_payload, project_chat_group
+from .reconcile import project_keys
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+
+from mysite.settings import AWS_STORAGE_BUCKET_NAME
 
 def login_view(request):
     # Automatically redirect users to Google login
@@ -36,7 +62,7 @@ def dashboard(request):
         # look for first name, if it doesn't exist, use their username
         user_name = request.user.first_name or request.user.username
 
-        if request.user.groups.filter(name='PMA Administrators').exists():
+        if user_is_pma_admin(request.user):
             # Render the PMA Administrator dashboard
             return pma_dashboard(request, user_name)
         else:
@@ -49,8 +75,10 @@ def dashboard(request):
 def common_dashboard(request, user_name):
     owned_projects = Project.objects.filter(owner=request.user)
     member_projects = Project.objects.filter(members=request.user).exclude(owner=request.user)
-    requests = JoinRequest.objects.filter(project__owner=request.user, status='pending')
-    project_requests = list({request.project for request in requests})
+    # Owned projects with at least one pending request, in one query
+    project_requests = owned_projects.filter(
+        Exists(JoinRequest.objects.filter(project_id=OuterRef('id'), status='pending'))
+    )
     return render(request, 'common_dashboard.html', {
         'user_name': user_name,
         'owned_projects': owned_projects,
@@ -60,61 +88,45 @@ def common_dashboard(request, user_name):
     
 #display project list helper method    
 def get_projects_context(request):
-    # Fetch projects with annotations
-    projects = Project.objects.select_related('owner').annotate(
+    # Check if the user is a PMA admin
+    is_pma_admin = False
+    is_authenticated = request.user.is_authenticated
+    is_pma_admin = is_authenticated and user_is_pma_admin(request.user)
+
+    # Fetch visible projects with annotations, visibility is resolved in the database
+    projects = Project.objects.visible_to(request.user, is_pma_admin).select_related('owner').defer('search_vector').annotate(
         user_has_upvoted=Exists(
             Project.upvoters.through.objects.filter(
                 user_id=request.user.id, project_id=OuterRef('id')
             )
         )
     )
+    if is_authenticated and not is_pma_admin:
+        projects = projects.with_user_status(request.user)
 
-    # Check if the user is a PMA admin
-    is_pma_admin = False
-    is_authenticated = request.user.is_authenticated
-    is_pma_admin = is_authenticated and request.user.groups.filter(name='PMA Administrators').exists()
-
-
-    # Apply sorting based on query params
-    sort_by = request.GET.get('sort', '-created_at')
-    if sort_by == 'due_date':
-        projects = projects.order_by(F('due_date').asc(nulls_last=True))
-    elif sort_by == '-due_date':
-        projects = projects.order_by(F('due_date').desc(nulls_last=True))
-    elif sort_by == 'created_at':
-        projects = projects.order_by('created_at')
-    elif sort_by == '-created_at':
-        projects = projects.order_by('-created_at')
-
-    # Apply search filter
-    search_query = request.GET.get('q', '')
+    # Apply search filter, search results are ranked by relevance unless another sort is picked
+    search_query = request.GET.get('q', '').strip()
+    sort_choices = PROJECT_SORTS
+    default_sort = DEFAULT_PROJECT_SORT
     if search_query:
-        projects = projects.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(category__icontains=search_query)
-        )
+        projects = search_projects(projects, search_query)
+        sort_choices = {**PROJECT_SORTS, **SEARCH_PROJECT_SORTS}
+        default_sort = SEARCH_PROJECT_SORT
 
-    # Filter visible projects
-    visible_projects = [
-        project for project in projects
-        if not project.is_private or project.owner == request.user
-        or request.user in project.members.all() or is_pma_admin
-    ]
+    # Apply sorting based on query params and fetch one page after the cursor
+    sort_by = request.GET.get('sort', default_sort)
+    if sort_by not in sort_choices:
+        sort_by = default_sort
+    visible_projects, next_cursor = keyset_page(projects, sort_by, request.GET.get('cursor'))
 
     project_status = None
-    # Determine project status for the current user
+    # Determine project status for the current user from the annotated page rows
     if is_authenticated and not is_pma_admin:
-        project_status = {
-            project.id: 'member' if request.user in project.members.all() else
-            'pending' if JoinRequest.objects.filter(user=request.user, project=project, status='pending').exists() else
-            'not_member'
-            for project in visible_projects
-        }
-    
-    # Determine project permissions for the current user
+        project_status = {project.id: get_project_status(project) for project in visible_projects}
+
+    # Determine project permissions for the current user (owner_id avoids loading the owner)
     project_permissions = {
-        project.id: project.owner == request.user or is_pma_admin
+        project.id: project.owner_id == request.user.id or is_pma_admin
         for project in visible_projects
     }
 
@@ -125,7 +137,9 @@ def get_projects_context(request):
         'project_status': project_status,
         'is_pma_admin': is_pma_admin,
         'project_permissions': project_permissions,
-        'search_query': search_query
+        'search_query': search_query,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
     }
 
 @login_required
@@ -203,30 +217,34 @@ def approve_join_request(request, request_id):
     if join_request.project.owner != request.user:
         return redirect('project_list')
 
-    join_request.status = 'accepted'
-    join_request.save()
-
-    # Add the user to the project's members
-    join_request.project.members.add(join_request.user)
-    ProjectMembership.objects.create(
-        user=join_request.user,
-        project=join_request.project,
-        date_added=now()
-    )
+    # Membership, member count and request status change together or not at all
+    with transaction.atomic():
+        join_request.status = 'accepted'
+        join_request.save()
+
+        # Add the user to the project's members (this also updates member_count)
+        join_request.project.members.add(join_request.user)
+        ProjectMembership.objects.create(
+            user=join_request.user,
+            project=join_request.project,
+            date_added=now()
+        )
 
-    # Check if the number of members exceeds the number of reviewers
-    project = join_request.project
-    if project.members.count() > project.number_of_reviewers + 1:
-        # Increase the number of reviewers to match the number of members
-        project.number_of_reviewers = F('number_of_reviewers') + 1
-        project.save(update_fields=['number_of_reviewers'])
-
-    # Check for existing invitations and resolve them
-    ProjectInvitation.objects.filter(
-        project=join_request.project,
-        invited_user=join_request.user,
-        status='PENDING'
-    ).update(status='ACCEPTED')
+        # Check if the number of members exceeds the number of reviewers
+        project = join_request.project
+        if project.member_count > project.number_of_reviewers + 1:
+            # Increase the number of reviewers to match the number of members
+            project.number_of_reviewers = F('number_of_reviewers') + 1
+            project.save(update_fields=['number_of_reviewers'])
+
+        # Check for existing invitations and resolve them
+        ProjectInvitation.objects.filter(
+            project=join_request.project,
+            invited_user=join_request.user,
+            status='PENDING'
+        ).update(status='ACCEPTED')
+        # update() skips the signals that refresh the navbar badges
+        forget_badge_counts([join_request.user_id, request.user.id])
 
     return redirect('manage_join_requests', project_id=join_request.project.id)
 
@@ -264,14 +282,14 @@ def leave_project(request, project_id, project_name):
     project = get_object_or_404(Project, id=project_id, name=project_name)
 
     # check if user is a member of the project
-    if request.user in project.members.all():
-        # remove membership
-        project.members.remove(request.user)
-        # remove project membership
-        ProjectMembership.objects.filter(user=request.user, project=project).delete()
-        # delete join request so they can request again after leaving
-        # # delete join request so they can request again after leaving
-        JoinRequest.objects.filter(user=request.user, project=project).delete()
+    if project.members.filter(id=request.user.id).exists():
+        with transaction.atomic():
+            # remove membership (this also updates member_count)
+            project.members.remove(request.user)
+            # remove project membership
+            ProjectMembership.objects.filter(user=request.user, project=project).delete()
+            # delete join request so they can request again after leaving
+            JoinRequest.objects.filter(user=request.user, project=project).delete()
         messages.success(request, 'You have successfully left the project.')
     else:
         messages.error(request, 'You are not a member of this project.')
@@ -282,21 +300,33 @@ def view_project(request, project_name, id):
     # send user back to the page they came from
     referer = request.META.get('HTTP_REFERER', '/')
 
-    project = get_object_or_404(Project, id=id)
+    project = get_object_or_404(Project.objects.select_related('owner'), id=id)
 
     search_query = request.GET.get('search', '')  # Get search query from the URL
 
-    # Filter uploads associated with the project and search query
-    uploads = Upload.objects.filter(project=project)
+    # Filter uploads associated with the project by name and keyword tags, the list shows each owner
+    uploads = Upload.objects.filter(project=project).select_related('owner')
     if search_query:
-        uploads = uploads.filter(Q(name__icontains=search_query) | Q(keywords__icontains=search_query))
-
-    is_owner_or_admin = (project.owner == request.user or request.user.groups.filter(name='PMA Administrators').exists())
+        uploads = search_uploads(uploads, project, search_query)
+
+    is_owner_or_admin = (project.owner == request.user or user_is_pma_admin(request.user))
+    # Thumbnails show the content, so only to people who may open the files
+    # Asked once here instead of by the template for every file
+    is_member = request.user.is_authenticated and project.members.filter(id=request.user.id).exists()
+    uploads = list(uploads)
+    if is_owner_or_admin or is_member:
+        attach_thumbnails(uploads)
     context = {
         'project': project,
         'files': uploads,
+        'search_query': search_query,
+        'keyword_counts': keyword_counts(project),
         'is_owner_or_admin': is_owner_or_admin,
+        'is_member': is_member,
         'referer': referer,
+        # project resources are private objects, so link to them through presigned URLs
+        'rubric_url': presigned_file_url(project.rubric.name) if project.rubric else None,
+        'review_guidelines_url': presigned_file_url(project.review_guidelines.name) if project.review_guidelines else None,
     }
 
     return render(request, 'project_main_view.html', context)
@@ -308,10 +338,8 @@ def project_upload(request, project_name, id):
     if project.name.lower() != project_name.lower():
         return redirect('project_list')
 
-    is_pma_admin = request.user.groups.filter(name='PMA Administrators').exists()
+    is_pma_admin = user_is_pma_admin(request.user)
     transcription_text = None
-    job_name = None
-    output_key = None
 
     if request.method == 'POST':
         if request.user == project.owner:
@@ -320,48 +348,21 @@ def project_upload(request, project_name, id):
                 project.rubric = request.FILES['rubric']
             if 'review_guidelines' in request.FILES:
                 project.review_guidelines = request.FILES['review_guidelines']
-            project.save()
+            project.save(update_fields=['rubric', 'review_guidelines'])
 
         # General file upload
         form = FileUploadForm(request.POST, request.FILES, project=project)
         if form.is_valid():
             uploaded_file = request.FILES['file']
-            s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
 
             try:
                 print(f'Uploading {uploaded_file.name} to S3...')
-                s3.upload_fileobj(
-                    uploaded_file,
-                    AWS_STORAGE_BUCKET_NAME,
-                    f'{project_name}/{uploaded_file.name}'
-                )
-                print('Upload successful!')
-
-                # Save metadata to the database
-                new_upload = form.save(commit=False)
-                new_upload.owner = request.user
-                new_upload.project = project
-                new_upload.file = uploaded_file.name
-                new_upload.save()
-
-                # Construct the transcription output key
-                safe_project_name = project_name.replace(' ', '_')
-                output_key = f"{safe_project_name}/{uploaded_file.name}-transcription.json"
-                new_upload.output_key = output_key
-                new_upload.save()
-
-                # Start transcription job if the file type is supported
-                file_extension = uploaded_file.name.split('.')[-1].lower()
-                if file_extension in ['mp3', 'mp4', 'wav', 'flac']:
-                    job_name = f"{project.name.replace(' ', '_')}-{uploaded_file.name}-{uuid.uuid4()}-transcription"
-                    file_uri = f"s3://{AWS_STORAGE_BUCKET_NAME}/{project_name}/{uploaded_file.name}"
-                    print(f'Starting transcription job: {job_name} for file: {file_uri}')
-
-                    start_transcription_job(job_name, file_uri, output_key)
-
-                    # Save the job name to the new upload
-                    new_upload.transcription_job_name = job_name
-                new_upload.save()
+                # Content that is already stored is referenced instead of sent again
+                blob, transferred = store_blob(uploaded_file)
+                print('Upload successful!' if transferred else f'Already stored as {blob.key}, skipped the upload.')
+
+                # Save metadata to the database and start transcription
+                save_upload(form.save(commit=False), project, project_name, request.user, uploaded_file.name, blob)
 
                 return redirect('project_main_view', project_name=project.name, id=project.id)
             except Exception as e:
@@ -373,10 +374,7 @@ def project_upload(request, project_name, id):
     if request.method == 'GET':
         last_upload = project.uploads.last()
         if last_upload and last_upload.transcription_job_name:
-            job_name = last_upload.transcription_job_name
-            output_key = last_upload.output_key
-            transcribe_client = boto3.client('transcribe', region_name=AWS_S3_REGION_NAME)
-            transcription_text = check_transcription_job(transcribe_client, job_name, output_key)
+            transcription_text = get_transcription_text(last_upload)
 
     return render(request, 'project_upload.html', {
         'project': project,
@@ -385,32 +383,155 @@ def project_upload(request, project_name, id):
         'transcription_text': transcription_text  ,
     })
 
-@login_required
-def delete_project(request, project_name, id):
+def _direct_upload_project(request, project_name, id):
+    # Members (the owner is one) may upload; returns the project or None
     project = get_object_or_404(Project, id=id)
+    if project.name.lower() != project_name.lower():
+        return None
+    if not project.members.filter(id=request.user.id).exists():
+        return None
+    return project
 
-    is_pma_admin = request.user.groups.filter(name='PMA Administrators').exists()
-    is_project_owner = project.owner == request.user
+@login_required
+def presign_project_upload(request, project_name, id):
+    """
+    First step of a direct upload: validate the file's details and hand the browser
+    a presigned POST so it can send the file straight to S3.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    project = _direct_upload_project(request, project_name, id)
+    if project is None:
+        return JsonResponse({'error': 'You are not a member of this project.'}, status=403)
+
+    form = DirectUploadForm(request.POST, project=project)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    name, token = new_direct_upload(project, form.cleaned_data['file_name'])
+    # The URL's name only matches case-insensitively, keys always use the stored one
+    key = upload_key(project.name, name)
+    post = presigned_upload(key, form.cleaned_data['content_type'])
+    return JsonResponse({'url': post['url'], 'fields': post['fields'], 'key': key, 'upload_token': token})
 
-    if is_pma_admin or is_project_owner:
-        s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
-        bucket_name = AWS_STORAGE_BUCKET_NAME
+@login_required
+def complete_project_upload(request, project_name, id):
+    """
+    Second step of a direct upload, called by the browser once S3 has the file:
+    record the Upload and start its transcription.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    project = _direct_upload_project(request, project_name, id)
+    if project is None:
+        return JsonResponse({'error': 'You are not a member of this project.'}, status=403)
+
+    form = DirectUploadForm(request.POST, project=project)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    # Only the name presign_project_upload handed out, the browser can't pick another key
+    name = direct_upload_name(request.POST.get('upload_token'), project, form.cleaned_data['file_name'])
+    if name is None:
+        return JsonResponse({'error': 'Invalid upload token.'}, status=400)
+    if uploaded_object_size(upload_key(project.name, name)) is None:
+        return JsonResponse({'error': 'The file has not been uploaded.'}, status=400)
 
-        folder_prefix = f"{project_name}/"
+    try:
+        with transaction.atomic():
+            save_upload(form.save(commit=False), project, project.name, request.user, name)
+    except IntegrityError:
+        # Another upload took the name between the two steps
+        return JsonResponse({'errors': {'name': ['An upload with this name already exists in the project.']}}, status=400)
+    return JsonResponse({'redirect': reverse('project_main_view', args=[project.name, project.id])})
 
-        try:
-            objects_to_delete = s3.list_objects_v2(Bucket=bucket_name, Prefix=folder_prefix)
-            if 'Contents' in objects_to_delete:
-                delete_keys = [{'Key': obj['Key']} for obj in objects_to_delete['Contents']]
+@login_required
+def batch_project_upload(request, project_name, id):
+    """
+    Upload several files in one request. Each file comes with its own name,
+    description and keywords, sent as repeated fields in the same order as the
+    files; a blank name falls back to the file name. Responds with one result per file.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    project = _direct_upload_project(request, project_name, id)
+    if project is None:
+        return JsonResponse({'error': 'You are not a member of this project.'}, status=403)
+
+    files = request.FILES.getlist('files')
+    if not files:
+        return JsonResponse({'error': 'No files were sent.'}, status=400)
+    if len(files) > MAX_BATCH_FILES:
+        return JsonResponse({'error': f'At most {MAX_BATCH_FILES} files can be uploaded at once.'}, status=400)
+
+    names = request.POST.getlist('name')
+    descriptions = request.POST.getlist('description')
+    keywords = request.POST.getlist('keywords')
+    entries = []
+    for index, uploaded_file in enumerate(files):
+        details = {
+            'name': (names[index] if index < len(names) else '').strip() or uploaded_file.name,
+            'description': descriptions[index] if index < len(descriptions) else '',
+            'keywords': keywords[index] if index < len(keywords) else '',
+        }
+        entries.append((uploaded_file, UploadMetaDataForm(details)))
 
-                s3.delete_objects(Bucket=bucket_name, Delete={'Objects': delete_keys})
+    results = upload_batch(project, project_name, request.user, entries)
+    return JsonResponse({'results': results})
 
+def serve_stored_file(request, token):
+    # Stands in for a presigned S3 GET when files are kept in LocalStorage
+    storage = get_storage()
+    payload = storage.unsign(token) if isinstance(storage, LocalStorage) else None
+    if payload is None:
+        raise Http404
+    try:
+        stream, _ = storage.open(payload['key'])
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(
+        stream,
+        content_type=payload['type'] or 'application/octet-stream',
+        as_attachment=payload['disposition'] == 'attachment',
+        filename=payload['key'].rsplit('/', 1)[-1],
+    )
+
+@csrf_exempt
+def receive_stored_file(request):
+    """
+    Stands in for a presigned S3 POST when files are kept in LocalStorage. Like S3, the
+    signed policy from presigned_post is the only authorization and sets the key,
+    the content type and the largest accepted size.
+    """
+    storage = get_storage()
+    if request.method != 'POST' or not isinstance(storage, LocalStorage):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    payload = storage.unsign(request.POST.get('policy', ''))
+    uploaded_file = request.FILES.get('file')
+    if payload is None or uploaded_file is None or request.POST.get('key') != payload['key']:
+        return JsonResponse({'error': 'Invalid or expired upload policy.'}, status=403)
+    if not 0 < uploaded_file.size <= payload['max_size']:
+        return JsonResponse({'error': 'The file is empty or too large.'}, status=400)
+    if payload['type'] and uploaded_file.content_type != payload['type']:
+        return JsonResponse({'error': 'The file type does not match.'}, status=400)
+    storage.save(payload['key'], uploaded_file, payload['type'])
+    return HttpResponse(status=204)
+
+@login_required
+def delete_project(request, project_name, id):
+    project = get_object_or_404(Project, id=id)
+
+    is_pma_admin = user_is_pma_admin(request.user)
+    is_project_owner = project.owner == request.user
+
+    if is_pma_admin or is_project_owner:
+        # The files can take a while to delete, the purge_storage worker removes them
+        # in the background so the request returns straight away
+        with transaction.atomic():
+            StoragePurge.objects.create(prefix=f"{project.name}/", keys=project_keys(project))
             project.delete()
-            print("Successfully deleted project and its files.")
-            messages.success(request, "Project and associated files deleted successfully.")
-        except Exception as e:
-            print(f"Error deleting project files from S3: {e}")
-            messages.error(request, "An error occurred while trying to delete the project files.")
+        print(f"Deleted project {project.name}, its files are queued for deletion.")
+        messages.success(request, "Project deleted. Its files are being removed in the background.")
 
         return redirect('project_list')
     else:
@@ -424,17 +545,20 @@ def delete_file(request, project_name, id, file_id):
     file_obj_owner = request.user == file_obj.owner
 
     # Check if the user has permissions to delete the file
-    if project.owner == request.user or request.user.groups.filter(name='PMA Administrators').exists() or file_obj_owner:
-        s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
-        bucket_name = AWS_STORAGE_BUCKET_NAME
+    if project.owner == request.user or user_is_pma_admin(request.user) or file_obj_owner:
+        storage = get_storage()
 
-        # Construct the correct S3 file key using the file metadata
-        file_key = f"{project_name}/{file_obj.file}"
+        # Construct the correct storage key using the file metadata
+        file_key = file_obj.storage_key(project_name)
 
         try:
-            # Delete the file from S3
-            response = s3.delete_object(Bucket=bucket_name, Key=file_key)
-            print(f"S3 deletion response: {response}")
+            # Shared blobs are only deleted once no upload uses them (see users.blobs)
+            if not file_obj.blob_id:
+                storage.delete(file_key)
+                forget_presigned_urls(file_key)
+                print(f"Deleted {file_key} from storage.")
+                if file_obj.thumbnail_key:
+                    storage.delete(file_obj.thumbnail_key)
 
             # Delete the file's metadata from the database
             file_obj.delete()
@@ -455,6 +579,12 @@ def create_message(request, project_id):
         if content:
             project = get_object_or_404(Project, id=project_id)
             message = Message.objects.create(content=content, project=project, user=request.user)
+
+            # Push the message to everyone connected to the project chat once it is committed
+            payload = message_payload(message, request.user)
+            transaction.on_commit(lambda: async_to_sync(get_channel_layer().group_send)(
+                project_chat_group(project.id), {'type': 'chat.message', 'message': payload}
+            ))
             return JsonResponse({
                 'status': 'Message sent',
                 'message': {
@@ -469,17 +599,68 @@ def create_message(request, project_id):
             })
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
 @login_required
 def load_messages(request, project_id):
-    messages = Message.objects.filter(project_id=project_id).order_by('created_at')
-    messages_list = [{'content': message.content, 'username':message.user.username} for message in messages]
-    return JsonResponse({'messages': messages_list})
+    """
+    Return one page of a project's chat, oldest first.
+
+    Without a cursor this is the latest page. ``after_id`` returns messages newer than
+    that id (catching up after a reconnect) and ``before_id`` returns the page before
+    it (scrolling back). ``next`` holds the cursor for the following page in the same
+    direction, or null when there is nothing more to load.
+    """
+    try:
+        after_id = int(request.GET['after_id']) if request.GET.get('after_id') else None
+        before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+        page_size = int(request.GET.get('limit', MESSAGE_PAGE_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest('Cursors and limit must be integers.')
+    if after_id is not None and before_id is not None:
+        return HttpResponseBadRequest('Use either after_id or before_id, not both.')
+    page_size = max(1, min(page_size, MAX_MESSAGE_PAGE_SIZE))
+
+    # Only the columns the chat needs, with the username joined in the same query
+    messages = Message.objects.filter(project_id=project_id).values(
+        'id', 'content', 'created_at', 'user__username'
+    )
+    if after_id is not None:
+        rows = list(messages.filter(id__gt=after_id).order_by('id')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = {'after_id': rows[-1]['id']} if has_more else None
+    else:
+        if before_id is not None:
+            messages = messages.filter(id__lt=before_id)
+        rows = list(messages.order_by('-id')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        next_cursor = {'before_id': rows[0]['id']} if has_more else None
+
+    messages_list = [
+        {
+            'id': row['id'],
+            'content': row['content'],
+            'created_at': row['created_at'].isoformat(),
+            'username': row['user__username'],
+        }
+        for row in rows
+    ]
+    return JsonResponse({'messages': messages_list, 'next': next_cursor})
 
 import mimetypes  # https://docs.python.org/3/library/mimetypes.html
 from .forms import PromptForm, PromptResponseForm
-from .models import Prompt
+from .models import Prompt, PromptResponse
 from django.template.loader import render_to_string
+from django.db.models import Prefetch
 
+def prompts_with_responses(upload):
+    # Everything the prompts partial shows, in three queries however many prompts there are
+    return upload.prompts.select_related('created_by').prefetch_related(
+        Prefetch('responses', queryset=PromptResponse.objects.select_related('created_by'))
+    )
 
 @login_required
 def view_file(request, project_name, id, file_id):
@@ -487,45 +668,24 @@ def view_file(request, project_name, id, file_id):
     project = get_object_or_404(Project, id=id, name=project_name)
 
     # Check user permissions
-    is_project_owner = project.owner == request.user
-    is_pma_admin = request.user.groups.filter(name='PMA Administrators').exists()
-    is_project_member = request.user in project.members.all()
+    is_project_owner = project.owner_id == request.user.id
+    is_pma_admin = user_is_pma_admin(request.user)
+    is_project_member = project.members.filter(id=request.user.id).exists()
 
     # Get file metadata from the database using file_id
-    upload = get_object_or_404(Upload, id=file_id, project=project)
+    upload = get_object_or_404(Upload.objects.select_related('owner'), id=file_id, project=project)
 
     # Retrieve prompts and their responses
-    prompts = upload.prompts.all()  # Retrieve all prompts related to this upload
+    prompts = prompts_with_responses(upload)
 
     # Ensure the user is allowed to view the file
     if is_project_owner or is_pma_admin or is_project_member:
-        # Fetch file from AWS S3
-        s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
-        bucket_name = AWS_STORAGE_BUCKET_NAME
-
         # Determine the S3 file key from the file_obj's path
-        file_key = f"{project_name}/{upload.file}"
+        file_key = upload.storage_key(project_name)
 
-        # Determine the media type of the file
-        mime_type, _ = mimetypes.guess_type(file_key)
-
-        if mime_type not in ['image/jpeg', 'text/plain', 'application/pdf', 'video/mp4']:
-            disposition_type = 'attachment'  # to download the file
-        else:
-            disposition_type = 'inline'  # to display the file
-
-
-        file_url = s3.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': bucket_name,
-                'Key': file_key,
-                # makes sure the browser is able to handle the display the correct media type
-                'ResponseContentType': mime_type,
-                'ResponseContentDisposition': disposition_type
-            },
-            ExpiresIn=3600  # URL expires in 1 hour
-        )
+        # Presigned URL for the file, reused from the cache while it is still valid. Blob
+        # keys are hashes, those downloads are named after the uploaded file instead
+        file_url = presigned_file_url(file_key, upload.file.name if upload.blob_id else None)
 
         # Handle prompt form submission
         if request.method == 'POST' and 'add_prompt' in request.POST:
@@ -538,7 +698,7 @@ def view_file(request, project_name, id, file_id):
                 
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         # Re-fetch prompts to include the new one
-                        prompts = upload.prompts.all()
+                        prompts = prompts_with_responses(upload)
 
                         # Render the partial template
                         prompts_html = render_to_string('partials/prompts_partial.html', {
@@ -566,7 +726,7 @@ def view_file(request, project_name, id, file_id):
                 
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         # Re-fetch prompts to include the new one
-                        prompts = upload.prompts.all()
+                        prompts = prompts_with_responses(upload)
 
                         # Render the partial template
                         prompts_html = render_to_string('partials/prompts_partial.html', {
@@ -592,11 +752,9 @@ def view_file(request, project_name, id, file_id):
             response_form = PromptResponseForm()
             # have it prepopulated in case users don't want to change the name
             metadata_form = UploadMetaDataForm(instance=upload)
-        # Get the transcription job name and check the transcription status
+        # Get the transcription job name and the stored transcription status
         job_name = upload.transcription_job_name
-        output_key = upload.output_key
-        transcribe_client = boto3.client('transcribe', region_name=AWS_S3_REGION_NAME)
-        transcription_text = check_transcription_job(transcribe_client, job_name, output_key) if job_name else None
+        transcription_text = get_transcription_text(upload)
 
         context = {
             'file_type': mimetypes.guess_type(upload.file.name)[0],
@@ -714,22 +872,6 @@ def edit_profile(request):
     return render(request, 'edit_profile.html', {'form': form})
 
 
-def start_transcription_job(job_name, file_uri, output_key):
-    transcribe_client = boto3.client('transcribe', region_name=AWS_S3_REGION_NAME)
-    try:
-        response = transcribe_client.start_transcription_job(
-            TranscriptionJobName=job_name,
-            Media={'MediaFileUri': file_uri},
-            MediaFormat='mp4',
-            LanguageCode='en-US',
-            OutputBucketName=AWS_STORAGE_BUCKET_NAME,
-            OutputKey=output_key,
-        )
-        print(f'Started transcription job: {response}')
-    except Exception as e:
-        print(f'Error starting transcription job: {e}')
-
-
 def transcribe_file(request, project_id, file_name):
     project = get_object_or_404(Project, id=project_id)
 
@@ -744,40 +886,11 @@ def transcribe_file(request, project_id, file_name):
 
     return redirect('view_project', project_name=project.name, id=project_id)
 
-def check_transcription_job(transcribe_client, job_name, output_key):
-    """Check the status of the transcription job."""
-    try:
-        response = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-        status = response['TranscriptionJob']['TranscriptionJobStatus']
-
-        if status == 'COMPLETED':
-            s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
-
-            # Fetch the transcription data
-            transcription_response = s3.get_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=output_key)
-            transcription_data = json.loads(transcription_response['Body'].read().decode('utf-8'))
-
-            transcription_text = transcription_data['results']['transcripts'][0]['transcript']
-            print(f"Transcription completed: {transcription_text}")
-            return transcription_text
-        elif status == 'FAILED':
-            print(f"Transcription job {job_name} failed.")
-            return "Transcription failed."
-        else:
-            print(f"Transcription job {job_name} is still in progress. Status: {status}")
-            return "Transcribing..."
-
-    except Exception as e:
-        print(f"Error checking transcription job: {e}")
-        return None
-
 def refresh_transcription_status(request, job_name, file_id):
-    upload = get_object_or_404(Upload, id=file_id)
-
-    output_key = upload.output_key
+    upload = get_object_or_404(Upload, id=file_id, transcription_job_name=job_name)
 
-    transcribe_client = boto3.client('transcribe', region_name=AWS_S3_REGION_NAME)
-    transcription_text = check_transcription_job(transcribe_client, job_name, output_key)
+    # Kept up to date by the poll_transcriptions worker
+    transcription_text = get_transcription_text(upload)
 
     response = {
         "status": "completed" if transcription_text not in ["Transcribing...", None] else transcription_text,
@@ -785,6 +898,31 @@ def refresh_transcription_status(request, job_name, file_id):
     }
     return JsonResponse(response)
 
+@login_required
+def search_transcripts(request):
+    search_query = request.GET.get('q', '').strip()
+    project_id = request.GET.get('project_id')
+    if project_id and not project_id.isdigit():
+        return HttpResponseBadRequest("Invalid project.")
+
+    # Only search projects whose files the user is allowed to open
+    is_pma_admin = user_is_pma_admin(request.user)
+    projects = Project.objects.accessible_to(request.user, is_pma_admin)
+    selected_project = None
+    if project_id:
+        selected_project = get_object_or_404(projects, id=project_id)
+        projects = projects.filter(id=selected_project.id)
+
+    results = []
+    if search_query:
+        results = rank_transcripts(Upload.objects.filter(project__in=projects), search_query)
+
+    return render(request, 'search_transcripts.html', {
+        'results': results,
+        'search_query': search_query,
+        'selected_project': selected_project,
+    })
+
 @login_required
 def search_users(request):
     # Get the search query and project_id from the request
@@ -797,8 +935,13 @@ def search_users(request):
         selected_project = get_object_or_404(Project, id=project_id)
 
 
-    # Get all users except the logged-in user and django admin users
-    users = User.objects.exclude(id=request.user.id)
+    # Get all users except the logged-in user and django admin users, with their
+    # profile and PMA admin status loaded in the same query
+    users = User.objects.exclude(id=request.user.id).select_related('profile').annotate(
+        is_pma_admin=Exists(
+            User.groups.through.objects.filter(user_id=OuterRef('id'), group__name=PMA_ADMIN_GROUP)
+        )
+    )
 
     # remove django admin users
     users = users.exclude(is_staff=True)  # exclude staff status accounts
@@ -806,10 +949,12 @@ def search_users(request):
 
     # Exclude users who are already members of the selected project
     if selected_project:
-        users = users.exclude(id__in=selected_project.members.values_list('id', flat=True))
+        users = users.exclude(
+            Exists(Project.members.through.objects.filter(project_id=selected_project.id, user_id=OuterRef('id')))
+        )
 
     if search_query:
-        # Filter users by username, full name, or bio
+        # Filter users by username, full name, or bio (trigram indexed on PostgreSQL)
         users = users.filter(
             Q(username__icontains=search_query) |
             Q(first_name__icontains=search_query) |
@@ -817,11 +962,17 @@ def search_users(request):
             Q(profile__bio__icontains=search_query)
         )
 
+    # Only render one page of matches at a time
+    users, next_cursor = keyset_page(users, USER_SORT, request.GET.get('cursor'), USER_PAGE_SIZE)
+
     context = {
         'users': users,
         'search_query': search_query,
         "project_id": project_id,
         "selected_project": selected_project,
+        'viewer_is_admin': user_is_pma_admin(request.user),
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
     }
     return render(request, 'search_users.html', context)
 
@@ -865,7 +1016,12 @@ def manage_invites(request):
 @login_required
 def select_project_for_invite(request, user_id):
     invited_user = get_object_or_404(User, id=user_id)
-    user_projects = Project.objects.filter(owner=request.user)
+    # Membership is annotated so the page doesn't load every project's members
+    user_projects = Project.objects.filter(owner=request.user).annotate(
+        invited_user_is_member=Exists(
+            Project.members.through.objects.filter(project_id=OuterRef('id'), user_id=invited_user.id)
+        )
+    )
     
     return render(request, 'select_project.html', {
         'invited_user': invited_user,
@@ -887,20 +1043,23 @@ def handle_invitation(request, invitation_id):
         action = request.POST.get('action')
 
         if action == 'accept':
-            # Add user to project members
-            invitation.project.members.add(request.user)
-
-            # Accept the invitation
-            invitation.status = 'ACCEPTED'
-            invitation.response_date = datetime.now()
-            invitation.save()
-
-            # Check for existing join requests and resolve them
-            JoinRequest.objects.filter(
-                project=invitation.project,
-                user=request.user,
-                status='pending'
-            ).update(status='accepted')
+            with transaction.atomic():
+                # Add user to project members (this also updates member_count)
+                invitation.project.members.add(request.user)
+
+                # Accept the invitation
+                invitation.status = 'ACCEPTED'
+                invitation.response_date = datetime.now()
+                invitation.save()
+
+                # Check for existing join requests and resolve them
+                JoinRequest.objects.filter(
+                    project=invitation.project,
+                    user=request.user,
+                    status='pending'
+                ).update(status='accepted')
+                # update() skips the signals that refresh the navbar badges
+                forget_badge_counts([request.user.id, invitation.project.owner_id])
 
             messages.success(request, f'You have joined {invitation.project.name}.',
                              extra_tags='invite-response')
@@ -930,66 +1089,50 @@ def invitation_list(request):
 
 @login_required
 def upvote_project(request, project_id):
-    project = get_object_or_404(Project, id=project_id)
-    
-    # Check if the user has already upvoted
-    if request.user in project.upvoters.all():
-        # If already upvoted, subtract the upvote and remove the user from upvoters
-        project.upvotes -= 1
-        project.upvoters.remove(request.user)
-        project.save()
-        return JsonResponse({'status': 'removed', 'upvotes': project.upvotes})
-    else:
-        # If not upvoted, add the upvote and add the user to upvoters
-        project.upvotes += 1
-        project.upvoters.add(request.user)
-        project.save()
-        return JsonResponse({'status': 'added', 'upvotes': project.upvotes})
+    # Toggle the upvote with a row insert/delete and an F() update instead of loading every upvoter
+    try:
+        added, upvotes = toggle_upvote(project_id, request.user)
+    except Project.DoesNotExist:
+        raise Http404("No Project matches the given query.")
+    return JsonResponse({'status': 'added' if added else 'removed', 'upvotes': upvotes})
 
 @login_required
 def popular_projects(request):
-    projects = Project.objects.annotate(
+    # Latest upload per project is resolved by a correlated subquery instead of a query per card
+    latest_upload = Upload.objects.filter(project=OuterRef('pk')).order_by('-uploaded_at', '-id')
+    projects = Project.objects.filter(is_private=False).select_related('owner').with_user_status(request.user).annotate(
         user_has_upvoted=Exists(
             Project.upvoters.through.objects.filter(
                 user_id=request.user.id, project_id=OuterRef('id')
             )
-        )
-    ).order_by('-upvotes')  
+        ),
+        latest_upload_id=Subquery(latest_upload.values('id')[:1]),
+    )
+    projects, next_cursor = keyset_page(projects, POPULAR_PROJECT_SORT, request.GET.get('cursor'))
 
-    s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
-    bucket_name = AWS_STORAGE_BUCKET_NAME
+    # Load the latest uploads for this page in one query
+    latest_uploads = Upload.objects.in_bulk(
+        [project.latest_upload_id for project in projects if project.latest_upload_id]
+    )
 
+    # Cards show a small rendition of the latest upload, never the original, and like on
+    # the project page only to people who may open the files
+    is_pma_admin = user_is_pma_admin(request.user)
+    viewable = []
     for project in projects:
-        project.pending_request = JoinRequest.objects.filter(user=request.user, project=project, status='pending').exists()
-        project.latest_upload = Upload.objects.filter(project=project).order_by('-uploaded_at').first()
-
+        project.pending_request = project.user_has_pending_request
+        project.latest_upload = latest_uploads.get(project.latest_upload_id)
         if project.latest_upload:
-            upload = project.latest_upload
-            file_key = f"{project.name}/{upload.file}"  
-
-            mime_type, _ = mimetypes.guess_type(file_key)
-
-            if mime_type not in ['image/jpeg', 'text/plain', 'application/pdf', 'video/mp4']:
-                disposition_type = 'attachment'
-            else:
-                disposition_type = 'inline'
-
-            file_url = s3.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': bucket_name,
-                    'Key': file_key,
-                    'ResponseContentType': mime_type,
-                    'ResponseContentDisposition': disposition_type
-                },
-                ExpiresIn=3600
-            )
-
-            upload.signed_url = file_url
-            file_type, _ = mimetypes.guess_type(project.latest_upload.file.name)
-            project.latest_upload.file_type = file_type
-        
-    return render(request, 'popular_projects.html', {'projects': projects})
+            project.latest_upload.thumbnail_url = None
+            if project.user_is_member or project.owner_id == request.user.id or is_pma_admin:
+                viewable.append(project.latest_upload)
+    attach_thumbnails(viewable)
+
+    return render(request, 'popular_projects.html', {
+        'projects': projects,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+    })
 
 @login_required
 def upload_project_files(request, project_name, id):
@@ -999,7 +1142,7 @@ def upload_project_files(request, project_name, id):
         return redirect('project_list')
 
     if request.method == 'POST' and request.user == project.owner:
-        s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
+        storage = get_storage()
 
         try:
             # Handle rubric upload
@@ -1009,17 +1152,14 @@ def upload_project_files(request, project_name, id):
                 
                 if project.rubric:
                     try:
-                        s3.delete_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=project.rubric.name)
+                        storage.delete(project.rubric.name)
+                        forget_presigned_urls(project.rubric.name)
                         print('Old rubric deleted from S3.')
                     except Exception as e:
                         print(f'Error deleting old rubric: {e}')
 
-                # Upload to S3
-                s3.upload_fileobj(
-                    rubric_file,
-                    AWS_STORAGE_BUCKET_NAME,
-                    f'{project_name}/rubrics/{rubric_file.name}'
-                )
+                # Upload to storage
+                storage.save(f'{project_name}/rubrics/{rubric_file.name}', rubric_file)
                 
                 # Update project model
                 project.rubric = f'{project_name}/rubrics/{rubric_file.name}'
@@ -1032,23 +1172,20 @@ def upload_project_files(request, project_name, id):
                 
                 if project.review_guidelines:
                     try:
-                        s3.delete_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=project.review_guidelines.name)
+                        storage.delete(project.review_guidelines.name)
+                        forget_presigned_urls(project.review_guidelines.name)
                         print('Old review guidelines deleted from S3.')
                     except Exception as e:
                         print(f'Error deleting old review guidelines: {e}')
                 
-                # Upload to S3
-                s3.upload_fileobj(
-                    guidelines_file,
-                    AWS_STORAGE_BUCKET_NAME,
-                    f'{project_name}/guidelines/{guidelines_file.name}'
-                )
+                # Upload to storage
+                storage.save(f'{project_name}/guidelines/{guidelines_file.name}', guidelines_file)
                 
                 # Update project model
                 project.review_guidelines = f'{project_name}/guidelines/{guidelines_file.name}'
                 print('Guidelines upload successful!')
 
-            project.save()
+            project.save(update_fields=['rubric', 'review_guidelines'])
             messages.success(request, 'Files uploaded successfully!')
 
         except Exception as e:
@@ -1062,9 +1199,8 @@ def delete_project_resources(request, project_name, id, resource_type):
     project = get_object_or_404(Project, id=id, name=project_name)
 
     # Check if the user has permissions to delete the file
-    if project.owner == request.user or request.user.groups.filter(name='PMA Administrators').exists() or file_obj_owner:
-        s3 = boto3.client('s3', region_name=AWS_S3_REGION_NAME)
-        bucket_name = AWS_STORAGE_BUCKET_NAME
+    if project.owner == request.user or user_is_pma_admin(request.user) or file_obj_owner:
+        storage = get_storage()
 
         # Determine the resource type (rubric or review_guidelines)
         if resource_type == 'rubric':
@@ -1080,7 +1216,8 @@ def delete_project_resources(request, project_name, id, resource_type):
         # Delete the file from S3
         if file_field:
             try:
-                s3.delete_object(Bucket=bucket_name, Key=str(file_field))
+                storage.delete(str(file_field))
+                forget_presigned_urls(str(file_field))
                 print(f"Deleted {file_field} from S3.")
             except Exception as e:
                 print(f"Error deleting file from S3: {e}")
@@ -1088,7 +1225,7 @@ def delete_project_resources(request, project_name, id, resource_type):
                 return redirect('project_main_view', project_name=project.name, id=project.id)
 
         # Save project changes
-        project.save()
+        project.save(update_fields=[resource_type])
         messages.success(request, "Resource deleted successfully.")
         return redirect('project_main_view', project_name=project.name, id=project.id)
 from allauth.socialaccount.models import SocialAccount
@@ -1134,8 +1271,10 @@ def edit_project(request, project_id):
         # Create form with POST data and existing project instance
         form = ProjectEditForm(request.POST, request.FILES, instance=project)
         if form.is_valid():
-            # Save the form
-            project = form.save()
+            # Save only the edited fields. The counters and search vector are kept up to date
+            # with update() calls, which this copy of the project may not have seen
+            project = form.save(commit=False)
+            project.save(update_fields=ProjectEditForm.Meta.fields)
            
             # Optional: Add success message
             messages.success(request, f'Project "{project.name}" updated successfully.')